@@ -1,4 +1,3 @@
-import asyncio
 import logging
 from enum import IntEnum, unique
 from typing import cast
@@ -8,7 +7,7 @@ import smp.message as smpmsg
 import typer
 from rich import print
 
-from smpmgr.common import Options, connect_with_spinner, get_smpclient
+from smpmgr.common import Options, connect_with_spinner, get_smpclient, run
 
 app = typer.Typer(name="another", help="Another user group 89")
 logger = logging.getLogger(__name__)
@@ -79,7 +78,7 @@ def write(ctx: typer.Context, message: str) -> None:
         r = await smpclient.request(AnotherWrite(d=message))
         print(r)
 
-    asyncio.run(f())
+    run(f())
 
 
 @app.command()
@@ -95,4 +94,4 @@ def read(ctx: typer.Context) -> None:
         r = await smpclient.request(AnotherRead())
         print(r)
 
-    asyncio.run(f())
+    run(f())
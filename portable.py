@@ -45,6 +45,7 @@ try:
                 "--copy-metadat=smpmgr",
                 "--copy-metadata=readchar",
                 "--name=smpmgr",
+                "--collect-submodules=smpmgr",  # the subcommands are imported lazily by name
                 "--collect-submodules=shellingham",
                 "--collect-submodules=readchar",
                 "--hidden-import=readchar",
@@ -67,6 +68,12 @@ try:
         not in subprocess.run(["dist/smpmgr/smpmgr", "--help"], capture_output=True).stdout.decode()
     )
 
+    # check that the lazily imported subcommands were bundled
+    for command in (("os", "echo"), ("image", "state-read"), ("upgrade",), ("file", "sync")):
+        result = subprocess.run(["dist/smpmgr/smpmgr", *command, "--help"], capture_output=True)
+        assert result.returncode == 0, result.stderr.decode()
+        assert "Usage" in result.stdout.decode()
+
     platform_system: Final = platform.system().lower()
     platform_name: Final = "macos" if platform_system == "darwin" else platform_system
 
@@ -0,0 +1,137 @@
+"""The run command, which runs a script of `smpmgr` commands over one connection."""
+
+import logging
+import shlex
+import time
+from dataclasses import dataclass
+from typing import Callable, Final, Sequence, cast
+
+import typer
+from rich import print
+from rich.table import Table
+from typing_extensions import Annotated
+
+from smpmgr.common import Options, Session
+
+logger: Final = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Step:
+    """One command of a script."""
+
+    line: int
+    args: list[str]
+
+
+@dataclass(frozen=True)
+class StepResult:
+    """The outcome of one `Step`."""
+
+    step: Step
+    exit_code: int
+    duration_s: float
+
+
+def parse_script(text: str) -> list[Step]:
+    """Parse one command per line of `text`, ignoring blank lines and `#` comments.
+
+    Each line is split like a shell would, e.g. `shell "echo hello"`, and may start with global
+    options, e.g. `--timeout 10 image upload app.bin`.
+
+    Raises:
+        typer.BadParameter: if a line cannot be split
+    """
+
+    steps: Final = []
+    for number, line in enumerate(text.splitlines(), start=1):
+        try:
+            args = shlex.split(line, comments=True)
+        except ValueError as e:
+            raise typer.BadParameter(f"line {number}: {e}", param_hint="SCRIPT")
+        if args:
+            steps.append(Step(number, args))
+    return steps
+
+
+def run_steps(
+    steps: Sequence[Step], invoke: Callable[[list[str]], None], keep_going: bool
+) -> list[StepResult]:
+    """Run each of `steps` with `invoke`, stopping at the first failure unless `keep_going`.
+
+    `invoke` runs a command like `app(args)` does, i.e. it ends with `SystemExit`.  Other
+    exceptions, e.g. the `RuntimeError` of a nested `interactive` or `run`, fail the step.
+    """
+
+    results: Final = []
+    for step in steps:
+        print(f"[bold]{step.line}: smpmgr {shlex.join(step.args)}[/bold]")
+        start = time.monotonic()
+        try:
+            invoke(step.args)
+            exit_code = 0
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+        except Exception as e:
+            logger.error(f"Step {step.line} failed: {e.__class__.__name__} - {e}")
+            exit_code = 1
+        results.append(StepResult(step, exit_code, time.monotonic() - start))
+        if exit_code != 0 and not keep_going:
+            logger.error(f"Stopping at line {step.line} with exit code {exit_code}")
+            break
+    return results
+
+
+def print_summary(steps: Sequence[Step], results: Sequence[StepResult]) -> None:
+    """Print the result and duration of each step, including those that were not run."""
+
+    table: Final = Table(title="Script Summary")
+    table.add_column("Line", justify="right")
+    table.add_column("Command", style="cyan")
+    table.add_column("Result")
+    table.add_column("Time (s)", justify="right")
+
+    for r in results:
+        table.add_row(
+            str(r.step.line),
+            shlex.join(r.step.args),
+            "[green]OK[/green]" if r.exit_code == 0 else f"[red]FAIL ({r.exit_code})[/red]",
+            f"{r.duration_s:.3f}",
+        )
+    for step in steps[len(results) :]:
+        table.add_row(str(step.line), shlex.join(step.args), "[dim]skipped[/dim]", "")
+
+    print(table)
+    print(f"Total: {sum(r.duration_s for r in results):.3f} s")
+
+
+def run_script(
+    ctx: typer.Context,
+    script: Annotated[
+        typer.FileText,
+        typer.Argument(help="File of smpmgr commands, one per line, or - for stdin"),
+    ],
+    keep_going: Annotated[
+        bool,
+        typer.Option("--keep-going", help="Run the remaining commands after a command fails."),
+    ] = False,
+) -> None:
+    """Run a script of smpmgr commands over one connection.
+
+    Each line is a command as it would be given to smpmgr, e.g. `os echo hello`, and `#` starts a
+    comment.  The commands share one connection and event loop, like the interactive shell, so
+    the connection is only made once.  The script stops at the first command that fails unless
+    --keep-going is given.  The time of each command is summarized at the end.
+    """
+
+    steps: Final = parse_script(script.read())
+
+    from smpmgr.main import app
+
+    with Session() as session:
+        session.resolve(cast(Options, ctx.obj))  # e.g. smpmgr --port COM1 run script.txt
+        results: Final = run_steps(steps, lambda args: app(args, prog_name="smpmgr"), keep_going)
+
+    print_summary(steps, results)
+    if any(r.exit_code != 0 for r in results):
+        raise typer.Exit(code=1)
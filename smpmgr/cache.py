@@ -0,0 +1,52 @@
+"""Small JSON caches kept in the user's application directory."""
+
+import json
+import logging
+import os
+from contextlib import suppress
+from pathlib import Path
+from typing import Any, Final
+
+import typer
+
+logger: Final = logging.getLogger(__name__)
+
+APP_NAME: Final = "smpmgr"
+
+
+def cache_path(name: str) -> Path:
+    """Return the path of the cache file `name`, e.g. `plugins.json`.
+
+    The directory can be overridden with the `SMPMGR_CACHE_DIR` environment variable.
+    """
+
+    return Path(os.environ.get("SMPMGR_CACHE_DIR") or typer.get_app_dir(APP_NAME)) / name
+
+
+def load(name: str) -> dict[str, Any]:
+    """Return the contents of the cache `name`, or an empty `dict` if it is missing or corrupt."""
+
+    path: Final = cache_path(name)
+    try:
+        data: Final = json.loads(path.read_text())
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.debug(f"Ignoring unreadable cache {path}: {e}")
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save(name: str, data: dict[str, Any]) -> None:
+    """Atomically replace the cache `name` with `data`; failures are logged and ignored."""
+
+    path: Final = cache_path(name)
+    tmp: Final = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp.write_text(json.dumps(data, indent=1, sort_keys=True))
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.debug(f"Could not write the cache {path}: {e}")
+        with suppress(OSError):
+            tmp.unlink(missing_ok=True)
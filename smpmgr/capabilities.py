@@ -0,0 +1,222 @@
+"""The SMP groups that each device supports, from the enumeration group.
+
+The groups are read with `ListSupportedGroups` the first time that `connect_with_spinner()`
+connects to a device, and cached by the device's address along with the hash of its running
+image.  Later runs use the cache without asking the device again, so a request to a group that
+the device does not support fails at once rather than after a timeout.  Each entry is read from
+the cache file once per process and then kept in memory.
+
+Before a request is refused, one `ImageStatesRead` checks that the device still runs the image
+that the groups were read from; if not, or if that image is not known, the groups are read
+again.  The entry of a device is also dropped when its image states show a different running
+image, or when an image is marked for the next boot.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Final, Iterable
+
+import typer
+from smp import header as smphdr
+from smp.image_management import ImageStatesReadResponse
+from smpclient import SMPClient
+from smpclient.generics import error, success
+from smpclient.requests.enumeration_management import ListSupportedGroups
+from smpclient.requests.image_management import ImageStatesRead
+
+from smpmgr import cache
+from smpmgr.common import try_request
+from smpmgr.timing import group_name
+
+logger: Final = logging.getLogger(__name__)
+
+CACHE: Final = "capabilities.json"
+"""The name of the capability cache in the cache directory."""
+PROBE_TIMEOUT_S: Final = 0.5
+"""How long to wait for `ListSupportedGroups` on the first connection to a device.
+
+A device with the enumeration group answers at once, while some without it never answer.
+"""
+
+
+@dataclass(frozen=True)
+class Capabilities:
+    """What a device supports, as of the running image with `image_hash`."""
+
+    groups: frozenset[int] | None
+    """The supported groups, or `None` if the device does not support the enumeration group."""
+    image_hash: str | None = None
+    """The hex hash of the running image, or `None` if it is not known yet."""
+
+    def supports(self, group_id: int) -> bool:
+        """Return `False` only if `group_id` is known to be unsupported.
+
+        The enumeration group is always allowed, since it is how the groups are read again.
+        """
+
+        return (
+            self.groups is None
+            or group_id in self.groups
+            or group_id == smphdr.GroupId.ENUM_MANAGEMENT
+        )
+
+
+_entries: Final[dict[str, Capabilities | None]] = {}
+"""The entries that this process has read or written, by address, so that the cache file is
+read once per device rather than before every request."""
+
+
+def get(address: str) -> Capabilities | None:
+    """Return the cached `Capabilities` of the device at `address`, or `None` if there are none."""
+
+    if address not in _entries:
+        _entries[address] = _load(address)
+    return _entries[address]
+
+
+def _load(address: str) -> Capabilities | None:
+    entry: Final = cache.load(CACHE).get(address)
+    if not isinstance(entry, dict):
+        return None
+    groups: Final = entry.get("groups")
+    image_hash: Final = entry.get("image_hash")
+    return Capabilities(
+        frozenset(groups) if isinstance(groups, list) else None,
+        image_hash if isinstance(image_hash, str) else None,
+    )
+
+
+def save(address: str, capabilities: Capabilities) -> None:
+    """Cache the `capabilities` of the device at `address`."""
+
+    _entries[address] = capabilities
+    entries: Final = cache.load(CACHE)
+    entries[address] = {
+        "groups": sorted(capabilities.groups) if capabilities.groups is not None else None,
+        "image_hash": capabilities.image_hash,
+    }
+    cache.save(CACHE, entries)
+
+
+def forget(address: str) -> None:
+    """Drop the cached capabilities of the device at `address`, e.g. after marking an image."""
+
+    _entries[address] = None
+    entries: Final = cache.load(CACHE)
+    if entries.pop(address, None) is not None:
+        logger.info(f"Dropped the cached capabilities of {address}")
+        cache.save(CACHE, entries)
+
+
+def save_groups(address: str, groups: Iterable[int]) -> None:
+    """Cache the `groups` of the device at `address`, keeping its running image if known."""
+
+    capabilities: Final = get(address)
+    save(
+        address,
+        Capabilities(frozenset(groups), capabilities.image_hash if capabilities else None),
+    )
+
+
+def supports(address: str, group_id: int) -> bool:
+    """Return `False` only if the device at `address` is known not to support `group_id`."""
+
+    capabilities: Final = get(address)
+    return capabilities is None or capabilities.supports(group_id)
+
+
+async def require(smpclient: SMPClient, group_id: int) -> None:
+    """Raise `typer.Exit` if the device of `smpclient` does not support `group_id`.
+
+    The cached groups are trusted only if the device still runs the image that they were read
+    from, otherwise they are read again.
+    """
+
+    address: Final = smpclient.address
+    if supports(address, group_id):
+        return
+    if not await _runs_cached_image(smpclient):
+        logger.info(f"The cached groups of {address} may be out of date, reading them again")
+        forget(address)
+        capabilities: Final = await read_capabilities(smpclient)
+        if capabilities is None or capabilities.supports(group_id):
+            return
+    logger.error(
+        f"The device does not support the {group_name(group_id)} group.  If its firmware "
+        "has changed, read its groups again with 'smpmgr enum get-supported-groups'."
+    )
+    raise typer.Exit(code=1)
+
+
+async def _runs_cached_image(smpclient: SMPClient) -> bool:
+    """Return `True` if the device runs the image that its cached groups were read from."""
+
+    capabilities: Final = get(smpclient.address)
+    if capabilities is None or capabilities.image_hash is None:
+        return False
+    states: Final = await try_request(smpclient, ImageStatesRead())
+    return (
+        states is not None
+        and success(states)
+        and running_image_hash(states) == capabilities.image_hash
+    )
+
+
+def running_image_hash(r: ImageStatesReadResponse) -> str | None:
+    """Return the hex hash of the running image of the first image in `r`, if any."""
+
+    for image in r.images:
+        if image.active and image.image in (None, 0) and image.hash is not None:
+            return image.hash.hex()
+    return None
+
+
+def note_image_states(address: str, r: ImageStatesReadResponse) -> None:
+    """Drop the cached capabilities of the device at `address` if it runs another image now.
+
+    Groups that were read without the running image, e.g. by `discover`, are left unverified,
+    since the image that they were read from is not known.
+    """
+
+    capabilities: Final = get(address)
+    if capabilities is None or capabilities.image_hash is None:  # e.g. read by `discover`
+        return
+    if running_image_hash(r) != capabilities.image_hash:
+        logger.info(f"{address} runs a different image than when its groups were read")
+        forget(address)
+
+
+async def read_capabilities(smpclient: SMPClient) -> Capabilities | None:
+    """Read the groups and running image of the device of `smpclient`, and cache them.
+
+    A device that does not answer `ListSupportedGroups` within `PROBE_TIMEOUT_S` is cached with
+    unknown groups, so that it is not asked again.  Returns `None`, without caching, if the
+    connection fails.
+    """
+
+    try:
+        groups: Final = await try_request(
+            smpclient, ListSupportedGroups(), min(PROBE_TIMEOUT_S, smpclient._timeout_s)
+        )
+        states: Final = (
+            await try_request(smpclient, ImageStatesRead())
+            if groups is None
+            or not success(groups)
+            or smphdr.GroupId.IMAGE_MANAGEMENT in groups.groups
+            else None
+        )
+    except Exception as e:
+        logger.info(f"Could not read the capabilities: {e.__class__.__name__} - {e}")
+        return None
+    image_hash: Final = (
+        running_image_hash(states) if states is not None and success(states) else None
+    )
+
+    if groups is not None and error(groups):
+        logger.info(f"{smpclient.address} does not support the enumeration group: {groups}")
+    capabilities: Final = Capabilities(
+        frozenset(groups.groups) if groups is not None and success(groups) else None, image_hash
+    )
+    logger.info(f"Caching the capabilities of {smpclient.address}: {capabilities}")
+    save(smpclient.address, capabilities)
+    return capabilities
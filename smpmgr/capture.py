@@ -0,0 +1,172 @@
+"""Timestamped capture of terminal output to a file."""
+
+import gzip
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from types import TracebackType
+from typing import IO, Final, Type
+
+logger: Final = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_S: Final = 1.0
+"""How often the capture file is flushed while the device is idle."""
+BUFFER_SIZE: Final = 1 << 20
+"""The size of the capture file's write buffer."""
+MAX_QUEUED: Final = 4096
+"""How many writes may wait for the writer thread before `Capture.write()` drops them."""
+
+_LINE: Final = re.compile(r"[^\n]*\n|[^\n]+")
+
+
+class CaptureError(Exception):
+    """Raised when the capture file can no longer be written, e.g. because the disk is full."""
+
+
+class Capture:
+    """Write text to `path`, prefixing each line with the time that it was received.
+
+    `write()` only puts the text on a queue; a background thread formats and writes it, so the
+    caller is never blocked by the disk.  If the thread falls `MAX_QUEUED` writes behind, further
+    writes are dropped, and a line in the file and a warning on closing say how many.  If the
+    thread fails, the next `write()`, or leaving the context, raises a `CaptureError`.
+
+    If `max_bytes` is not 0, the file is rotated at the end of the line that reaches it, keeping
+    `backups` old files named `<path>.1` (the newest) to `<path>.<backups>`, gzipped if
+    `compress` is `True`.
+    """
+
+    def __init__(
+        self, path: Path, max_bytes: int = 0, backups: int = 5, compress: bool = False
+    ) -> None:
+        self._path: Final = path
+        self._max_bytes: Final = max_bytes
+        self._backups: Final = backups
+        self._compress: Final = compress
+        self._queue: Final[queue.Queue[tuple[float, str] | int | None]] = queue.Queue(MAX_QUEUED)
+        self._thread: Final = threading.Thread(target=self._run, name="capture", daemon=True)
+        self._file: IO[bytes] | None = None
+        self._size = 0
+        self._error: Exception | None = None
+        self._dropped = 0  # since the last marker line
+        self._dropped_total = 0
+
+    def __enter__(self) -> "Capture":
+        self._open()
+        self._thread.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        for item in ([self._dropped] if self._dropped else []) + [None]:
+            while self._error is None:  # the writer may be behind, or may have just failed
+                try:
+                    self._queue.put(item, timeout=FLUSH_INTERVAL_S)
+                    break
+                except queue.Full:
+                    continue
+        self._thread.join()
+        if self._dropped_total:
+            logger.warning(
+                f"Dropped {self._dropped_total} writes to {self._path}, the disk could not keep up"
+            )
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError as e:
+                self._error = self._error or e
+        if self._error is not None and exc_type is None:
+            raise CaptureError(f"Could not write {self._path}: {self._error}") from self._error
+
+    def write(self, text: str) -> None:
+        """Queue `text` to be written with the current time; never blocks.
+
+        The text is dropped if the queue is full.  Raises `CaptureError` if the writer thread has
+        failed.
+        """
+
+        if self._error is not None:
+            raise CaptureError(f"Could not write {self._path}: {self._error}") from self._error
+        try:
+            if self._dropped:
+                self._queue.put_nowait(self._dropped)
+                self._dropped = 0
+            self._queue.put_nowait((time.time(), text))
+        except queue.Full:
+            self._dropped += 1
+            self._dropped_total += 1
+
+    def _open(self) -> None:
+        self._file = open(self._path, "ab", buffering=BUFFER_SIZE)
+        self._size = self._file.tell()
+
+    def _run(self) -> None:
+        try:
+            self._write_queued()
+        except Exception as e:
+            logger.debug(f"The capture writer failed: {e.__class__.__name__} - {e}")
+            self._error = e
+
+    def _write_queued(self) -> None:
+        at_line_start = True
+        while True:
+            try:
+                item = self._queue.get(timeout=FLUSH_INTERVAL_S)
+            except queue.Empty:
+                assert self._file is not None
+                self._file.flush()
+                continue
+            if item is None:
+                return
+
+            if isinstance(item, int):
+                timestamp = time.time()
+                text = ("" if at_line_start else "\n") + f"<dropped {item} writes>\n"
+            else:
+                timestamp, text = item
+            prefix = f"[{datetime.fromtimestamp(timestamp).isoformat(timespec='milliseconds')}] "
+            for match in _LINE.finditer(text):
+                line = match.group()
+                data = ((prefix if at_line_start else "") + line).encode()
+                assert self._file is not None
+                self._file.write(data)
+                self._size += len(data)
+                at_line_start = line.endswith("\n")
+                if at_line_start and self._max_bytes and self._size >= self._max_bytes:
+                    self._rotate()
+
+    def _rotate(self) -> None:
+        assert self._file is not None
+        self._file.close()
+
+        suffix: Final = ".gz" if self._compress else ""
+        for i in range(self._backups - 1, 0, -1):
+            older = self._path.with_name(f"{self._path.name}.{i}{suffix}")
+            if older.exists():
+                os.replace(older, self._path.with_name(f"{self._path.name}.{i + 1}{suffix}"))
+
+        try:
+            if self._backups == 0:
+                self._path.unlink()
+            elif self._compress:
+                with open(self._path, "rb") as src, gzip.open(
+                    self._path.with_name(f"{self._path.name}.1.gz"), "wb"
+                ) as dst:
+                    shutil.copyfileobj(src, dst)
+                self._path.unlink()
+            else:
+                os.replace(self._path, self._path.with_name(f"{self._path.name}.1"))
+        except OSError as e:
+            logger.error(f"Could not rotate {self._path}: {e}")
+
+        self._open()
@@ -2,18 +2,34 @@
 
 import asyncio
 import logging
-from dataclasses import dataclass, fields
-from typing import Type, TypedDict, TypeVar
+import mmap
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass, fields, replace
+from io import BufferedReader
+from types import TracebackType
+from typing import (
+    Any,
+    Coroutine,
+    Final,
+    Iterator,
+    Literal,
+    Sequence,
+    Type,
+    TypedDict,
+    TypeVar,
+    cast,
+)
 
 import typer
+from pydantic import ValidationError
 from rich.progress import Progress, SpinnerColumn, TextColumn
 from serial import SerialException
+from smp import header as smphdr
 from smp.exceptions import SMPBadStartDelimiter
 from smpclient import SMPClient
 from smpclient.generics import SMPRequest, TEr1, TEr2, TRep
-from smpclient.transport.ble import SMPBLETransport
-from smpclient.transport.serial import SMPSerialTransport
-from smpclient.transport.udp import SMPUDPTransport
+from smpclient.transport import SMPTransport, SMPTransportDisconnected
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +37,14 @@ TSMPClient = TypeVar(
     "TSMPClient",
     bound=SMPClient,
 )
+T = TypeVar("T")
+
+SERIAL_DEPTH: Final = 1
+"""The default number of requests in flight over a serial transport.
+
+The buffer count that the SMP server reports is of its MCUmgr buffers, but Zephyr's UART
+transport has fewer receive buffers of its own, 2 by default.
+"""
 
 
 @dataclass(frozen=True)
@@ -34,7 +58,7 @@ class TransportDefinition:
 class Options:
     timeout: float
     transport: TransportDefinition
-    mtu: int | None
+    mtu: int | Literal["auto"] | None
     baudrate: int | None
 
 
@@ -45,35 +69,57 @@ class SMPSerialTransportKwargs(TypedDict, total=False):
     baudrate: int
 
 
-def get_custom_smpclient(options: Options, smp_client_cls: Type[TSMPClient]) -> TSMPClient:
-    """Return an `SMPClient` subclass to the chosen transport or raise `typer.Exit`."""
+def get_transport(options: Options) -> SMPTransport:
+    """Return an `SMPTransport` for the chosen transport or raise `typer.Exit`.
+
+    Only the chosen transport is imported; e.g. the BLE transport's dependencies are slow to
+    import and not needed for serial or UDP.  With `--mtu auto`, the MTU cached for the target is
+    used, see `smpmgr.mtu`.  With `--timing`, the transport's round trips are recorded, see
+    `smpmgr.timing`.
+    """
+    from smpmgr import timing
+
+    transport: Final = _new_transport(options)
+    if timing.active():
+        timing.instrument(transport)
+    return transport
+
+
+def _new_transport(options: Options) -> SMPTransport:
+    mtu: int | None
+    if options.mtu == "auto":
+        from smpmgr.mtu import cached_mtu
+
+        mtu = cached_mtu(options)
+        logger.info(f"Using the cached MTU of the target, {mtu=}")
+    else:
+        mtu = options.mtu
+
     if options.transport.port is not None:
-        logger.info(
-            f"Initializing SMPClient with the SMPSerialTransport, {options.transport.port=}"
-        )
+        from smpclient.transport.serial import SMPSerialTransport
+
+        logger.info(f"Initializing the SMPSerialTransport, {options.transport.port=}")
         kwargs: SMPSerialTransportKwargs = {}
-        if options.mtu is not None:
-            kwargs['max_smp_encoded_frame_size'] = options.mtu
-            kwargs['line_length'] = options.mtu
+        if mtu is not None:
+            kwargs['max_smp_encoded_frame_size'] = mtu
+            kwargs['line_length'] = mtu
             kwargs['line_buffers'] = 1
         if options.baudrate is not None:
             kwargs['baudrate'] = options.baudrate
-        return smp_client_cls(SMPSerialTransport(**kwargs), options.transport.port, options.timeout)
+        return SMPSerialTransport(**kwargs)
     elif options.transport.ble is not None:
-        logger.info(f"Initializing SMPClient with the SMPBLETransport, {options.transport.ble=}")
-        return smp_client_cls(
-            SMPBLETransport(),
-            options.transport.ble,
-            options.timeout,
-        )
+        from smpclient.transport.ble import SMPBLETransport
+
+        logger.info(f"Initializing the SMPBLETransport, {options.transport.ble=}")
+        return SMPBLETransport()
     elif options.transport.ip is not None:
-        logger.info(f"Initializing SMPClient with the SMPUDPTransport, {options.transport.ip=}")
-        if options.mtu is not None:
-            return smp_client_cls(
-                SMPUDPTransport(mtu=options.mtu), options.transport.ip, options.timeout
-            )
+        from smpclient.transport.udp import SMPUDPTransport
+
+        logger.info(f"Initializing the SMPUDPTransport, {options.transport.ip=}")
+        if mtu is not None:
+            return SMPUDPTransport(mtu=mtu)
         else:
-            return smp_client_cls(SMPUDPTransport(), options.transport.ip, options.timeout)
+            return SMPUDPTransport()
     else:
         typer.echo(
             f"A transport option is required; "
@@ -83,23 +129,80 @@ def get_custom_smpclient(options: Options, smp_client_cls: Type[TSMPClient]) ->
         raise typer.Exit(code=1)
 
 
+def get_address(options: Options) -> str:
+    """Return the SMP server address of the chosen transport."""
+    address: Final = options.transport.port or options.transport.ble or options.transport.ip
+    assert address is not None, "get_transport() must be called first"
+    return address
+
+
+def get_custom_smpclient(options: Options, smp_client_cls: Type[TSMPClient]) -> TSMPClient:
+    """Return an `SMPClient` subclass to the chosen transport or raise `typer.Exit`.
+
+    Within a `Session`, the client wraps the session's transport so that it can be reused by
+    subsequent commands.
+    """
+    transport: Final = (
+        _session.get_transport(options) if _session is not None else get_transport(options)
+    )
+    logger.info(f"Initializing {smp_client_cls.__name__} with {transport.__class__.__name__}")
+    return smp_client_cls(transport, get_address(options), options.timeout)
+
+
 def get_smpclient(options: Options) -> SMPClient:
     """Return an `SMPClient` to the chosen transport or raise `typer.Exit`."""
     return get_custom_smpclient(options, SMPClient)
 
 
-async def connect_with_spinner(smpclient: SMPClient) -> None:
-    """Spin while connecting to the SMP Server; raises `typer.Exit` if connection fails."""
+@contextmanager
+def map_file(file: typer.FileBinaryRead | BufferedReader) -> Iterator[bytes]:
+    """Map the contents of the open binary `file` into memory, read-only.
+
+    Pages are read from disk as they are accessed and are backed by the file rather than copied
+    into Python memory, so the kernel can drop pages that have been sent.  A file upload reads
+    each page as it reaches it, but `SMPClient.upload()` hashes the whole image with SHA256
+    before its first request, so an image upload reads the file once before sending.
+
+    The mapping supports `len()`, slicing, and the buffer protocol (e.g. `hashlib`), so it is
+    typed as `bytes` for the `SMPClient` upload routines.  It remains valid after `file` is closed.
+    """
+    if os.fstat(file.fileno()).st_size == 0:  # empty files cannot be mapped
+        yield b""
+        return
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+        yield cast(bytes, mapping)
+
+
+async def connect_with_spinner(smpclient: SMPClient, visible: bool = True) -> None:
+    """Spin while connecting to the SMP Server; raises `typer.Exit` if connection fails.
+
+    Within a `Session`, the connection is only made if the session is not already connected.
+    The first connection to a device also reads its capabilities, see `smpmgr.capabilities`.
+    The spinner is hidden if not `visible`, e.g. when the output is JSON.
+    """
+    _check_session_loop()
+    if _session is not None and _session.is_connected(smpclient):
+        logger.debug(f"Reusing the session connection to {smpclient.address}")
+        return
+
     with Progress(
         SpinnerColumn(), TextColumn("[progress.description]{task.description}")
     ) as progress:
         connect_task_description = f"Connecting to {smpclient._address}..."
-        connect_task = progress.add_task(description=connect_task_description, total=None)
+        connect_task = progress.add_task(
+            description=connect_task_description, total=None, visible=visible
+        )
         try:
             await smpclient.connect()
+            from smpmgr import capabilities
+
+            if capabilities.get(smpclient.address) is None:  # only on the first connection
+                await capabilities.read_capabilities(smpclient)
             progress.update(
                 connect_task, description=f"{connect_task_description} OK", completed=True
             )
+            if _session is not None:
+                _session.set_connected(smpclient)
             return
         except asyncio.TimeoutError:
             logger.error("Transport error: connection timeout")
@@ -112,20 +215,215 @@ async def connect_with_spinner(smpclient: SMPClient) -> None:
         raise typer.Exit(code=1)
 
 
+async def _check_supported(
+    smpclient: SMPClient, requests: Sequence[SMPRequest[Any, Any, Any]]
+) -> None:
+    """Raise `typer.Exit` if the device is known not to support the group of one of `requests`."""
+    from smpmgr import capabilities
+
+    for group_id in dict.fromkeys(request.header.group_id for request in requests):
+        await capabilities.require(smpclient, group_id)
+
+
+def _note_responses(
+    smpclient: SMPClient, requests: Sequence[SMPRequest[Any, Any, Any]], responses: Sequence[Any]
+) -> None:
+    """Keep the cached capabilities of the device in step with the image states it reports."""
+    from smp.image_management import ImageStatesReadResponse, ImageStatesWriteRequest
+
+    from smpmgr import capabilities
+
+    for request, response in zip(requests, responses):
+        if not isinstance(response, ImageStatesReadResponse):
+            continue
+        if isinstance(request, ImageStatesWriteRequest) and request.hash is not None:
+            capabilities.forget(smpclient.address)  # another image will run after the reset
+        else:
+            capabilities.note_image_states(smpclient.address, response)
+
+
 async def smp_request(
     smpclient: SMPClient,
     request: SMPRequest[TRep, TEr1, TEr2],
     description: str | None = None,
     timeout_s: float | None = None,
+    visible: bool = True,
 ) -> TRep | TEr1 | TEr2:
+    """Make `request` with a spinner; raises `typer.Exit` if it fails.
+
+    A request to a group that the device is known not to support fails without being sent.
+    The spinner is hidden if not `visible`.
+    """
+    _check_session_loop()
+    await _check_supported(smpclient, [request])
     with Progress(
         SpinnerColumn(), TextColumn("[progress.description]{task.description}")
     ) as progress:
         description = description or f"Waiting for response to {request.__class__.__name__}..."
-        task = progress.add_task(description=description, total=None)
+        task = progress.add_task(description=description, total=None, visible=visible)
         try:
             r = await smpclient.request(request, timeout_s)
             progress.update(task, description=f"{description} OK", completed=True)
+            _note_responses(smpclient, [request], [r])
+            return r
+        except asyncio.TimeoutError:
+            progress.update(task, description=f"{description} timeout", completed=True)
+            logger.error("Timeout waiting for response")
+            raise typer.Exit(code=1)
+        except SMPBadStartDelimiter:
+            progress.update(task, description=f"{description} SMP error", completed=True)
+            logger.error("Is the device an SMP server?")
+            raise typer.Exit(code=1)
+        except (OSError, SMPTransportDisconnected) as e:
+            progress.update(task, description=f"{description} OS error", completed=True)
+            logger.error(f"Connection to device lost: {e.__class__.__name__} - {e}")
+            raise typer.Exit(code=1)
+
+
+async def get_buf_count(smpclient: SMPClient) -> int:
+    """Return how many requests the SMP server can buffer, from its MCUmgr parameters.
+
+    `SMPClient.connect()` reads the parameters but keeps only the buffer size, so they are read
+    again, once per transport.  Returns 1 if the SMP server does not report them.
+    """
+
+    transport: Final = smpclient._transport
+    buf_count: int | None = getattr(transport, "_smpmgr_buf_count", None)
+    if buf_count is None:
+        from smpclient.generics import success
+        from smpclient.requests.os_management import MCUMgrParametersRead
+
+        r = await try_request(smpclient, MCUMgrParametersRead())
+        buf_count = r.buf_count if r is not None and success(r) else 1
+        logger.info(f"The SMP server buffers {buf_count} requests")
+        setattr(transport, "_smpmgr_buf_count", buf_count)
+    return buf_count
+
+
+async def _pipeline_depth(smpclient: SMPClient, depth: int | None) -> int:
+    """Return `depth`, or the default depth if it is `None`, capped at the SMP server's buffers."""
+
+    if depth == 1:
+        return 1
+    buf_count: Final = await get_buf_count(smpclient)
+    if depth is None:
+        from smpclient.transport.serial import SMPSerialTransport
+
+        if isinstance(smpclient._transport, SMPSerialTransport):
+            return SERIAL_DEPTH
+        return buf_count
+    if depth > buf_count:
+        logger.info(f"Keeping {buf_count} requests in flight rather than {depth=}")
+    return min(depth, buf_count)
+
+
+def _loads(request: SMPRequest[TRep, TEr1, TEr2], frame: bytes) -> TRep | TEr1 | TEr2:
+    """Parse `frame` as the Response or Error of `request`, like `SMPClient.request()`."""
+
+    for cls in (request._Response, request._ErrorV1, request._ErrorV2):
+        try:
+            return cast(TRep | TEr1 | TEr2, cls.loads(frame))
+        except ValidationError:
+            pass
+    raise ValueError(
+        f"Response could not by parsed as one of {request._Response}, "
+        f"{request._ErrorV1}, or {request._ErrorV2}. {frame=}"
+    )
+
+
+async def pipeline(
+    smpclient: SMPClient,
+    requests: Sequence[SMPRequest[TRep, TEr1, TEr2]],
+    depth: int | None,
+    timeout_s: float | None = None,
+) -> list[TRep | TEr1 | TEr2]:
+    """Make the `requests` with up to `depth` of them in flight at once.
+
+    Responses are matched to requests by the SMP header sequence, so the SMP server may answer
+    in any order, and they are returned in the order of `requests`.  With `depth` 1 this is the
+    same as awaiting `SMPClient.request()` for each request.
+
+    `depth` is capped at the buffer count of the SMP server, since it drops the requests that
+    it has no buffer for.  With `depth` `None`, it is the buffer count, or `SERIAL_DEPTH` over a
+    serial transport.
+
+    Raises:
+        TimeoutError: if no response is received within `timeout_s`
+    """
+
+    transport: Final = smpclient._transport
+    timeout_s = timeout_s if timeout_s is not None else smpclient._timeout_s
+    pending: Final = iter(enumerate(requests))
+    in_flight: Final[dict[int, int]] = {}  # sequence -> index
+    responses: Final[dict[int, TRep | TEr1 | TEr2]] = {}
+
+    async def send_next() -> None:
+        for index, request in pending:
+            in_flight[request.header.sequence] = index
+            await transport.send(request.BYTES)
+            return
+
+    for _ in range(await _pipeline_depth(smpclient, depth) if len(requests) > 1 else 1):
+        await send_next()
+
+    while in_flight:
+        try:
+            frame = await asyncio.wait_for(transport.receive(), timeout_s)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timeout ({timeout_s}s) waiting for {len(in_flight)} responses")
+        sequence = smphdr.Header.loads(frame[: smphdr.Header.SIZE]).sequence
+        index = in_flight.pop(sequence, -1)
+        if index == -1:
+            logger.warning(f"Ignoring a response with unexpected {sequence=}")
+            continue
+        responses[index] = _loads(requests[index], frame)
+        await send_next()
+
+    return [responses[i] for i in range(len(requests))]
+
+
+async def try_request(
+    smpclient: SMPClient,
+    request: SMPRequest[TRep, TEr1, TEr2],
+    timeout_s: float | None = None,
+) -> TRep | TEr1 | TEr2 | None:
+    """Make `request` and return its response, or `None` if there is none within `timeout_s`.
+
+    For requests that may well go unanswered, e.g. a probe of an address that may not be an SMP
+    server, a device that is still booting, or a group that the SMP server may not support.
+    `SMPClient.request()` logs each timeout as an error, so the request is made with
+    `pipeline()` and the timeout is only logged at the info level.
+    """
+
+    try:
+        (r,) = await pipeline(smpclient, [request], 1, timeout_s)
+        return r
+    except TimeoutError as e:
+        logger.info(f"{smpclient.address} did not answer {request.__class__.__name__}: {e}")
+        return None
+
+
+async def smp_pipeline(
+    smpclient: SMPClient,
+    requests: Sequence[SMPRequest[TRep, TEr1, TEr2]],
+    depth: int | None,
+    description: str | None = None,
+    timeout_s: float | None = None,
+    visible: bool = True,
+) -> list[TRep | TEr1 | TEr2]:
+    """Like `smp_request()`, but for many requests made with `pipeline()`."""
+
+    _check_session_loop()
+    await _check_supported(smpclient, requests)
+    with Progress(
+        SpinnerColumn(), TextColumn("[progress.description]{task.description}")
+    ) as progress:
+        description = description or f"Waiting for {len(requests)} responses..."
+        task = progress.add_task(description=description, total=None, visible=visible)
+        try:
+            r = await pipeline(smpclient, requests, depth, timeout_s)
+            progress.update(task, description=f"{description} OK", completed=True)
+            _note_responses(smpclient, requests, r)
             return r
         except asyncio.TimeoutError:
             progress.update(task, description=f"{description} timeout", completed=True)
@@ -135,7 +433,174 @@ async def smp_request(
             progress.update(task, description=f"{description} SMP error", completed=True)
             logger.error("Is the device an SMP server?")
             raise typer.Exit(code=1)
-        except OSError as e:
+        except (OSError, SMPTransportDisconnected) as e:
             progress.update(task, description=f"{description} OS error", completed=True)
             logger.error(f"Connection to device lost: {e.__class__.__name__} - {e}")
             raise typer.Exit(code=1)
+
+
+class Session:
+    """A persistent event loop and SMP transport shared by the commands of a shell session.
+
+    While the `Session` context is active, `get_custom_smpclient()` wraps the session's transport,
+    `connect_with_spinner()` connects it only once, and `run()` runs commands on the session's
+    event loop.  The connection is dropped, and remade by the next command, when a command fails,
+    when the device is reset (see `drop_connection()`), or when the user switches target.
+
+    Example:
+
+    ```python
+    with Session():
+        app(["--port", "COM1", "os", "echo", "hello"], standalone_mode=False)
+        app(["os", "echo", "again"], standalone_mode=False)  # same target and connection
+    ```
+    """
+
+    def __init__(self) -> None:
+        self.loop: Final = asyncio.new_event_loop()
+        self._options: Options | None = None
+        self._transport: SMPTransport | None = None
+        self._connected = False
+
+    def __enter__(self) -> "Session":
+        global _session
+        if _session is not None:
+            raise RuntimeError("A Session is already active")
+        asyncio.set_event_loop(self.loop)
+        _session = self
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Type[BaseException] | None,
+        exc_value: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        global _session
+        _session = None
+        try:
+            self.loop.run_until_complete(self.disconnect())
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.run_until_complete(self.loop.shutdown_default_executor())
+        finally:
+            asyncio.set_event_loop(None)
+            self.loop.close()
+
+    def resolve(self, options: Options) -> Options:
+        """Return `options` with the session target filled in if no transport was given.
+
+        Giving a different target than the session's drops the current connection.
+        """
+        if options.transport == TransportDefinition(port=None, ble=None, ip=None):
+            if self._options is None:
+                return options
+            return replace(
+                options,
+                transport=self._options.transport,
+                mtu=options.mtu if options.mtu is not None else self._options.mtu,
+                baudrate=options.baudrate
+                if options.baudrate is not None
+                else self._options.baudrate,
+            )
+
+        if self._options is not None and (
+            options.transport,
+            options.mtu,
+            options.baudrate,
+        ) != (self._options.transport, self._options.mtu, self._options.baudrate):
+            logger.info(f"Switching target from {self._options.transport} to {options.transport}")
+            self.loop.run_until_complete(self.disconnect())
+
+        self._options = options
+        return options
+
+    def get_transport(self, options: Options) -> SMPTransport:
+        """Return the session's transport, creating it if there is none."""
+        if self._transport is None:
+            self._transport = get_transport(options)
+        else:
+            from smpmgr import timing
+
+            if timing.active():  # e.g. `--timing` given after the connection was made
+                timing.instrument(self._transport)
+        return self._transport
+
+    def is_connected(self, smpclient: SMPClient) -> bool:
+        """Return `True` if `smpclient` uses the session's connected transport."""
+        return (
+            self._connected
+            and smpclient._transport is self._transport
+            and asyncio.get_running_loop() is self.loop
+        )
+
+    def set_connected(self, smpclient: SMPClient) -> None:
+        """Record that `smpclient` has connected the session's transport."""
+        self._connected = smpclient._transport is self._transport
+
+    async def disconnect(self) -> None:
+        """Disconnect and forget the session's transport."""
+        transport: Final = self._transport
+        self._transport = None
+        self._connected = False
+        if transport is None:
+            return
+        try:
+            await transport.disconnect()
+        except Exception as e:
+            logger.debug(f"Ignoring error while disconnecting: {e.__class__.__name__} - {e}")
+
+    def run(self, main: Coroutine[Any, Any, T]) -> T:
+        """Run `main` on the session's event loop, dropping the connection if it fails."""
+        task: Final = self.loop.create_task(main)
+        try:
+            return self.loop.run_until_complete(task)
+        except typer.Exit as e:
+            if e.exit_code != 0:
+                self.loop.run_until_complete(self.disconnect())
+            raise
+        except BaseException:
+            if not task.done():
+                task.cancel()
+                self.loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+            self.loop.run_until_complete(self.disconnect())
+            raise
+
+
+_session: Session | None = None
+
+
+def resolve_options(options: Options) -> Options:
+    """Return `options`, completed with the target of the active `Session`, if any."""
+    return _session.resolve(options) if _session is not None else options
+
+
+def run(main: Coroutine[Any, Any, T]) -> T:
+    """Run `main` on the event loop of the active `Session`, or with `asyncio.run()`.
+
+    Commands should use this instead of `asyncio.run()` so that they share the connection of the
+    `interactive` shell.
+    """
+    return _session.run(main) if _session is not None else asyncio.run(main)
+
+
+def _check_session_loop() -> None:
+    """Raise `typer.Exit` if a command of the active `Session` runs on another event loop.
+
+    The session's transport belongs to the session's event loop, so a command, e.g. of a plugin,
+    that is run with `asyncio.run()` rather than `run()` would break the session's connection.
+    """
+    if _session is not None and asyncio.get_running_loop() is not _session.loop:
+        logger.error(
+            "This command cannot be used from the interactive shell because it runs with "
+            "asyncio.run(); it must run with smpmgr.common.run() instead."
+        )
+        raise typer.Exit(code=1)
+
+
+async def drop_connection() -> None:
+    """Drop the connection of the active `Session`, if any, e.g. after resetting the device.
+
+    The next command of the session will reconnect.
+    """
+    if _session is not None:
+        await _session.disconnect()
@@ -0,0 +1,248 @@
+"""The discover command, which finds the SMP servers on the serial ports and UDP networks."""
+
+import asyncio
+import ipaddress
+import json
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, replace
+from typing import Final, Iterator, List, Sequence, cast
+
+import typer
+from rich import print
+from rich.progress import Progress, SpinnerColumn, TextColumn
+from rich.table import Table
+from smpclient import SMPClient
+from smpclient.generics import success
+from smpclient.requests.enumeration_management import ListSupportedGroups
+from smpclient.requests.os_management import EchoWrite
+from typing_extensions import Annotated
+
+from smpmgr import capabilities
+from smpmgr.common import Options, TransportDefinition, get_address, get_transport, run, try_request
+from smpmgr.fleet import target_label
+from smpmgr.timing import group_name
+
+logger: Final = logging.getLogger(__name__)
+
+JOBS: Final = 256
+"""Default number of targets probed at once; each has its own socket or serial port open."""
+
+MAX_UDP_HOSTS: Final = 4096
+"""The most UDP addresses that are probed, so that a mistyped prefix, e.g. /8, is caught."""
+
+TRANSPORT_LOGGERS: Final = (
+    "smpclient.transport.serial",
+    "smpclient.transport.udp",
+    "smpclient.transport._udp_client",
+)
+"""The loggers of the transports, which warn about e.g. ICMP port unreachable."""
+
+ECHO: Final = "smpmgr"
+"""The string echoed by the probe."""
+
+
+@dataclass(frozen=True)
+class Found:
+    """An SMP server that answered the probe."""
+
+    target: str
+    """The target, e.g. `port:/dev/ttyACM0` or `ip:192.168.1.10`, as given to `--target`."""
+    rtt_s: float
+    """The round trip time of the echo."""
+    groups: list[int] | None
+    """The supported groups, or `None` if the enumeration group is not supported."""
+
+
+def udp_addresses(networks: Sequence[str]) -> list[str]:
+    """Return the host addresses of `networks`, e.g. `192.168.1.0/24` or `10.0.0.5`.
+
+    Raises:
+        typer.BadParameter: if a network is invalid or there are too many addresses
+    """
+
+    addresses: Final[dict[str, None]] = {}  # ordered and unique
+    for network in networks:
+        try:
+            hosts = ipaddress.ip_network(network, strict=False).hosts()
+        except ValueError as e:
+            raise typer.BadParameter(str(e), param_hint="--udp")
+        for host in hosts:
+            addresses[str(host)] = None
+            if len(addresses) > MAX_UDP_HOSTS:
+                raise typer.BadParameter(
+                    f"More than {MAX_UDP_HOSTS} addresses, use a longer prefix", param_hint="--udp"
+                )
+    return list(addresses)
+
+
+def serial_ports() -> list[str]:
+    """Return the serial ports of this computer, e.g. `/dev/ttyACM0` or `COM3`."""
+
+    from serial.tools.list_ports import comports
+
+    return [port.device for port in comports()]
+
+
+async def echo(smpclient: SMPClient, label: str, timeout_s: float) -> float | None:
+    """Return the round trip time of an echo to `smpclient`, or `None` if it does not answer."""
+
+    start: Final = time.monotonic()
+    r: Final = await try_request(smpclient, EchoWrite(d=ECHO), timeout_s)
+    if r is None:
+        return None
+    rtt_s: Final = time.monotonic() - start
+    if not success(r):  # e.g. echo is disabled, but it is still an SMP server
+        logger.info(f"{label} answered the echo with {r}")
+    return rtt_s
+
+
+async def probe(options: Options, timeout_s: float) -> Found | None:
+    """Return the `Found` SMP server at the target of `options`, or `None` if it does not answer.
+
+    The RTT is the faster of two echoes, since the first one competes with the probes of all of
+    the other targets.
+    """
+
+    label: Final = target_label(options)
+    transport: Final = get_transport(options)
+    smpclient: Final = SMPClient(transport, get_address(options), timeout_s)
+    try:
+        await transport.connect(get_address(options), timeout_s)
+        rtt_s = await echo(smpclient, label, timeout_s)
+        if rtt_s is None:
+            logger.info(f"No SMP server at {label}")
+            return None
+
+        r = await try_request(smpclient, ListSupportedGroups(), timeout_s)
+        groups = list(r.groups) if r is not None and success(r) else None
+        if groups is not None:
+            capabilities.save_groups(get_address(options), groups)
+        if r is not None:
+            rtt_s = min(rtt_s, await echo(smpclient, label, timeout_s) or rtt_s)
+        return Found(label, rtt_s, groups)
+    except Exception as e:
+        logger.info(f"No SMP server at {label}: {e.__class__.__name__} - {e}")
+        return None
+    finally:
+        try:
+            await transport.disconnect()
+        except Exception as e:
+            logger.debug(f"Ignoring error while disconnecting: {e.__class__.__name__} - {e}")
+
+
+async def probe_many(targets: Sequence[Options], timeout_s: float, jobs: int) -> list[Found]:
+    """Probe `targets` concurrently, at most `jobs` at a time, and return those that answered."""
+
+    semaphore: Final = asyncio.Semaphore(jobs)
+
+    async def worker(options: Options) -> Found | None:
+        async with semaphore:
+            return await probe(options, timeout_s)
+
+    return [
+        found
+        for found in await asyncio.gather(*(worker(options) for options in targets))
+        if found is not None
+    ]
+
+
+def _demote(record: logging.LogRecord) -> bool:
+    """Log the warnings of a transport as INFO, since most targets are not SMP servers."""
+
+    if record.levelno == logging.WARNING:
+        record.levelno, record.levelname = logging.INFO, logging.getLevelName(logging.INFO)
+    return True
+
+
+@contextmanager
+def _quiet_transports() -> Iterator[None]:
+    """Hide the transport warnings of the targets that are not SMP servers from the console."""
+
+    loggers: Final = [logging.getLogger(name) for name in TRANSPORT_LOGGERS]
+    for transport_logger in loggers:
+        transport_logger.addFilter(_demote)
+    try:
+        yield
+    finally:
+        for transport_logger in loggers:
+            transport_logger.removeFilter(_demote)
+
+
+def print_found(found: Sequence[Found]) -> None:
+    """Print a table of the `found` SMP servers."""
+
+    table: Final = Table(title="SMP Servers")
+    table.add_column("Target", style="cyan")
+    table.add_column("RTT (ms)", justify="right")
+    table.add_column("Groups")
+    for f in found:
+        table.add_row(
+            f.target,
+            f"{f.rtt_s * 1000:.1f}",
+            ", ".join(map(group_name, f.groups)) if f.groups is not None else "[dim]unknown[/dim]",
+        )
+    print(table)
+
+
+def discover(
+    ctx: typer.Context,
+    udp: Annotated[
+        List[str],
+        typer.Option(
+            metavar="ADDRESS[/PREFIX]",
+            help="Probe the UDP addresses of this network, e.g. 192.168.1.0/24, or this "
+            "address, e.g. 192.168.1.10.  May be used more than once.",
+        ),
+    ] = [],
+    serial: Annotated[bool, typer.Option(help="Probe every serial port.")] = True,
+    jobs: Annotated[
+        int, typer.Option(min=1, help="Maximum number of targets to probe concurrently.")
+    ] = JOBS,
+    json_output: Annotated[
+        bool,
+        typer.Option("--json", help="Print the SMP servers as a JSON list"),
+    ] = False,
+) -> None:
+    """Find the SMP servers on the serial ports and UDP networks.
+
+    Every target is sent an echo at once, so the search takes about one --timeout regardless of
+    the number of targets; a shorter --timeout, e.g. 0.5, is usually enough.  The servers that
+    answer are asked for their supported groups, which are cached for later commands.  Their
+    targets can be given to `upgrade --target`.
+    """
+
+    options: Final = cast(Options, ctx.obj)
+    targets: Final = [
+        replace(options, transport=TransportDefinition(port=port, ble=None, ip=None))
+        for port in (serial_ports() if serial else [])
+    ] + [
+        replace(options, transport=TransportDefinition(port=None, ble=None, ip=ip))
+        for ip in udp_addresses(udp)
+    ]
+    if not targets:
+        typer.echo("There is nothing to probe; no serial ports were found and --udp was not given.")
+        raise typer.Exit(code=1)
+
+    start: Final = time.monotonic()
+    with _quiet_transports(), Progress(
+        SpinnerColumn(), TextColumn("[progress.description]{task.description}")
+    ) as progress:
+        description: Final = f"Probing {len(targets)} targets..."
+        task: Final = progress.add_task(
+            description=description, total=None, visible=not json_output
+        )
+        found: Final = run(probe_many(targets, options.timeout, jobs))
+        progress.update(task, description=f"{description} OK", completed=True)
+
+    if json_output:
+        typer.echo(json.dumps([asdict(f) for f in found], indent=2))
+        return
+
+    if found:
+        print_found(found)
+    print(
+        f"Found {len(found)} SMP servers among {len(targets)} targets in "
+        f"{time.monotonic() - start:.1f} s."
+    )
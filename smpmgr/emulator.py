@@ -0,0 +1,671 @@
+"""An emulated SMP server for testing and benchmarking without hardware.
+
+The `Emulator` keeps its images, files, and statistics in memory and simulates the latency and
+bandwidth of the link and the speed of flash writes.  It is served over UDP with `serve_udp()` or
+over a serial pseudo-terminal with `serve_pty()`, so that `smpmgr` can connect to it with `--ip`
+or `--port` like to a real device.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import zlib
+from dataclasses import dataclass, field, replace
+from hashlib import sha256
+from io import BytesIO
+from typing import Annotated, Any, Callable, Final, Generic, TypeVar
+
+import cbor2
+import typer
+from smp import header as smphdr
+from smp import packet as smppacket
+from smp.error import MGMT_ERR
+from smp.file_management import FS_MGMT_ERR
+from smp.image_management import IMG_MGMT_ERR
+from smp.statistics_management import STAT_MGMT_ERR
+from smpclient.mcuboot import IMAGE_TLV, ImageHeader, ImageTLV, ImageTLVInfo
+
+from smpmgr.common import run
+
+logger: Final = logging.getLogger(__name__)
+
+GroupId: Final = smphdr.GroupId
+_OS: Final = smphdr.CommandId.OSManagement
+_IMG: Final = smphdr.CommandId.ImageManagement
+_STAT: Final = smphdr.CommandId.StatisticsManagement
+_FS: Final = smphdr.CommandId.FileManagement
+_SHELL: Final = smphdr.CommandId.ShellManagement
+_ENUM: Final = smphdr.CommandId.EnumManagement
+_IC: Final = smphdr.CommandId.Intercreate
+_R: Final = smphdr.OP.READ
+_W: Final = smphdr.OP.WRITE
+
+TPeer = TypeVar("TPeer")
+
+_Handler = Callable[[dict[str, Any]], dict[str, Any]]
+"""Return the response to a request, both as decoded CBOR maps, or raise `SMPError`."""
+
+
+@dataclass(frozen=True)
+class LinkModel:
+    """The simulated characteristics of the link and the device."""
+
+    latency_s: float = 0.0
+    """Delay added to every response, i.e. the round trip time of an empty request."""
+    bandwidth: int | None = None
+    """Link speed in bytes per second, in both directions, or `None` for unlimited."""
+    flash_write_s: float = 0.0
+    """Delay per KiB written to an image slot or a file."""
+    buf_size: int = 2048
+    """The MCUmgr buffer size that is reported to the client; larger requests are dropped."""
+    buf_count: int = 4
+    """The MCUmgr buffer count that is reported to the client; further requests are dropped."""
+    reset_s: float = 0.0
+    """How long the device ignores requests after a reset."""
+
+
+@dataclass
+class Image:
+    """An image in a slot of the emulated device."""
+
+    data: bytes
+    hash: bytes
+    version: str
+    active: bool = False
+    confirmed: bool = False
+    pending: bool = False
+    permanent: bool = False
+
+
+@dataclass
+class _Upload:
+    """An image upload in progress."""
+
+    image: int
+    size: int
+    sha: bytes | None
+    data: bytearray = field(default_factory=bytearray)
+
+
+class SMPError(Exception):
+    """Raised by a request handler to respond with an error."""
+
+    def __init__(self, rc: int, mgmt_rc: MGMT_ERR = MGMT_ERR.EUNKNOWN) -> None:
+        super().__init__(rc, mgmt_rc)
+        self.rc: Final = rc
+        """The group error code, for SMP version 2 requests."""
+        self.mgmt_rc: Final = mgmt_rc
+        """The general error code, for SMP version 1 requests."""
+
+
+def inspect_image(data: bytes) -> tuple[bytes, str]:
+    """Return the IMAGE_TLV_SHA256 and version of the MCUboot image `data`.
+
+    Data that is not an MCUboot image is identified by its SHA256 and version 0.0.0.
+    """
+
+    try:
+        f: Final = BytesIO(data)
+        header: Final = ImageHeader.load_from(f)
+        tlv_offset: Final = header.hdr_size + header.img_size
+        f.seek(tlv_offset)
+        tlv_info: Final = ImageTLVInfo.load_from(f)
+        while f.tell() < tlv_offset + tlv_info.tlv_tot:
+            tlv = ImageTLV.load_from(f)
+            value = f.read(tlv.len)
+            if tlv.type == IMAGE_TLV.SHA256:
+                return value, str(header.ver)
+    except Exception as e:
+        logger.debug(f"Not an MCUboot image: {e.__class__.__name__} - {e}")
+    return sha256(data).digest(), "0.0.0"
+
+
+class Emulator:
+    """The state and request handling of an emulated SMP server.
+
+    Requests are handled one at a time, like by the SMP thread of a device; the transports in
+    this module serialize them.
+    """
+
+    def __init__(self, link: LinkModel = LinkModel()) -> None:
+        self.link: Final = link
+        running: Final = b"smpmgr emulator"
+        self.slots: Final[dict[int, Image]] = {
+            0: Image(running, sha256(running).digest(), "0.0.0", active=True, confirmed=True)
+        }
+        """The images of the device by slot; image N is in slots 2N (primary) and 2N+1."""
+        self.files: Final[dict[str, bytearray]] = {}
+        """The file system of the device."""
+        self.ic_images: Final[dict[int, bytearray]] = {}
+        """The data uploaded with the Intercreate group, by image number."""
+        self.stats: Final[dict[str, dict[str, int]]] = {
+            "smp": {"rx_frames": 0, "tx_frames": 0, "rx_bytes": 0, "tx_bytes": 0, "dropped": 0},
+            "flash": {"bytes_written": 0, "erases": 0},
+            "os": {"resets": 0},
+        }
+        """The statistics groups of the device."""
+        self._upload: _Upload | None = None
+        self._ic_upload_image = 0
+        self._written = 0
+        self._resetting_until = 0.0
+
+        self._handlers: Final[dict[tuple[int, int, smphdr.OP], _Handler]] = {
+            (GroupId.OS_MANAGEMENT, _OS.ECHO, _W): self._echo,
+            (GroupId.OS_MANAGEMENT, _OS.RESET, _W): self._reset,
+            (GroupId.OS_MANAGEMENT, _OS.MCUMGR_PARAMETERS, _R): self._mcumgr_parameters,
+            (GroupId.IMAGE_MANAGEMENT, _IMG.STATE, _R): self._image_states_read,
+            (GroupId.IMAGE_MANAGEMENT, _IMG.STATE, _W): self._image_states_write,
+            (GroupId.IMAGE_MANAGEMENT, _IMG.UPLOAD, _W): self._image_upload,
+            (GroupId.IMAGE_MANAGEMENT, _IMG.ERASE, _W): self._image_erase,
+            (GroupId.STATISTICS_MANAGEMENT, _STAT.LIST_OF_GROUPS, _R): self._stat_list,
+            (GroupId.STATISTICS_MANAGEMENT, _STAT.GROUP_DATA, _R): self._stat_group_data,
+            (GroupId.FILE_MANAGEMENT, _FS.FILE_DOWNLOAD_UPLOAD, _R): self._file_download,
+            (GroupId.FILE_MANAGEMENT, _FS.FILE_DOWNLOAD_UPLOAD, _W): self._file_upload,
+            (GroupId.FILE_MANAGEMENT, _FS.FILE_STATUS, _R): self._file_status,
+            (GroupId.FILE_MANAGEMENT, _FS.FILE_HASH_CHECKSUM, _R): self._file_hash,
+            (
+                GroupId.FILE_MANAGEMENT,
+                _FS.SUPPORTED_FILE_HASH_CHECKSUM_TYPES,
+                _R,
+            ): self._file_hash_types,
+            (GroupId.FILE_MANAGEMENT, _FS.FILE_CLOSE, _W): lambda _: {},
+            (GroupId.SHELL_MANAGEMENT, _SHELL.EXECUTE, _W): self._shell_execute,
+            (GroupId.ENUM_MANAGEMENT, _ENUM.GROUP_COUNT, _R): lambda _: {"count": len(self.groups)},
+            (GroupId.ENUM_MANAGEMENT, _ENUM.LIST_OF_GROUPS, _R): lambda _: {"groups": self.groups},
+            (smphdr.UserGroupId.INTERCREATE, _IC.UPLOAD, _W): self._ic_upload,
+        }
+
+    @property
+    def groups(self) -> list[int]:
+        """The IDs of the SMP groups that the emulator supports."""
+
+        return sorted({group for group, _, _ in self._handlers})
+
+    async def handle(self, frame: bytes) -> bytes | None:
+        """Return the response to the request `frame` after the simulated delays.
+
+        Returns `None` if the request is dropped, e.g. because it is larger than the MCUmgr
+        buffer or because the device is resetting.
+        """
+
+        now: Final = time.monotonic()
+        if now < self._resetting_until or len(frame) > self.link.buf_size:
+            logger.debug(f"Dropping a {len(frame)} B request")
+            self.stats["smp"]["dropped"] += 1
+            return None
+
+        header: Final = smphdr.Header.loads(frame[: smphdr.Header.SIZE])
+        self.stats["smp"]["rx_frames"] += 1
+        self.stats["smp"]["rx_bytes"] += len(frame)
+
+        self._written = 0
+        body = self._respond(header, frame[smphdr.Header.SIZE :])
+        response: Final = (
+            replace(header, op=smphdr.OP(header.op + 1), length=len(body)).BYTES + body
+        )
+
+        delay = self.link.latency_s + self.link.flash_write_s * self._written / 1024
+        if self.link.bandwidth is not None:
+            delay += (len(frame) + len(response)) / self.link.bandwidth
+        await asyncio.sleep(delay - (time.monotonic() - now))
+
+        self.stats["smp"]["tx_frames"] += 1
+        self.stats["smp"]["tx_bytes"] += len(response)
+        return response
+
+    def _respond(self, header: smphdr.Header, data: bytes) -> bytes:
+        """Return the CBOR response body to the request with `header` and CBOR `data`."""
+
+        handler: Final = self._handlers.get((header.group_id, header.command_id, header.op))
+        try:
+            if handler is None:
+                raise SMPError(MGMT_ERR.ENOTSUP, MGMT_ERR.ENOTSUP)
+            try:
+                return cbor2.dumps(handler(cbor2.loads(data) if data else {}))
+            except (KeyError, TypeError, ValueError) as e:
+                logger.debug(f"Invalid request: {e.__class__.__name__} - {e}")
+                raise SMPError(MGMT_ERR.EINVAL, MGMT_ERR.EINVAL)
+        except SMPError as e:
+            logger.debug(f"{header.group_id=} {header.command_id=} failed with {e.rc=}")
+            if header.version == smphdr.Version.V1:
+                return cbor2.dumps({"rc": int(e.mgmt_rc)})
+            return cbor2.dumps({"err": {"group": int(header.group_id), "rc": int(e.rc)}})
+
+    def _write_flash(self, size: int) -> None:
+        self._written += size
+        self.stats["flash"]["bytes_written"] += size
+
+    def _echo(self, request: dict[str, Any]) -> dict[str, Any]:
+        return {"r": request["d"]}
+
+    def _reset(self, request: dict[str, Any]) -> dict[str, Any]:
+        """Swap to a pending image, or revert an unconfirmed one, like MCUboot would."""
+
+        self.stats["os"]["resets"] += 1
+        self._resetting_until = time.monotonic() + self.link.reset_s
+        self._upload = None
+        for image in sorted({slot // 2 for slot in self.slots}):
+            active, other = self.slots.get(image * 2), self.slots.get(image * 2 + 1)
+            if other is None or not (
+                other.pending or (active is not None and not active.confirmed)
+            ):
+                continue
+            self.slots[image * 2] = replace(
+                other, active=True, confirmed=other.permanent or other.confirmed, pending=False
+            )
+            if active is not None:
+                self.slots[image * 2 + 1] = replace(active, active=False, pending=False)
+            else:  # e.g. the first upload of a network core image
+                del self.slots[image * 2 + 1]
+        return {}
+
+    def _mcumgr_parameters(self, request: dict[str, Any]) -> dict[str, Any]:
+        return {"buf_size": self.link.buf_size, "buf_count": self.link.buf_count}
+
+    def _image_states_read(self, request: dict[str, Any]) -> dict[str, Any]:
+        return {
+            "images": [
+                {
+                    "image": slot // 2,
+                    "slot": slot % 2,
+                    "version": image.version,
+                    "hash": image.hash,
+                    "bootable": True,
+                    "pending": image.pending,
+                    "confirmed": image.confirmed,
+                    "active": image.active,
+                    "permanent": image.permanent,
+                }
+                for slot, image in sorted(self.slots.items())
+            ],
+            "splitStatus": 0,
+        }
+
+    def _image_states_write(self, request: dict[str, Any]) -> dict[str, Any]:
+        hash: Final = request.get("hash")
+        confirm: Final = bool(request.get("confirm", False))
+        if hash is None:
+            if not confirm:
+                raise SMPError(IMG_MGMT_ERR.INVALID_HASH, MGMT_ERR.EINVAL)
+            for image in self.slots.values():
+                if image.active:
+                    image.confirmed = True
+            return self._image_states_read(request)
+
+        for image in self.slots.values():
+            if image.hash == hash:
+                if image.active:
+                    image.confirmed |= confirm
+                else:
+                    image.pending = True
+                    image.permanent = confirm
+                return self._image_states_read(request)
+        raise SMPError(IMG_MGMT_ERR.HASH_NOT_FOUND, MGMT_ERR.ENOENT)
+
+    def _image_upload(self, request: dict[str, Any]) -> dict[str, Any]:
+        """Write a chunk of an image to the secondary slot.
+
+        Like Zephyr, a first chunk with the SHA256 of the upload in progress resumes it.
+        """
+
+        off: Final = request["off"]
+        data: Final = request["data"]
+        if off == 0:
+            size: Final = request["len"]
+            sha: Final = request.get("sha")
+            if (
+                self._upload is not None
+                and sha is not None
+                and (self._upload.sha, self._upload.size) == (sha, size)
+                and len(self._upload.data) < size
+            ):
+                logger.info(f"Resuming the upload at {len(self._upload.data)}")
+                return {"off": len(self._upload.data)}
+            slot: Final = request.get("image", 0) * 2 + 1
+            if slot in self.slots and self.slots[slot].active:
+                raise SMPError(IMG_MGMT_ERR.NO_FREE_SLOT, MGMT_ERR.EBADSTATE)
+            self.slots.pop(slot, None)
+            self.stats["flash"]["erases"] += 1
+            self._upload = _Upload(request.get("image", 0), size, sha)
+
+        upload: Final = self._upload
+        if upload is None:
+            raise SMPError(IMG_MGMT_ERR.FLASH_CONTEXT_NOT_SET, MGMT_ERR.EINVAL)
+        if off != len(upload.data):
+            return {"off": len(upload.data)}
+
+        upload.data.extend(data[: upload.size - off])
+        self._write_flash(len(data))
+        if len(upload.data) < upload.size:
+            return {"off": len(upload.data)}
+
+        self._upload = None
+        hash, version = inspect_image(bytes(upload.data))
+        self.slots[upload.image * 2 + 1] = Image(bytes(upload.data), hash, version)
+        return {"off": upload.size, "match": upload.sha in (None, sha256(upload.data).digest())}
+
+    def _image_erase(self, request: dict[str, Any]) -> dict[str, Any]:
+        slot: Final = request.get("slot", 1)
+        if slot in self.slots and self.slots[slot].active:
+            raise SMPError(IMG_MGMT_ERR.IMAGE_SETTING_TEST_TO_ACTIVE_DENIED, MGMT_ERR.EBADSTATE)
+        self.slots.pop(slot, None)
+        self._upload = None
+        self.stats["flash"]["erases"] += 1
+        return {}
+
+    def _stat_list(self, request: dict[str, Any]) -> dict[str, Any]:
+        return {"stat_list": list(self.stats)}
+
+    def _stat_group_data(self, request: dict[str, Any]) -> dict[str, Any]:
+        name: Final = request["name"]
+        if name not in self.stats:
+            raise SMPError(STAT_MGMT_ERR.ERR_INVALID_GROUP, MGMT_ERR.ENOENT)
+        return {"name": name, "fields": dict(self.stats[name])}
+
+    def _file(self, name: str) -> bytearray:
+        if name not in self.files:
+            raise SMPError(FS_MGMT_ERR.FILE_NOT_FOUND, MGMT_ERR.ENOENT)
+        return self.files[name]
+
+    def _file_download(self, request: dict[str, Any]) -> dict[str, Any]:
+        file: Final = self._file(request["name"])
+        off: Final = request["off"]
+        if off > len(file):
+            raise SMPError(FS_MGMT_ERR.FILE_OFFSET_LARGER_THAN_FILE, MGMT_ERR.EINVAL)
+        chunk: Final = max(1, self.link.buf_size - 64)  # room for the header and the CBOR keys
+        response: Final[dict[str, Any]] = {"off": off, "data": bytes(file[off : off + chunk])}
+        if off == 0:
+            response["len"] = len(file)
+        return response
+
+    def _file_upload(self, request: dict[str, Any]) -> dict[str, Any]:
+        name: Final = request["name"]
+        off: Final = request["off"]
+        data: Final = request["data"]
+        if off == 0:
+            self.files[name] = bytearray()
+        file: Final = self._file(name)
+        if off != len(file):
+            raise SMPError(FS_MGMT_ERR.FILE_OFFSET_NOT_VALID, MGMT_ERR.EINVAL)
+        file.extend(data)
+        self._write_flash(len(data))
+        return {"off": len(file)}
+
+    def _file_status(self, request: dict[str, Any]) -> dict[str, Any]:
+        return {"len": len(self._file(request["name"]))}
+
+    def _file_hash(self, request: dict[str, Any]) -> dict[str, Any]:
+        file: Final = self._file(request["name"])
+        type: Final = request.get("type", "sha256")
+        off: Final = request.get("off", 0)
+        data: Final = bytes(file[off : off + request["len"]] if "len" in request else file[off:])
+        if type == "sha256":
+            output: bytes | int = sha256(data).digest()
+        elif type == "crc32":
+            output = zlib.crc32(data)
+        else:
+            raise SMPError(FS_MGMT_ERR.CHECKSUM_HASH_NOT_FOUND, MGMT_ERR.ENOTSUP)
+        return {"type": type, "off": off, "len": len(data), "output": output}
+
+    def _file_hash_types(self, request: dict[str, Any]) -> dict[str, Any]:
+        return {
+            "types": {
+                "crc32": {"format": 0, "size": 4},
+                "sha256": {"format": 1, "size": 32},
+            }
+        }
+
+    def _ic_upload(self, request: dict[str, Any]) -> dict[str, Any]:
+        """Write a chunk of data to an Intercreate image, e.g. a secondary MCU."""
+
+        off: Final = request["off"]
+        if off == 0 and "image" in request:  # the start of an upload, which may have no data
+            self._ic_upload_image = request["image"]
+            self.ic_images[self._ic_upload_image] = bytearray()
+        data: Final = self.ic_images.get(self._ic_upload_image)
+        if data is None:
+            raise SMPError(1, MGMT_ERR.EINVAL)  # IC_MGMT_ERR.INVALID_IMAGE
+        if off == len(data):
+            data.extend(request["data"])
+            self._write_flash(len(request["data"]))
+        return {"off": len(data)}
+
+    def _shell_execute(self, request: dict[str, Any]) -> dict[str, Any]:
+        argv: Final[list[str]] = request["argv"]
+        if argv[:1] == ["echo"]:
+            return {"o": " ".join(argv[1:]), "ret": 0}
+        return {"o": f"{argv[0] if argv else ''}: command not found", "ret": -8}
+
+
+class _Worker(Generic[TPeer]):
+    """Handle the requests from a transport one at a time and send the responses."""
+
+    def __init__(self, emulator: Emulator, send: Callable[[bytes, TPeer], None]) -> None:
+        self._emulator: Final = emulator
+        self._send: Final = send
+        self._queue: Final[asyncio.Queue[tuple[bytes, TPeer]]] = asyncio.Queue()
+        self._busy = False
+        self._task: Final = asyncio.get_running_loop().create_task(self._run())
+
+    def put(self, frame: bytes, peer: TPeer) -> None:
+        """Queue `frame`, or drop it if all of the MCUmgr buffers are in use, like a device."""
+
+        if self._queue.qsize() + self._busy >= self._emulator.link.buf_count:
+            logger.debug(f"Dropping a {len(frame)} B request, all buffers are in use")
+            self._emulator.stats["smp"]["dropped"] += 1
+            return
+        self._queue.put_nowait((frame, peer))
+
+    async def _run(self) -> None:
+        while True:
+            frame, peer = await self._queue.get()
+            self._busy = True
+            try:
+                response = await self._emulator.handle(frame)
+            except Exception:
+                logger.exception(f"Failed to handle {frame.hex()}")
+                continue
+            finally:
+                self._busy = False
+            if response is not None:
+                self._send(response, peer)
+
+    def close(self) -> None:
+        self._task.cancel()
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, emulator: Emulator) -> None:
+        self._emulator: Final = emulator
+        self._partial: Final[dict[Any, bytearray]] = {}
+        self.transport: asyncio.DatagramTransport | None = None
+        self._worker: _Worker[Any] | None = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport  # type: ignore[assignment]
+        self._worker = _Worker(self._emulator, self._sendto)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        if self._worker is not None:
+            self._worker.close()
+
+    def _sendto(self, response: bytes, addr: Any) -> None:
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.sendto(response, addr)
+
+    def datagram_received(self, data: bytes, addr: Any) -> None:
+        """Reassemble frames that the client fragmented into several datagrams."""
+
+        frame: Final = self._partial.pop(addr, bytearray()) + data
+        if len(frame) < smphdr.Header.SIZE:
+            return
+        length: Final = smphdr.Header.loads(bytes(frame[: smphdr.Header.SIZE])).length
+        if len(frame) < smphdr.Header.SIZE + length:
+            self._partial[addr] = frame
+            return
+        assert self._worker is not None
+        self._worker.put(bytes(frame), addr)
+
+
+async def serve_udp(
+    emulator: Emulator, host: str = "127.0.0.1", port: int = 1337
+) -> asyncio.DatagramTransport:
+    """Serve `emulator` on UDP `host`:`port` until the returned transport is closed.
+
+    `smpmgr --ip` always connects to port 1337; other ports are useful for tests.
+    """
+
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: _UDPProtocol(emulator), local_addr=(host, port)
+    )
+    logger.info(f"Serving SMP over UDP on {transport.get_extra_info('sockname')}")
+    return transport
+
+
+class PTYServer:
+    """Serve an `Emulator` over a serial pseudo-terminal; connect to `port`."""
+
+    LINE_LENGTH: Final = 128
+    """The length of the encoded SMP packets that are sent to the client."""
+
+    def __init__(self, emulator: Emulator) -> None:
+        import tty
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)  # the client sees the bytes as they are, without echo
+        self.port: Final = os.ttyname(self._slave)
+        """The serial port to connect to, e.g. /dev/pts/3."""
+        self._buffer = bytearray()
+        self._decoder: Any = None
+        self._worker: Final = _Worker(emulator, self._write)
+        asyncio.get_running_loop().add_reader(self._master, self._read)
+        logger.info(f"Serving SMP over the serial port {self.port}")
+
+    def _write(self, response: bytes, _: None) -> None:
+        for packet in smppacket.encode(response, line_length=PTYServer.LINE_LENGTH):
+            os.write(self._master, packet)
+
+    def _read(self) -> None:
+        try:
+            self._buffer.extend(os.read(self._master, 4096))
+        except OSError as e:
+            logger.debug(f"Serial read error: {e}")
+            return
+        while (end := self._buffer.find(smppacket.END_DELIMITER)) != -1:
+            line = bytes(self._buffer[: end + 1])
+            del self._buffer[: end + 1]
+            self._decode(line)
+
+    def _decode(self, line: bytes) -> None:
+        """Feed an SMP packet to the decoder and queue the frame when it is complete."""
+
+        if line.startswith(smppacket.START_DELIMITER):
+            self._decoder = smppacket.decode()
+            next(self._decoder)
+        elif not line.startswith(smppacket.CONTINUE_DELIMITER) or self._decoder is None:
+            logger.debug(f"Ignoring serial data {line!r}")
+            return
+        try:
+            self._decoder.send(line)
+        except StopIteration as e:
+            self._decoder = None
+            self._worker.put(e.value, None)
+        except Exception as e:
+            self._decoder = None
+            logger.warning(f"Dropping a bad SMP packet: {e.__class__.__name__} - {e}")
+
+    def close(self) -> None:
+        self._worker.close()
+        asyncio.get_running_loop().remove_reader(self._master)
+        os.close(self._master)
+        os.close(self._slave)
+
+
+async def serve_pty(emulator: Emulator) -> PTYServer:
+    """Serve `emulator` over a new serial pseudo-terminal until the server is closed.
+
+    Only supported on POSIX systems.
+    """
+
+    return PTYServer(emulator)
+
+
+def emulator(
+    udp: Annotated[
+        str | None,
+        typer.Option(
+            metavar="HOST[:PORT]",
+            help="Serve SMP over UDP at this address; connect with smpmgr --ip HOST. "
+            "The port defaults to 1337, which is the port that smpmgr connects to.",
+        ),
+    ] = None,
+    pty: Annotated[
+        bool,
+        typer.Option(
+            "--pty",
+            help="Serve SMP over a serial pseudo-terminal; connect with smpmgr --port <path>. "
+            "POSIX only.",
+        ),
+    ] = False,
+    latency: Annotated[
+        float, typer.Option(min=0, help="Delay of every response, in milliseconds.")
+    ] = 0.0,
+    bandwidth: Annotated[
+        int | None, typer.Option(min=1, help="Link speed in bytes per second; unlimited if unset.")
+    ] = None,
+    flash_write_delay: Annotated[
+        float, typer.Option(min=0, help="Flash write delay in milliseconds per KiB.")
+    ] = 0.0,
+    buf_size: Annotated[
+        int, typer.Option(min=64, help="The MCUmgr buffer size; larger requests are dropped.")
+    ] = LinkModel.buf_size,
+    buf_count: Annotated[
+        int, typer.Option(min=1, help="The MCUmgr buffer count; further requests are dropped.")
+    ] = LinkModel.buf_count,
+    reset_delay: Annotated[
+        float, typer.Option(min=0, help="How long a reset takes, in milliseconds.")
+    ] = 0.0,
+) -> None:
+    """Run an emulated SMP server for testing without hardware.
+
+    Images, files, and statistics are kept in memory until the emulator is stopped with Ctrl-C.
+    Without --udp or --pty, the emulator is served over UDP on 127.0.0.1.
+    """
+
+    if pty and os.name != "posix":
+        typer.echo("--pty is only supported on POSIX systems.")
+        raise typer.Exit(code=1)
+
+    link: Final = LinkModel(
+        latency_s=latency / 1000,
+        bandwidth=bandwidth,
+        flash_write_s=flash_write_delay / 1000,
+        buf_size=buf_size,
+        buf_count=buf_count,
+        reset_s=reset_delay / 1000,
+    )
+
+    async def f() -> None:
+        emulator: Final = Emulator(link)
+        servers: Final[list[asyncio.DatagramTransport | PTYServer]] = []
+        try:
+            if udp is not None or not pty:
+                host, _, port = (udp or "127.0.0.1").partition(":")
+                servers.append(await serve_udp(emulator, host, int(port or 1337)))
+                typer.echo(f"Serving SMP over UDP on {host}:{port or 1337}; use smpmgr --ip {host}")
+            if pty:
+                pty_server = await serve_pty(emulator)
+                servers.append(pty_server)
+                typer.echo(
+                    f"Serving SMP over {pty_server.port}; use smpmgr --port {pty_server.port}"
+                )
+            await asyncio.Event().wait()
+        finally:
+            for server in servers:
+                server.close()
+
+    try:
+        run(f())
+    except KeyboardInterrupt:
+        pass
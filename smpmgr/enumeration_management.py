@@ -1,15 +1,16 @@
 """The enum subcommand group."""
 
-import asyncio
 import logging
 from typing import List, cast
 
 import typer
 from rich import print
+from smpclient.generics import success
 from smpclient.requests.enumeration_management import GroupDetails, ListSupportedGroups
 from typing_extensions import Annotated
 
-from smpmgr.common import Options, connect_with_spinner, get_smpclient, smp_request
+from smpmgr import capabilities
+from smpmgr.common import Options, connect_with_spinner, get_smpclient, run, smp_request
 
 app = typer.Typer(name="enum", help="The SMP Enumeration Management Group.")
 logger = logging.getLogger(__name__)
@@ -17,7 +18,11 @@ logger = logging.getLogger(__name__)
 
 @app.command()
 def get_supported_groups(ctx: typer.Context) -> None:
-    """Request groups supported by the server."""
+    """Request groups supported by the server.
+
+    The groups are also cached, so that later commands to a group that the device does not
+    support fail at once instead of after a timeout.
+    """
 
     options = cast(Options, ctx.obj)
     smpclient = get_smpclient(options)
@@ -26,8 +31,10 @@ def get_supported_groups(ctx: typer.Context) -> None:
         await connect_with_spinner(smpclient)
         r = await smp_request(smpclient, ListSupportedGroups(), "Waiting for supported groups...")  # type: ignore # noqa
         print(r)
+        if success(r):
+            capabilities.save_groups(smpclient.address, r.groups)
 
-    asyncio.run(f())
+    run(f())
 
 
 @app.command()
@@ -45,4 +52,4 @@ def get_group_details(
         r = await smp_request(smpclient, GroupDetails(groups=groups), "Waiting for group details...")  # type: ignore # noqa
         print(r)
 
-    asyncio.run(f())
+    run(f())
@@ -1,10 +1,13 @@
 """The image subcommand group."""
 
 import asyncio
+import hashlib
 import logging
+import zlib
+from enum import Enum, unique
 from io import BufferedReader
 from pathlib import Path
-from typing import cast
+from typing import Final, cast
 
 import typer
 from rich import print
@@ -12,27 +15,37 @@ from rich.progress import (
     BarColumn,
     DownloadColumn,
     Progress,
-    SpinnerColumn,
     TextColumn,
     TimeRemainingColumn,
     TransferSpeedColumn,
 )
+from rich.table import Table
 from smp.exceptions import SMPBadStartDelimiter
+from smp.header import GroupId
 from smpclient import SMPClient
 from smpclient.generics import error, success
 from smpclient.requests.file_management import (
+    FileDownload,
     FileHashChecksum,
     FileStatus,
     SupportedFileHashChecksumTypes,
 )
+from smpclient.transport import SMPTransportDisconnected
 from typing_extensions import Annotated
 
-from smpmgr.common import Options, connect_with_spinner, get_smpclient, smp_request
+from smpmgr import capabilities
+from smpmgr.common import Options, connect_with_spinner, get_smpclient, map_file, run, smp_request
 
 app = typer.Typer(name="file", help="The SMP File Management Group.")
 logger = logging.getLogger(__name__)
 
 
+@unique
+class HashType(Enum):
+    SHA256 = 'sha256'
+    CRC32 = 'crc32'
+
+
 @app.command()
 def get_supported_hash_types(ctx: typer.Context) -> None:
     """Request the supported hash types."""
@@ -52,7 +65,7 @@ def get_supported_hash_types(ctx: typer.Context) -> None:
         else:
             raise Exception("Unreachable")
 
-    asyncio.run(f())
+    run(f())
 
 
 @app.command()
@@ -74,7 +87,7 @@ def get_hash(
         else:
             raise Exception("Unreachable")
 
-    asyncio.run(f())
+    run(f())
 
 
 @app.command()
@@ -98,7 +111,7 @@ def read_size(
         else:
             raise Exception("Unreachable")
 
-    asyncio.run(f())
+    run(f())
 
 
 async def upload_with_progress_bar(
@@ -116,8 +129,7 @@ async def upload_with_progress_bar(
         TransferSpeedColumn(),
         "•",
         TimeRemainingColumn(),
-    ) as progress:
-        file_data = file.read()
+    ) as progress, map_file(file) as file_data:
         file.close()
         task = progress.add_task("Uploading", total=len(file_data), filename=file.name, start=True)
         try:
@@ -150,7 +162,106 @@ def upload(
         with open(file, "rb") as f:
             await upload_with_progress_bar(smpclient, f, destination)
 
-    asyncio.run(f())
+    run(f())
+
+
+async def download_with_progress_bar(
+    smpclient: SMPClient, file: str, destination: Path, resume: bool = True
+) -> None:
+    """Animate a progress bar while downloading the file, appending each chunk to a .part file.
+
+    The .part file is renamed to `destination` when the download is complete.  If `resume` is
+    `True` and a .part file is left over from an interrupted download, the download continues
+    from its end, unless the file on the SMP server no longer begins with the .part file.
+    """
+
+    part: Final = destination.with_name(f"{destination.name}.part")
+    offset = part.stat().st_size if resume and part.exists() else 0
+    length: int | None = None
+
+    if offset > 0:
+        r = await smp_request(smpclient, FileStatus(name=file), "Waiting for file size...")  # type: ignore # noqa
+        if error(r):
+            print(r)
+            raise typer.Exit(code=1)
+        elif success(r):
+            length = r.len
+        else:
+            raise Exception("Unreachable")
+        if offset > length:
+            logger.warning(f"{part} is larger than {file}, restarting the download")
+            offset = 0
+        elif not await _prefix_matches(smpclient, file, part):
+            logger.warning(f"{file} has changed since {part} was saved, restarting the download")
+            offset = 0
+        else:
+            logger.info(f"Resuming download of {file} from {offset=}")
+
+    with Progress(
+        TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
+        BarColumn(),
+        "[progress.percentage]{task.percentage:>3.1f}%",
+        "•",
+        DownloadColumn(),
+        "•",
+        TransferSpeedColumn(),
+        "•",
+        TimeRemainingColumn(),
+    ) as progress, part.open("ab" if offset > 0 else "wb") as part_f:
+        task = progress.add_task(
+            "Downloading", total=length, completed=offset, filename=file, start=True
+        )
+        try:
+            while length is None or offset < length:
+                response = await smpclient.request(FileDownload(off=offset, name=file))
+                if error(response):
+                    progress.stop()
+                    print(response)
+                    raise typer.Exit(code=1)
+                elif success(response):
+                    if response.len is not None:
+                        length = response.len
+                        progress.update(task, total=length)
+                    if length is None:
+                        progress.stop()
+                        logger.error(f"No length received: {response=}")
+                        raise typer.Exit(code=1)
+                    if len(response.data) == 0 and offset < length:
+                        progress.stop()
+                        logger.error(f"Empty chunk received at {offset=} of {length=}")
+                        raise typer.Exit(code=1)
+                    part_f.write(response.data)
+                    offset += len(response.data)
+                    progress.update(task, completed=offset)
+                    logger.info(f"Download {offset=}")
+                else:
+                    raise Exception("Unreachable")
+        except SMPBadStartDelimiter as e:
+            progress.stop()
+            logger.info(f"Bad start delimiter: {e}")
+            logger.error("Got an unexpected response, is the device an SMP server?")
+            raise typer.Exit(code=1)
+        except (OSError, SMPTransportDisconnected) as e:
+            logger.error(f"Connection to device lost: {e.__class__.__name__} - {e}")
+            logger.error(f"Saved {offset} B to {part}, download again to resume")
+            raise typer.Exit(code=1)
+
+    part.replace(destination)
+
+
+async def _prefix_matches(smpclient: SMPClient, file: str, part: Path) -> bool:
+    """Return `True` if the file on the SMP server begins with the contents of `part`.
+
+    A file that was rewritten after `part` was saved, e.g. a rotated log, may have grown past
+    the end of `part`, so the hash of its prefix is compared rather than only its length.
+    """
+
+    with open(part, "rb") as f, map_file(f) as data:
+        try:
+            return await _hash_matches(smpclient, file, data, HashType.SHA256)
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout waiting for the hash of {file}")
+            raise typer.Exit(code=1)
 
 
 @app.command()
@@ -164,6 +275,13 @@ def download(
             " file will be saved in the cwd with its original name."
         ),
     ] = None,
+    resume: Annotated[
+        bool,
+        typer.Option(
+            help="Continue an interrupted download from the end of the <destination>.part file,"
+            " if the file on the SMP Server still begins with it."
+        ),
+    ] = True,
 ) -> None:
     """Download a file."""
 
@@ -174,17 +292,135 @@ def download(
 
     async def f() -> None:
         await connect_with_spinner(smpclient)
+        await download_with_progress_bar(smpclient, file, destination, resume)
+
+    run(f())
+
 
-        with Progress(
-            SpinnerColumn(), TextColumn("[progress.description]{task.description}")
-        ) as progress:
-            download_task = progress.add_task(description=f"Downloading {file}", total=None)
-            file_data = await smpclient.download_file(file)
-            progress.update(download_task, description=f"Downloaded {file}", completed=True)
+def _local_hash(data: bytes, hash_type: HashType) -> bytes | int:
+    """Return the hash of `data` in the form that FileHashChecksum responds with."""
+
+    if hash_type == HashType.SHA256:
+        return hashlib.sha256(data).digest()
+    elif hash_type == HashType.CRC32:
+        return zlib.crc32(data)
+    else:
+        raise Exception("Unreachable")
+
+
+async def _hash_matches(smpclient: SMPClient, name: str, data: bytes, hash_type: HashType) -> bool:
+    """Return `True` if the first `len(data)` bytes of the file `name` on the SMP server match.
+
+    The hash is computed on the SMP server with `hash_type`, or with the other `HashType` if the
+    SMP server does not support it.  Returns `False` if it supports neither.
+    """
+
+    for t in [hash_type] + [t for t in HashType if t != hash_type]:
+        r = await smpclient.request(
+            FileHashChecksum(name=name, type=t.value, off=0, len=len(data))  # type: ignore # noqa
+        )
+        if error(r):
+            logger.info(f"Could not get the {t.value} of {name}: {r}")
+        elif success(r):
+            return r.len == len(data) and r.output == _local_hash(data, t)
+        else:
+            raise Exception("Unreachable")
+    logger.warning(f"Could not get a hash of {name} from the SMP server")
+    return False
 
-            save_task = progress.add_task(description=f"Saving {destination}", total=len(file_data))
-            with destination.open("wb") as dest_f:
-                dest_f.write(file_data)
-            progress.update(save_task, description=f"Saved {destination}", completed=True)
 
-    asyncio.run(f())
+async def _remote_matches(
+    smpclient: SMPClient, name: str, data: bytes, hash_type: HashType
+) -> bool:
+    """Return `True` if the file `name` on the SMP server has the same contents as `data`.
+
+    The length is compared first so that the SMP server only hashes files that might match.
+    """
+
+    status: Final = await smpclient.request(FileStatus(name=name))
+    if error(status):
+        logger.info(f"{name} not found on the SMP server: {status}")
+        return False
+    elif success(status):
+        if status.len != len(data):
+            logger.info(f"{name} length differs: local={len(data)} remote={status.len}")
+            return False
+    else:
+        raise Exception("Unreachable")
+
+    return await _hash_matches(smpclient, name, data, hash_type)
+
+
+@app.command()
+def sync(
+    ctx: typer.Context,
+    local_dir: Annotated[
+        Path,
+        typer.Argument(exists=True, file_okay=False, help="The directory to upload from"),
+    ],
+    remote_dir: Annotated[str, typer.Argument(help="The directory on the SMP Server")],
+    hash_type: Annotated[
+        HashType,
+        typer.Option(
+            help="The hash used to compare local and remote files; the other one is used if the"
+            " SMP Server does not support it."
+        ),
+    ] = HashType.SHA256,
+    dry_run: Annotated[
+        bool, typer.Option("--dry-run", help="Only report which files would be uploaded.")
+    ] = False,
+) -> None:
+    """Upload the files in LOCAL_DIR that are missing or different in REMOTE_DIR.
+
+    Files are compared by length and then by a hash computed on the SMP Server.
+    The remote directories must already exist.  If the device is known not to support the file
+    group, the command fails at once instead of after a timeout.
+    """
+
+    options = cast(Options, ctx.obj)
+    smpclient = get_smpclient(options)
+
+    files: Final = sorted(p for p in local_dir.rglob("*") if p.is_file())
+    remote_root: Final = remote_dir.rstrip("/")
+
+    async def f() -> None:
+        await connect_with_spinner(smpclient)
+        await capabilities.require(smpclient, GroupId.FILE_MANAGEMENT)
+
+        table = Table(title=f"Sync {local_dir} -> {remote_root}/")
+        table.add_column("File", style="cyan")
+        table.add_column("Size", justify="right")
+        table.add_column("Action")
+        skipped = transferred = 0
+
+        for path in files:
+            name = f"{remote_root}/{path.relative_to(local_dir).as_posix()}"
+            with open(path, "rb") as file:
+                with map_file(file) as data:
+                    try:
+                        matches = await _remote_matches(smpclient, name, data, hash_type)
+                    except asyncio.TimeoutError:
+                        logger.error(f"Timeout waiting for response about {name}")
+                        raise typer.Exit(code=1)
+                    except (OSError, SMPTransportDisconnected) as e:
+                        logger.error(f"Connection to device lost: {e.__class__.__name__} - {e}")
+                        raise typer.Exit(code=1)
+                    size = len(data)
+                if matches:
+                    skipped += size
+                    table.add_row(name, f"{size} B", "[dim]unchanged[/dim]")
+                    continue
+                if not dry_run:
+                    await upload_with_progress_bar(smpclient, file, name)
+                transferred += size
+                table.add_row(
+                    name, f"{size} B", "[yellow]would upload" if dry_run else "[green]uploaded"
+                )
+
+        print(table)
+        print(
+            f"{'Would transfer' if dry_run else 'Transferred'} {transferred} B, "
+            f"skipped {skipped} B unchanged."
+        )
+
+    run(f())
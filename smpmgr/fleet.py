@@ -0,0 +1,309 @@
+"""Concurrent operations on many SMP servers."""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Final, Sequence
+
+import typer
+from rich import print
+from rich.progress import (
+    BarColumn,
+    DownloadColumn,
+    Progress,
+    TaskID,
+    TextColumn,
+    TransferSpeedColumn,
+)
+from rich.table import Table
+from smp import error as smperr
+from smp.image_management import ImageState
+from smp.os_management import OS_MGMT_RET_RC
+from smpclient import SMPClient
+from smpclient.generics import SMPRequest, TEr1, TEr2, TRep, error, error_v1, error_v2, success
+from smpclient.requests.image_management import ImageStatesRead, ImageStatesWrite
+from smpclient.requests.os_management import ResetWrite
+from typing_extensions import assert_never
+
+from smpmgr import capabilities, trace
+from smpmgr.common import Options, TransportDefinition, get_address, get_transport
+from smpmgr.image_management import check_booted, find_image, upload_with_retries, wait_for_boot
+
+logger: Final = logging.getLogger(__name__)
+
+
+class UpgradeError(Exception):
+    """Raised when one step of a device upgrade fails."""
+
+
+@dataclass(frozen=True)
+class UpgradeResult:
+    """The outcome of upgrading one SMP server."""
+
+    target: str
+    ok: bool
+    duration_s: float
+    detail: str
+
+
+def parse_target(target: str) -> TransportDefinition:
+    """Parse a target like `port:/dev/ttyACM0`, `ip:192.168.1.10` or `ble:AA:BB:CC:DD:EE:FF`."""
+
+    kind, _, address = target.strip().partition(":")
+    if not address or kind not in {"port", "ip", "ble"}:
+        raise typer.BadParameter(
+            f"Invalid target '{target}', expected one of port:<port>, ip:<ip>, or ble:<address>"
+        )
+    return TransportDefinition(
+        port=address if kind == "port" else None,
+        ble=address if kind == "ble" else None,
+        ip=address if kind == "ip" else None,
+    )
+
+
+def load_targets(path: Path) -> list[TransportDefinition]:
+    """Load one target per line from `path`, ignoring blank lines and `#` comments."""
+
+    return [
+        parse_target(line)
+        for line in (line.split("#", 1)[0].strip() for line in path.read_text().splitlines())
+        if line
+    ]
+
+
+def get_target_options(
+    options: Options, targets: Sequence[str], targets_file: Path | None
+) -> list[Options]:
+    """Return an `Options` per target given by `--target`, `--targets-file`, or the global options.
+
+    Returns an empty list if no target was given.
+    """
+
+    transports: Final = [parse_target(target) for target in targets]
+    if targets_file is not None:
+        transports.extend(load_targets(targets_file))
+    if transports and options.transport != TransportDefinition(port=None, ble=None, ip=None):
+        transports.insert(0, options.transport)
+
+    return [replace(options, transport=t) for t in dict.fromkeys(transports)]
+
+
+def target_label(options: Options) -> str:
+    """Return the target of `options` in the form accepted by `parse_target()`."""
+
+    t: Final = options.transport
+    return f"port:{t.port}" if t.port else f"ble:{t.ble}" if t.ble else f"ip:{t.ip}"
+
+
+async def _request_ok(smpclient: SMPClient, request: SMPRequest[TRep, TEr1, TEr2]) -> None:
+    """Make `request` and raise `UpgradeError` if the SMP server reports an error."""
+
+    response: Final = await smpclient.request(request)
+    if success(response):
+        return
+    elif error(response):
+        if error_v1(response):
+            if response.rc == smperr.MGMT_ERR.EOK:
+                return
+        elif error_v2(response):
+            if isinstance(request, ResetWrite) and response.err.rc == OS_MGMT_RET_RC.OK:
+                return
+        else:
+            assert_never(response)
+        raise UpgradeError(f"{request.__class__.__name__} failed: {response}")
+    else:
+        assert_never(response)
+
+
+async def _read_image_hash(smpclient: SMPClient, slot: int) -> bytes:
+    """Return the hash of the image in `slot`, as reported by the SMP server."""
+
+    response: Final = await smpclient.request(ImageStatesRead())
+    if error(response):
+        raise UpgradeError(f"ImageStatesRead failed: {response}")
+    elif success(response):
+        for image in response.images:
+            if image.slot == slot and image.hash is not None:
+                return image.hash
+        raise UpgradeError(f"Image with slot {slot} not found!")
+    else:
+        assert_never(response)
+
+
+async def _upgrade_one(
+    options: Options,
+    image: bytes,
+    image_hash: bytes | None,
+    slot: int,
+    confirm: bool,
+    progress: Progress,
+    task: TaskID,
+    retries: int,
+    force: bool,
+    wait_timeout: float | None,
+) -> str:
+    """Connect, upload, mark, and reset one SMP server, reporting to `progress`.
+
+    If `wait_timeout` is not `None`, wait for the SMP server to boot and check that it runs the
+    image.  Returns a note for the summary, e.g. if the upload was skipped.
+    """
+
+    trace.track(target_label(options))
+    smpclient: Final = SMPClient(get_transport(options), get_address(options), options.timeout)
+
+    progress.update(task, status="connecting")
+    try:
+        with trace.span("connect"):
+            await smpclient.connect()
+    except Exception as e:
+        raise UpgradeError(f"Connection failed: {e.__class__.__name__} - {e}") from e
+
+    try:
+        installed: ImageState | None = None
+        if not force and image_hash is not None:
+            progress.update(task, status="checking")
+            with trace.span("ImageStatesRead"):
+                installed = find_image(await smpclient.request(ImageStatesRead()), image_hash)
+
+        if installed is None:
+            progress.update(task, status="uploading")
+            progress.start_task(task)
+            with trace.span("upload", size=len(image), slot=slot):
+                async for offset, resumed in upload_with_retries(smpclient, image, slot, retries):
+                    if resumed:
+                        logger.info(f"{target_label(options)} upload resumed at {offset=}")
+                    progress.update(task, completed=offset)
+        elif installed.active:
+            if confirm and not installed.confirmed:
+                progress.update(task, status="confirming")
+                with trace.span("ImageStatesWrite", confirm=True):
+                    await _request_ok(smpclient, ImageStatesWrite(hash=None, confirm=True))
+            return "already running"
+
+        hash = image_hash
+        marked: Final = slot != 0 or confirm or installed is not None
+        if marked or wait_timeout is not None:  # with a wait, the image should be swapped in
+            progress.update(task, status="marking")
+            try:
+                if hash is None:
+                    hash = await _read_image_hash(smpclient, slot)
+                with trace.span("ImageStatesWrite", confirm=confirm):
+                    await _request_ok(smpclient, ImageStatesWrite(hash=hash, confirm=confirm))
+            except UpgradeError as e:
+                if marked:
+                    raise
+                # e.g. a bootloader that wrote the image to the primary slot
+                logger.info(f"{target_label(options)}: could not mark the image: {e}")
+            capabilities.forget(get_address(options))  # another image will run after the reset
+
+        progress.update(task, status="resetting")
+        with trace.span("ResetWrite"):
+            await _request_ok(smpclient, ResetWrite())
+        reset_time: Final = time.monotonic()
+        detail: Final = (
+            "" if installed is None else f"upload skipped, already in slot {installed.slot}"
+        )
+        if wait_timeout is None:
+            return detail
+
+        progress.update(task, status="booting")
+        with trace.span("wait"):
+            boot: Final = await wait_for_boot(smpclient, reset_time, wait_timeout)
+        if hash is not None:
+            reason: Final = check_booted(boot.states, hash, confirm)
+            if reason is not None:
+                raise UpgradeError(reason)
+        return ", ".join(filter(None, (detail, f"booted in {boot.duration_s:.1f} s")))
+    finally:
+        try:
+            await smpclient.disconnect()
+        except Exception as e:
+            logger.debug(f"Ignoring error while disconnecting: {e.__class__.__name__} - {e}")
+
+
+async def upgrade_many(
+    targets: Sequence[Options],
+    image: bytes,
+    image_hash: bytes | None,
+    slot: int,
+    confirm: bool,
+    jobs: int,
+    retries: int = 0,
+    force: bool = False,
+    wait_timeout: float | None = None,
+) -> list[UpgradeResult]:
+    """Upgrade `targets` concurrently, at most `jobs` at a time, with a progress row per device.
+
+    The `image` is shared, read-only, by all of the workers.  If `image_hash` is `None`, it is
+    read back from each device after the upload.  Otherwise, devices that already have the
+    image are not uploaded to, unless `force` is `True`.  See `upload_with_retries()` for the
+    meaning of `retries`, and `_upgrade_one()` for `wait_timeout`.
+    """
+
+    semaphore: Final = asyncio.Semaphore(jobs)
+
+    with Progress(
+        TextColumn("[bold blue]{task.fields[target]}", justify="right"),
+        TextColumn("{task.fields[status]:<10}"),
+        BarColumn(),
+        "[progress.percentage]{task.percentage:>3.1f}%",
+        "•",
+        DownloadColumn(),
+        "•",
+        TransferSpeedColumn(),
+    ) as progress:
+
+        async def worker(options: Options) -> UpgradeResult:
+            label: Final = target_label(options)
+            task: Final = progress.add_task(
+                "Upgrading", total=len(image), target=label, status="queued", start=False
+            )
+            async with semaphore:
+                start: Final = time.monotonic()
+                try:
+                    detail: Final = await _upgrade_one(
+                        options,
+                        image,
+                        image_hash,
+                        slot,
+                        confirm,
+                        progress,
+                        task,
+                        retries,
+                        force,
+                        wait_timeout,
+                    )
+                except Exception as e:
+                    logger.info(f"{label} failed: {e.__class__.__name__} - {e}")
+                    progress.update(task, status="[red]failed")
+                    return UpgradeResult(label, False, time.monotonic() - start, str(e))
+                progress.update(
+                    task, status="[green]skipped" if "skipped" in detail else "[green]done"
+                )
+                return UpgradeResult(label, True, time.monotonic() - start, detail)
+
+        return await asyncio.gather(*(worker(options) for options in targets))
+
+
+def print_summary(results: Sequence[UpgradeResult]) -> None:
+    """Print a pass/fail table of the `results`."""
+
+    table: Final = Table(title="Upgrade Summary")
+    table.add_column("Target", style="cyan")
+    table.add_column("Result")
+    table.add_column("Time (s)", justify="right")
+    table.add_column("Detail")
+
+    for r in results:
+        table.add_row(
+            r.target,
+            "[green]PASS[/green]" if r.ok else "[red]FAIL[/red]",
+            f"{r.duration_s:.1f}",
+            r.detail,
+        )
+
+    print(table)
+    passed: Final = sum(r.ok for r in results)
+    print(f"{passed}/{len(results)} devices upgraded.")
@@ -2,9 +2,11 @@
 
 import asyncio
 import logging
+import time
+from dataclasses import dataclass
 from io import BufferedReader
 from pathlib import Path
-from typing import Annotated, cast
+from typing import Annotated, AsyncIterator, Final, List, cast
 
 import typer
 from rich import print
@@ -16,17 +18,51 @@ from rich.progress import (
     TimeRemainingColumn,
     TransferSpeedColumn,
 )
+from rich.table import Table
 from smp.exceptions import SMPBadStartDelimiter
+from smp.image_management import (
+    ImageManagementErrorV1,
+    ImageManagementErrorV2,
+    ImageState,
+    ImageStatesReadResponse,
+)
 from smpclient import SMPClient
 from smpclient.generics import error, success
-from smpclient.mcuboot import ImageInfo
 from smpclient.requests.image_management import ImageErase, ImageStatesRead, ImageStatesWrite
-
-from smpmgr.common import Options, connect_with_spinner, get_smpclient, smp_request
+from smpclient.transport import SMPTransportDisconnected
+
+from smpmgr import trace
+from smpmgr.common import (
+    Options,
+    connect_with_spinner,
+    get_smpclient,
+    map_file,
+    run,
+    smp_request,
+    try_request,
+)
+from smpmgr.preflight import ImageCheck, check_files
 
 app = typer.Typer(name="image", help="The SMP Image Management Group.")
 logger = logging.getLogger(__name__)
 
+RESUME_RETRIES: Final = 5
+"""Default number of reconnects for an upload with `--resume`."""
+RETRY_BACKOFF_S: Final = 0.5
+"""Delay before the first reconnect, doubled for each subsequent reconnect."""
+RETRY_BACKOFF_MAX_S: Final = 8.0
+"""Maximum delay between reconnects."""
+BOOT_TIMEOUT_S: Final = 300.0
+"""Default time to wait for the device to answer after a reset with `upgrade --wait`."""
+BOOT_POLL_S: Final = 0.5
+"""Delay after a reset before the first poll, doubled for each subsequent poll.
+
+It is longer than the delay of Zephyr's `ResetWrite` handler before it resets, 250 ms by
+default, so that the image that is being replaced does not answer the first poll.
+"""
+BOOT_POLL_MAX_S: Final = 4.0
+"""Maximum delay between polls, which is the resolution of the measured boot time."""
+
 
 @app.command()
 def state_read(ctx: typer.Context) -> None:
@@ -52,7 +88,7 @@ def state_read(ctx: typer.Context) -> None:
         else:
             raise Exception("Unreachable")
 
-    asyncio.run(f())
+    run(f())
 
 
 @app.command()
@@ -105,7 +141,7 @@ def state_write(
         else:
             raise Exception("Unreachable")
 
-    asyncio.run(f())
+    run(f())
 
 
 @app.command()
@@ -133,13 +169,234 @@ def erase(
         else:
             raise Exception("Unreachable")
 
-    asyncio.run(f())
+    run(f())
+
+
+@app.command()
+def inspect(
+    files: Annotated[
+        List[Path],
+        typer.Argument(exists=True, dir_okay=False, help="Paths to FW images"),
+    ],
+    jobs: Annotated[
+        int, typer.Option(min=1, help="Maximum number of images to hash concurrently.")
+    ] = 4,
+    cache: Annotated[
+        bool,
+        typer.Option(
+            help="Reuse the results of images that have not changed since they were inspected."
+        ),
+    ] = True,
+) -> None:
+    """Verify FW images locally, without a device.
+
+    Each image is read once to check its hash TLV, and its signature TLV if it has one.  The
+    signature is not verified cryptographically, only that it is present and well formed.
+    """
+
+    checks: Final = check_files(files, jobs, cache)
+
+    table: Final = Table(title="Image Inspection")
+    table.add_column("File", style="cyan")
+    table.add_column("Version")
+    table.add_column("Hash")
+    table.add_column("Signature")
+    table.add_column("Result")
+    for check in checks:
+        table.add_row(
+            check.path,
+            check.version or "",
+            f"{check.hash_type} {check.tlv_hash}" if check.tlv_hash is not None else "none",
+            check.signature or "none",
+            "[green]OK[/green]" if check.ok else f"[red]{check.error}[/red]",
+        )
+    print(table)
+
+    if not all(check.ok for check in checks):
+        raise typer.Exit(code=1)
+
+
+def find_image(
+    r: ImageStatesReadResponse | ImageManagementErrorV1 | ImageManagementErrorV2,
+    image_hash: bytes,
+) -> ImageState | None:
+    """Return the state of the image with `image_hash` from the `ImageStatesRead` response `r`.
+
+    Returns `None` if the image is not found or if the SMP server responded with an error, e.g.
+    a bootloader that does not support reading the image states, so that the caller falls back
+    to uploading the image.
+    """
+
+    if error(r):
+        logger.info(f"Could not read the image states, the image will be uploaded: {r}")
+        return None
+    elif success(r):
+        for image in r.images:
+            if image.hash == image_hash:
+                logger.info(f"Found the image on the device: {image}")
+                return image
+        return None
+    else:
+        raise Exception("Unreachable")
+
+
+def verify_image(file: Path) -> ImageCheck:
+    """Verify the MCUboot image `file` before it is uploaded, or raise `typer.Exit`.
+
+    The hash TLV is checked against the file, see `smpmgr.preflight`.
+    """
+
+    try:
+        check: Final = check_files([file])[0]
+    except OSError as e:
+        typer.echo(f"Inspection of FW image failed: {e}")
+        raise typer.Exit(code=1)
+    if not check.ok:
+        typer.echo(f"Inspection of FW image failed: {check.error}")
+        raise typer.Exit(code=1)
+    return check
+
+
+async def upload_with_retries(
+    smpclient: SMPClient, image: bytes, slot: int = 0, retries: int = 0
+) -> AsyncIterator[tuple[int, bool]]:
+    """Iteratively upload the `image` to `slot`, yielding the offset and whether it was resumed.
+
+    If the connection is lost, or a response is lost, e.g. over UDP, reconnect up to `retries`
+    times, with exponential backoff, and restart the upload.  The SMP server recognizes the
+    SHA256 of the `image` in the first packet and responds with the offset that it had already
+    received, which is yielded with `True`.
+
+    Each chunk and reconnect is recorded in the `smpmgr.trace`, if one is active.
+    """
+
+    attempt = 0
+    while True:
+        try:
+            resumed = attempt > 0
+            chunk_start = time.monotonic()
+            async for offset in smpclient.upload(image, slot):
+                trace.complete("chunk", chunk_start, offset=offset, resumed=resumed)
+                yield offset, resumed
+                resumed = False
+                chunk_start = time.monotonic()
+            return
+        except (OSError, SMPTransportDisconnected, asyncio.TimeoutError) as e:
+            if attempt >= retries:
+                raise
+            attempt += 1
+            delay = min(RETRY_BACKOFF_S * 2 ** (attempt - 1), RETRY_BACKOFF_MAX_S)
+            logger.warning(
+                f"Connection to device lost: {e.__class__.__name__} - {e}; "
+                f"reconnecting in {delay:.1f}s ({attempt}/{retries})"
+            )
+            trace.instant("connection lost", error=f"{e.__class__.__name__} - {e}")
+            try:
+                await smpclient.disconnect()
+            except Exception as e:
+                logger.debug(f"Ignoring error while disconnecting: {e.__class__.__name__} - {e}")
+            await asyncio.sleep(delay)
+            try:
+                with trace.span("reconnect", attempt=attempt):
+                    await smpclient.connect()
+            except Exception as e:
+                logger.warning(f"Reconnect failed: {e.__class__.__name__} - {e}")
+
+
+@dataclass(frozen=True)
+class BootResult:
+    """The image states read from a device once it answered again after a reset."""
+
+    states: ImageStatesReadResponse | ImageManagementErrorV1 | ImageManagementErrorV2
+    duration_s: float
+    """The time from the reset until the device answered, i.e. the swap and boot time."""
+    polls: int
+
+
+async def wait_for_boot(
+    smpclient: SMPClient, reset_time: float, timeout_s: float = BOOT_TIMEOUT_S
+) -> BootResult:
+    """Poll the device with `ImageStatesRead` until it answers after the reset at `reset_time`.
+
+    The transport is reconnected before each poll, with exponential backoff between polls, since
+    a serial or BLE device disappears while MCUboot swaps the images.  `reset_time` is from
+    `time.monotonic()`.
+
+    Raises:
+        TimeoutError: if the device does not answer within `timeout_s` of `reset_time`
+    """
+
+    transport: Final = smpclient._transport
+    polls = 0
+    while True:
+        try:
+            await transport.disconnect()
+        except Exception as e:
+            logger.debug(f"Ignoring error while disconnecting: {e.__class__.__name__} - {e}")
+
+        delay = min(BOOT_POLL_S * 2**polls, BOOT_POLL_MAX_S)
+        remaining = reset_time + timeout_s - time.monotonic()
+        if remaining <= delay:
+            raise TimeoutError(f"The device did not answer within {timeout_s:.0f} s of the reset")
+        await asyncio.sleep(delay)
+        polls += 1
+        poll_timeout_s = min(smpclient._timeout_s, remaining - delay)
+
+        try:
+            with trace.span("poll", attempt=polls):
+                await transport.connect(smpclient._address, poll_timeout_s)
+                states = await try_request(smpclient, ImageStatesRead(), poll_timeout_s)
+        except Exception as e:  # e.g. the serial port has not enumerated again yet
+            logger.info(f"Device is not ready: {e.__class__.__name__} - {e} ({polls=})")
+            continue
+        if states is None:
+            continue
+
+        duration_s = time.monotonic() - reset_time
+        logger.info(f"Device answered {duration_s:.1f} s after the reset ({polls=})")
+        return BootResult(states, duration_s, polls)
+
+
+def check_booted(
+    r: ImageStatesReadResponse | ImageManagementErrorV1 | ImageManagementErrorV2,
+    image_hash: bytes,
+    confirm: bool,
+) -> str | None:
+    """Return why the image with `image_hash` is not running as expected after a reset.
+
+    The image should be active, and confirmed too if it was marked with `confirm`.  Returns
+    `None` if it is.
+    """
+
+    if error(r):
+        return f"Could not read the image states: {r}"
+    elif success(r):
+        image: Final = find_image(r, image_hash)
+        if image is None:
+            return "The image is not on the device"
+        if image.pending:
+            return f"The image is still pending in slot {image.slot}, it was not swapped in"
+        if not image.active:
+            return f"The image is in slot {image.slot} but it is not running"
+        if confirm and not image.confirmed:
+            return "The image is running but not confirmed"
+        return None
+    else:
+        raise Exception("Unreachable")
 
 
 async def upload_with_progress_bar(
-    smpclient: SMPClient, file: typer.FileBinaryRead | BufferedReader, slot: int = 0
+    smpclient: SMPClient,
+    file: typer.FileBinaryRead | BufferedReader,
+    slot: int = 0,
+    retries: int = 0,
 ) -> None:
-    """Animate a progress bar while uploading the FW image."""
+    """Animate a progress bar while uploading the FW image.
+
+    See `upload_with_retries()` for the meaning of `retries`.
+    """
+
+    saved = 0
 
     with Progress(
         TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
@@ -151,12 +408,14 @@ async def upload_with_progress_bar(
         TransferSpeedColumn(),
         "•",
         TimeRemainingColumn(),
-    ) as progress:
-        image = file.read()
+    ) as progress, map_file(file) as image:
         file.close()
         task = progress.add_task("Uploading", total=len(image), filename=file.name, start=True)
         try:
-            async for offset in smpclient.upload(image, slot):
+            async for offset, resumed in upload_with_retries(smpclient, image, slot, retries):
+                if resumed:
+                    logger.info(f"Upload resumed at {offset=}")
+                    saved += offset
                 progress.update(task, completed=offset)
                 logger.info(f"Upload {offset=}")
         except SMPBadStartDelimiter as e:
@@ -164,32 +423,65 @@ async def upload_with_progress_bar(
             logger.info(f"Bad start delimiter: {e}")
             logger.error("Got an unexpected response, is the device an SMP server?")
             raise typer.Exit(code=1)
-        except OSError as e:
+        except (OSError, SMPTransportDisconnected, asyncio.TimeoutError) as e:
             logger.error(f"Connection to device lost: {e.__class__.__name__} - {e}")
             raise typer.Exit(code=1)
 
+    if saved > 0:
+        print(f"Resumed the upload; {saved} B did not have to be sent again.")
+
 
 @app.command()
 def upload(
     ctx: typer.Context,
     file: Annotated[Path, typer.Argument(help="Path to FW image")],
     slot: Annotated[int, typer.Option(help="The image slot to upload to")] = 0,
+    resume: Annotated[
+        bool,
+        typer.Option(
+            "--resume",
+            help="If the connection is lost, reconnect and continue from the offset that the "
+            "device had received.",
+        ),
+    ] = False,
+    retries: Annotated[
+        int, typer.Option(min=0, help="How many times to reconnect with --resume.")
+    ] = RESUME_RETRIES,
+    force: Annotated[
+        bool,
+        typer.Option(
+            "--force", help="Upload the image even if the device already has an identical one."
+        ),
+    ] = False,
 ) -> None:
-    """Upload a FW image."""
+    """Upload a FW image.
 
-    try:
-        image_info = ImageInfo.load_file(str(file))
-        logger.info(str(image_info))
-    except Exception:
-        logger.exception("Inspection of FW image failed")
-        raise typer.Exit(code=1)
+    The upload is skipped if an image with the same IMAGE_TLV_SHA256 is already on the device.
+    """
+
+    image_hash: Final = verify_image(file).hash
+    if image_hash is None:
+        logger.warning("Could not find IMAGE_TLV_SHA256 in image, it will always be uploaded")
 
     options = cast(Options, ctx.obj)
     smpclient = get_smpclient(options)
 
     async def f() -> None:
         await connect_with_spinner(smpclient)
+        if not force and image_hash is not None:
+            installed = find_image(
+                await smp_request(
+                    smpclient, ImageStatesRead(), "Checking for the image on the device..."
+                ),
+                image_hash,
+            )
+            if installed is not None:
+                print(
+                    f"The image is already in slot {installed.slot}, skipping the upload. "
+                    "Use --force to upload it anyway."
+                )
+                return
         with open(file, "rb") as f:
-            await upload_with_progress_bar(smpclient, f, slot)
+            await upload_with_progress_bar(smpclient, f, slot, retries if resume else 0)
 
-    asyncio.run(f())
+    run(f())
@@ -0,0 +1,85 @@
+"""A Typer group that imports its subcommands only when they are used."""
+
+import logging
+from importlib import import_module
+from pathlib import Path
+from typing import ClassVar, Final, List, Mapping, NamedTuple
+
+import click
+import typer
+from typer.core import TyperGroup
+from typer.main import get_command_from_info, get_group_from_info
+from typer.models import CommandInfo, TyperInfo
+
+from smpmgr.plugins import load_module
+
+logger: Final = logging.getLogger(__name__)
+
+
+class LazyCommand(NamedTuple):
+    """A subcommand defined by the attribute `attr` of the module `module`.
+
+    The attribute is either a `typer.Typer` group or a command function.  `help` is shown in the
+    command list of `--help` so that listing the commands does not import them.  If `path` is
+    given, the module is loaded from that file, e.g. a plugin, rather than imported by name.
+    """
+
+    module: str
+    attr: str
+    help: str
+    path: Path | None = None
+
+
+class LazyGroup(TyperGroup):
+    """A `TyperGroup` whose `lazy_commands` are imported the first time that they are invoked."""
+
+    lazy_commands: ClassVar[Mapping[str, LazyCommand]] = {}
+
+    _listing: bool = False
+
+    def list_commands(self, ctx: click.Context) -> List[str]:
+        return list(self.lazy_commands) + [
+            name for name in super().list_commands(ctx) if name not in self.lazy_commands
+        ]
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command | None:
+        if cmd_name not in self.lazy_commands or cmd_name in self.commands:
+            return super().get_command(ctx, cmd_name)
+
+        lazy: Final = self.lazy_commands[cmd_name]
+        if self._listing:  # a placeholder is enough to list the command in --help
+            return click.Command(cmd_name, help=lazy.help)
+
+        logger.debug(f"Importing {lazy.module}.{lazy.attr} for the {cmd_name} command")
+        module: Final = (
+            import_module(lazy.module) if lazy.path is None else load_module(lazy.module, lazy.path)
+        )
+        obj: Final = getattr(module, lazy.attr)
+        command: Final = (
+            get_group_from_info(
+                TyperInfo(obj),
+                pretty_exceptions_short=True,
+                rich_markup_mode=self.rich_markup_mode,
+            )
+            if isinstance(obj, typer.Typer)
+            else get_command_from_info(
+                CommandInfo(name=cmd_name, callback=obj),
+                pretty_exceptions_short=True,
+                rich_markup_mode=self.rich_markup_mode,
+            )
+        )
+        self.add_command(command, cmd_name)
+        return command
+
+    def format_help(self, ctx: click.Context, formatter: click.HelpFormatter) -> None:
+        self._listing = True
+        try:
+            super().format_help(ctx, formatter)
+        finally:
+            self._listing = False
+
+
+def lazy_group(commands: Mapping[str, LazyCommand]) -> type[LazyGroup]:
+    """Return a `LazyGroup` class for `typer.Typer(cls=...)` that provides `commands`."""
+
+    return type("LazyGroup", (LazyGroup,), {"lazy_commands": dict(commands)})
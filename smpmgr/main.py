@@ -1,6 +1,5 @@
 """Entry point for the `smpmgr` application."""
 
-import asyncio
 import logging
 import sys
 from importlib.metadata import version as get_version
@@ -10,34 +9,11 @@ from typing import Final, cast
 import typer
 import typer.rich_utils
 from rich import print
-from smp import error as smperr
-from smp.os_management import OS_MGMT_RET_RC
-from smpclient.generics import error, error_v1, error_v2, success
-from smpclient.mcuboot import IMAGE_TLV, ImageInfo, TLVNotFound
-from smpclient.requests.image_management import ImageStatesRead, ImageStatesWrite
-from smpclient.requests.os_management import ResetWrite
-from typing_extensions import Annotated, assert_never
+from typing_extensions import Annotated
 
-from smpmgr import (
-    enumeration_management,
-    file_management,
-    image_management,
-    os_management,
-    shell_management,
-    stat_management,
-    terminal,
-)
-from smpmgr.common import (
-    Options,
-    TransportDefinition,
-    connect_with_spinner,
-    get_smpclient,
-    smp_request,
-)
-from smpmgr.image_management import upload_with_progress_bar
+from smpmgr.lazy import LazyCommand, lazy_group
 from smpmgr.logging import LogLevel, setup_logging
 from smpmgr.plugins import get_plugins
-from smpmgr.user import intercreate
 
 logger = logging.getLogger(__name__)
 
@@ -64,18 +40,44 @@ HELP_LINES: Final = (
 # Override the dimming of the help text
 typer.rich_utils.STYLE_HELPTEXT = ""
 
-app: Final = typer.Typer(help="".join(HELP_LINES), rich_markup_mode="rich")
-app.add_typer(os_management.app)
-app.add_typer(stat_management.app)
-app.add_typer(image_management.app)
-app.add_typer(file_management.app)
-app.add_typer(enumeration_management.app)
-app.add_typer(intercreate.app)
-app.command()(shell_management.shell)
-app.command()(terminal.terminal)
+COMMANDS: Final = {
+    "os": LazyCommand("smpmgr.os_management", "app", "The SMP OS Management Group."),
+    "statistics": LazyCommand("smpmgr.stat_management", "app", "The SMP stat Management Group."),
+    "image": LazyCommand("smpmgr.image_management", "app", "The SMP Image Management Group."),
+    "file": LazyCommand("smpmgr.file_management", "app", "The SMP File Management Group."),
+    "enum": LazyCommand(
+        "smpmgr.enumeration_management", "app", "The SMP Enumeration Management Group."
+    ),
+    "ic": LazyCommand("smpmgr.user.intercreate", "app", "The Intercreate User Group (64)"),
+    "shell": LazyCommand("smpmgr.shell_management", "shell", "Send shell commands to the device."),
+    "terminal": LazyCommand("smpmgr.terminal", "terminal", "Open a terminal to the device."),
+    "run": LazyCommand(
+        "smpmgr.batch", "run_script", "Run a script of smpmgr commands over one connection."
+    ),
+    "discover": LazyCommand(
+        "smpmgr.discovery", "discover", "Find the SMP servers on the serial ports and UDP networks."
+    ),
+    "emulator": LazyCommand(
+        "smpmgr.emulator", "emulator", "Run an emulated SMP server for testing without hardware."
+    ),
+    "upgrade": LazyCommand(
+        "smpmgr.upgrade",
+        "upgrade",
+        "Upload a FW image, mark it for next boot, and reset the device.",
+    ),
+}
+"""The subcommands, which are imported only when invoked so that the CLI starts quickly."""
 
-for plugin in plugins:
-    app.add_typer(plugin.app)
+LOCAL_COMMANDS: Final = frozenset({"interactive", "terminal", "discover", "emulator"})
+"""The subcommands that make no SMP requests to the target, so `--mtu auto` is not probed."""
+
+app: Final = typer.Typer(
+    cls=lazy_group(
+        COMMANDS | {p.name: LazyCommand(p.module, "app", p.help, p.path) for p in plugins}
+    ),
+    help="".join(HELP_LINES),
+    rich_markup_mode="rich",
+)
 
 
 @app.callback(invoke_without_command=True)
@@ -89,13 +91,15 @@ def options(
     timeout: float = typer.Option(
         2.0, help="Transport timeout in seconds; how long to wait for requests"
     ),
-    mtu: int
+    mtu: str
     | None = typer.Option(
         None,
+        metavar="INTEGER|auto",
         help=(
             "Maximum transmission unit supported by the SMP server serial transport."
             " Will default to smpclient upstream value."
             " Ignored for BLE transport since the BLE connection will report MTU."
+            " With 'auto', the largest reliable MTU is probed once per device and cached."
         ),
     ),
     baudrate: int
@@ -106,6 +110,16 @@ def options(
             " Will default to smpclient upstream value."
         ),
     ),
+    timing: bool = typer.Option(
+        False,
+        help=(
+            "Time every request and upload or download chunk, and print the count, bytes,"
+            " latency percentiles, and throughput of each request type at exit."
+        ),
+    ),
+    timing_json: Path = typer.Option(
+        None, help="Also write the --timing summary as JSON to this file. Implies --timing."
+    ),
     loglevel: LogLevel = typer.Option(None, help="Debug log level"),
     logfile: Path = typer.Option(None, help="Log file path"),
     version: Annotated[bool, typer.Option("--version", help="Show the version and exit.")] = False,
@@ -122,19 +136,40 @@ def options(
         print(get_version('smpmgr'))
         raise typer.Exit()
 
+    if mtu is not None and mtu != "auto" and not mtu.isdecimal():
+        raise typer.BadParameter(f"{mtu!r} is not an integer or 'auto'", param_hint="--mtu")
+
     setup_logging(loglevel, logfile)
 
-    ctx.obj = Options(
-        timeout=timeout,
-        transport=TransportDefinition(port=port, ble=ble, ip=ip),
-        mtu=mtu,
-        baudrate=baudrate,
+    # imported here rather than at the top so that --version and --help start quickly
+    from smpmgr.common import Options, TransportDefinition, resolve_options
+
+    ctx.obj = resolve_options(
+        Options(
+            timeout=timeout,
+            transport=TransportDefinition(port=port, ble=ble, ip=ip),
+            mtu="auto" if mtu == "auto" else None if mtu is None else int(mtu),
+            baudrate=baudrate,
+        )
     )
     logger.info(ctx.obj)
 
+    if ctx.obj.mtu == "auto" and ctx.invoked_subcommand not in LOCAL_COMMANDS | {None}:
+        from smpmgr.mtu import ensure_mtu
+
+        ensure_mtu(ctx.obj)
+
+    if (timing or timing_json is not None) and ctx.invoked_subcommand is not None:
+        from smpmgr import timing as timings
+
+        timings.start()
+        ctx.call_on_close(lambda: timings.report(timing_json))
+
     if ctx.invoked_subcommand is None:
         if loglevel is not None or logfile is not None:
             raise typer.Exit()
+        if port is not None or ble is not None or ip is not None:  # target set for the shell
+            raise typer.Exit()
         print("A command is required, see [bold]--help[/bold] for available commands.")
         raise typer.Exit()
 
@@ -143,160 +178,31 @@ def options(
 
 
 @app.command()
-def upgrade(
-    ctx: typer.Context,
-    file: Annotated[Path, typer.Argument(help="Path to FW image")],
-    slot: Annotated[int, typer.Option(help="The image slot to upload to")] = 0,
-    confirm: Annotated[
-        bool,
-        typer.Option(
-            "--confirm",
-            help="Permanently confirm the image (prevent revert/rollback). "
-            "Without this flag (default): the image is marked for test swap, and MCUboot will "
-            "revert to the previous image if the new image fails to boot or is not confirmed. "
-            "With this flag: the image is immediately marked as permanent, bypassing MCUboot's "
-            "test/revert safety mechanism. "
-            "[red]WARNING[/red]: Using --confirm skips the test boot and can brick your device. "
-            "[bold]Only use this flag in development scenarios where recovery is possible[/bold], "
-            "such as: MCUboot has serial recovery enabled and you have access to the physical "
-            "serial interface; JTAG/SWD debug headers are exposed and not locked; "
-            "or you have another reliable recovery mechanism. "
-            "[red]DO NOT[/red] use --confirm in production or field deployments where physical "
-            "access for recovery is not available. "
-            "Best practice: always test first by marking for test swap, "
-            "rebooting to verify the image works, "
-            "then confirm the running image with 'smpmgr image state-write --confirm' "
-            "(or some other mechanism).",
-        ),
-    ] = False,
-    bypass_inspect: Annotated[
-        bool,
-        typer.Option(
-            "--bypass-inspect",
-            help="Skip local MCUboot image inspection and read the image hash from the device "
-            "instead of extracting it from the file. "
-            "This is useful when uploading images that are not in MCUboot format, such as "
-            "custom bootloader formats (e.g., NXP's SB3.1) where the hash may be calculated "
-            "differently (e.g., over a specific block rather than the entire binary). "
-            "[bold red]WARNING[/bold red]: When using this option, the responsibility for "
-            "validating image integrity is placed entirely on the device's bootloader. "
-            "If the bootloader does not verify the image, corrupted firmware could be uploaded "
-            "and marked as valid. "
-            "It's assumed the image format encodes some sort of integrity check "
-            "(e.g., CRC or hash)."
-            "[bold red]Only use this option if your bootloader performs its own image integrity "
-            "validation.[/bold red]",
-        ),
-    ] = False,
-) -> None:
-    """Upload a FW image, mark it for next boot, and reset the device."""
-
-    if not bypass_inspect:
-        try:
-            image_info = ImageInfo.load_file(str(file))
-            logger.info(str(image_info))
-        except Exception as e:
-            typer.echo(f"Inspection of FW image failed: {e}")
-            raise typer.Exit(code=1)
-
-        try:
-            image_tlv_sha256 = image_info.get_tlv(IMAGE_TLV.SHA256)
-            logger.info(f"IMAGE_TLV_SHA256: {image_tlv_sha256}")
-        except TLVNotFound:
-            typer.echo("Could not find IMAGE_TLV_SHA256 in image.")
-            raise typer.Exit(code=1)
-
-    options = cast(Options, ctx.obj)
-    smpclient = get_smpclient(options)
-
-    async def f() -> None:
-        image_hash: bytes | None = None
-        await connect_with_spinner(smpclient)
-
-        with open(file, "rb") as f:
-            await upload_with_progress_bar(smpclient, f, slot)
-
-        if slot != 0 or confirm:
-            if bypass_inspect:
-                # Read hash from device since we skipped local image inspection
-                r = await smp_request(smpclient, ImageStatesRead(), "Waiting for image states...")
+def interactive(ctx: typer.Context) -> None:
+    """Open the `smpmgr` interactive shell. Type 'exit' or 'quit' to exit.
 
-                if error(r):
-                    print(r)
-                    raise typer.Exit(code=1)
-                elif success(r):
-                    if len(r.images) == 0:
-                        print("No images on device!")
-                        raise typer.Exit(code=1)
-                    for image in r.images:
-                        if image.slot == slot:
-                            image_hash = image.hash
-                            break
-                    if image_hash is None:
-                        print(f"Image with slot {slot} not found!")
-                        raise typer.Exit(code=1)
-                else:
-                    assert_never(r)
-            else:
-                image_hash = image_tlv_sha256.value
-
-            image_states_response = await smp_request(
-                smpclient,
-                ImageStatesWrite(hash=image_hash, confirm=confirm),
-                "Marking uploaded image for permanent upgrade..."
-                if confirm
-                else "Marking uploaded image for test upgrade...",
-            )
-            if success(image_states_response):
-                pass
-            elif error(image_states_response):
-                print(image_states_response)
-                raise typer.Exit(code=1)
-            else:
-                assert_never(image_states_response)
-
-        reset_response = await smp_request(smpclient, ResetWrite())
-        if success(reset_response):
-            pass
-        elif error(reset_response):
-            if error_v1(reset_response):
-                if reset_response.rc != smperr.MGMT_ERR.EOK:
-                    print(reset_response)
-                    raise typer.Exit(code=1)
-            elif error_v2(reset_response):
-                if reset_response.err.rc != OS_MGMT_RET_RC.OK:
-                    print(reset_response)
-                    raise typer.Exit(code=1)
-            else:
-                assert_never(reset_response)
-        else:
-            assert_never(reset_response)
-
-        print("Upgrade complete.")
-
-        if slot != 0:
-            print("The device may take a few minutes to complete FW swap.")
-
-    asyncio.run(f())
-
-
-@app.command()
-def interactive() -> None:
-    """Open the `smpmgr` interactive shell. Type 'exit' or 'quit' to exit."""
+    The connection to the SMP server is kept open between commands.
+    Set the target once, e.g. `--port COM1`, to use it until another is given.
+    """
 
     print("".join(HELP_LINES))
     print("Type 'exit' or 'quit' to exit the shell.\n")
 
-    while True:
-        args = typer.prompt("smpmgr", prompt_suffix=' >').split()
+    from smpmgr.common import Options, Session
+
+    with Session() as session:
+        session.resolve(cast(Options, ctx.obj))  # e.g. smpmgr --port COM1 interactive
+
+        while True:
+            args = typer.prompt("smpmgr", prompt_suffix=' >').split()
 
-        if args[0] in {"exit", "quit"}:
-            break
-        if args[0] == "interactive":
-            print("The 'interactive' command cannot be used from within the shell.")
-            continue
+            if args[0] in {"exit", "quit"}:
+                break
+            if args[0] == "interactive":
+                print("The 'interactive' command cannot be used from within the shell.")
+                continue
 
-        try:
-            app(args)
-        except SystemExit:
-            continue
+            try:
+                app(args)
+            except SystemExit:
+                continue
@@ -0,0 +1,185 @@
+"""Export SMP server statistics in the OpenMetrics or Prometheus text format."""
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Final, Sequence
+
+from smpclient import SMPClient
+from smpclient.generics import error, success
+from smpclient.requests.statistics_management import GroupData, ListOfGroups
+
+from smpmgr.common import Options, get_address, get_transport, pipeline
+from smpmgr.fleet import target_label
+
+logger: Final = logging.getLogger(__name__)
+
+OPENMETRICS_CONTENT_TYPE: Final = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+"""The content type of `render(..., openmetrics=True)`."""
+PROMETHEUS_CONTENT_TYPE: Final = "text/plain; version=0.0.4; charset=utf-8"
+"""The content type of `render(..., openmetrics=False)`."""
+
+
+@dataclass(frozen=True)
+class DeviceStats:
+    """The result of polling the statistics groups of one SMP server."""
+
+    device: str
+    up: bool
+    groups: dict[str, dict[str, int]] = field(default_factory=dict)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def render(stats: Sequence[DeviceStats], openmetrics: bool = True) -> str:
+    """Render `stats`, labelled by device, group, and counter, as an OpenMetrics exposition.
+
+    If not `openmetrics`, they are rendered in the Prometheus text format instead, e.g. for the
+    node_exporter textfile collector.  The counter samples are named `smp_stat_total` in both,
+    but the Prometheus text format has no metric families, so the TYPE names the samples rather
+    than the `smp_stat` family, and there is no `# EOF`.
+    """
+
+    stat: Final = "smp_stat" if openmetrics else "smp_stat_total"
+    lines: Final = [
+        "# TYPE smp_up gauge",
+        "# HELP smp_up Whether the SMP server responded to the last poll.",
+    ]
+    lines.extend(f'smp_up{{device="{_escape(s.device)}"}} {int(s.up)}' for s in stats)
+    lines.extend(
+        (
+            f"# TYPE {stat} counter",
+            f"# HELP {stat} Counters of the SMP server statistics groups.",
+        )
+    )
+    lines.extend(
+        f'smp_stat_total{{device="{_escape(s.device)}",group="{_escape(group)}",'
+        f'counter="{_escape(name)}"}} {value}'
+        for s in stats
+        for group, fields in s.groups.items()
+        for name, value in fields.items()
+    )
+    if openmetrics:
+        lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: Path, text: str) -> None:
+    """Atomically replace `path` with `text`, as required by textfile collectors."""
+
+    tmp: Final = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+class StatsPoller:
+    """Keeps a connection to one SMP server and reads its statistics groups on each poll.
+
+    The connection is made on the first poll, and remade on the next poll after a failure, so
+    that a device that is reset or unplugged is reported as down rather than stopping the export.
+    """
+
+    def __init__(self, options: Options, groups: Sequence[str], depth: int | None) -> None:
+        self.device: Final = target_label(options)
+        self._options: Final = options
+        self._groups = list(groups)
+        self._depth: Final = depth
+        self._smpclient: SMPClient | None = None
+
+    async def _connect(self) -> SMPClient:
+        if self._smpclient is None:
+            smpclient = SMPClient(
+                get_transport(self._options), get_address(self._options), self._options.timeout
+            )
+            await smpclient.connect()
+            self._smpclient = smpclient
+        return self._smpclient
+
+    async def _read_groups(self, smpclient: SMPClient) -> list[str]:
+        if not self._groups:
+            r = await smpclient.request(ListOfGroups())  # type: ignore
+            if error(r):
+                raise RuntimeError(f"ListOfGroups failed: {r}")
+            elif success(r):
+                self._groups = list(r.stat_list)
+            else:
+                raise Exception("Unreachable")
+        return self._groups
+
+    async def poll(self) -> DeviceStats:
+        """Return the current counters, or a `DeviceStats` that is not `up` if the poll failed."""
+
+        try:
+            smpclient: Final = await self._connect()
+            groups: Final = await self._read_groups(smpclient)
+            responses: Final = await pipeline(
+                smpclient, [GroupData(name=group) for group in groups], self._depth
+            )
+        except Exception as e:
+            logger.warning(f"{self.device} poll failed: {e.__class__.__name__} - {e}")
+            await self.close()
+            return DeviceStats(self.device, False)
+
+        stats: Final = DeviceStats(self.device, True)
+        for group, r in zip(groups, responses):
+            if success(r):
+                stats.groups[group] = r.fields
+            elif error(r):
+                logger.warning(f"{self.device} GroupData {group} failed: {r}")
+            else:
+                raise Exception("Unreachable")
+        return stats
+
+    async def close(self) -> None:
+        """Disconnect from the SMP server, if connected."""
+
+        if self._smpclient is None:
+            return
+        smpclient: Final = self._smpclient
+        self._smpclient = None
+        try:
+            await smpclient.disconnect()
+        except Exception as e:
+            logger.debug(f"Ignoring error while disconnecting: {e.__class__.__name__} - {e}")
+
+
+async def serve(
+    host: str, port: int, get_stats: Callable[[], Sequence[DeviceStats]]
+) -> asyncio.Server:
+    """Start a minimal HTTP server that responds to `GET /metrics` with `get_stats()`.
+
+    The metrics are rendered in the OpenMetrics text format if the client accepts it, like
+    Prometheus does, and in the Prometheus text format otherwise.
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line: Final = (await reader.readline()).decode("latin-1").split()
+            openmetrics = False
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.strip().lower() == "accept" and "application/openmetrics-text" in value:
+                    openmetrics = True
+            if request_line[:1] == ["GET"] and request_line[1:2] in (["/"], ["/metrics"]):
+                status = "200 OK"
+                content_type = OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE
+                body = render(get_stats(), openmetrics).encode()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", b"Not Found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError as e:
+            logger.debug(f"HTTP client error: {e}")
+        finally:
+            writer.close()
+
+    server: Final = await asyncio.start_server(handle, host, port)
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
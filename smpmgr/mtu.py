@@ -0,0 +1,171 @@
+"""Automatic selection of the SMP frame size, i.e. `--mtu auto`.
+
+The largest frame that an SMP server accepts depends on its transport buffers, so it is found by
+echoing frames of increasing size.  The result is cached per device address so that later runs
+use it immediately.
+"""
+
+import logging
+from dataclasses import replace
+from typing import Final
+
+import typer
+from rich.progress import Progress, SpinnerColumn, TextColumn
+from smpclient import SMPClient
+from smpclient.generics import success
+from smpclient.requests.os_management import EchoWrite
+from smpclient.transport import SMPTransport
+
+from smpmgr import cache
+from smpmgr.common import Options, drop_connection, get_address, get_transport, run
+
+logger: Final = logging.getLogger(__name__)
+
+CACHE: Final = "mtu.json"
+"""The name of the MTU cache in the cache directory."""
+
+SERIAL_MTUS: Final = (128, 256, 512, 1024, 2048, 4096)
+"""The frame sizes tried for the serial transport, smallest first."""
+
+UDP_MTUS: Final = (256, 512, 1024, 1500, 2048, 4096, 8192)
+"""The frame sizes tried for the UDP transport, smallest first."""
+
+ATTEMPTS: Final = 2
+"""How many echoes of each size must succeed for the size to be considered reliable."""
+
+
+def cache_key(options: Options) -> str | None:
+    """Return the MTU cache key of the target of `options`, or `None` if it is not probed.
+
+    BLE is not probed because the BLE connection reports its MTU.
+    """
+
+    if options.transport.port is not None:
+        return f"port:{options.transport.port}"
+    if options.transport.ip is not None:
+        return f"ip:{options.transport.ip}"
+    return None
+
+
+def candidates(options: Options) -> tuple[int, ...]:
+    """Return the MTUs to try for the target of `options`, smallest first."""
+
+    if options.transport.port is not None:
+        return SERIAL_MTUS
+    if options.transport.ip is not None:
+        return UDP_MTUS
+    return ()
+
+
+def cached_mtu(options: Options) -> int | None:
+    """Return the cached MTU of the target of `options`, or `None` if it has not been probed."""
+
+    key: Final = cache_key(options)
+    if key is None:
+        return None
+    mtu: Final = cache.load(CACHE).get(key)
+    return mtu if isinstance(mtu, int) else None
+
+
+def save_mtu(options: Options, mtu: int) -> None:
+    """Cache `mtu` as the MTU of the target of `options`."""
+
+    key: Final = cache_key(options)
+    if key is None:
+        return
+    mtus: Final = cache.load(CACHE)
+    mtus[key] = mtu
+    cache.save(CACHE, mtus)
+
+
+def echo_request(transport: SMPTransport) -> EchoWrite:
+    """Return the largest `EchoWrite` that fits in one frame of `transport`."""
+
+    limit: Final = transport.max_unencoded_size
+    size = max(0, limit - len(EchoWrite(d="").BYTES))
+    while size > 0 and len(EchoWrite(d="x" * size).BYTES) > limit:  # the CBOR length grows
+        size -= 1
+    return EchoWrite(d="x" * size)
+
+
+async def probe(options: Options) -> int | None:
+    """Return the largest MTU that the SMP server of `options` echoes reliably.
+
+    One connection is made with the largest candidate MTU and each candidate is tried by echoing
+    the largest frame that a transport with that MTU would send.  The first size that fails ends
+    the probe.  Returns `None` if even the smallest size failed.
+
+    Raises:
+        Exception: if the connection could not be made
+    """
+
+    mtus: Final = candidates(options)
+    if not mtus:
+        return None
+
+    smpclient: Final = SMPClient(
+        get_transport(replace(options, mtu=mtus[-1])), get_address(options), options.timeout
+    )
+    await smpclient.connect()
+
+    best: int | None = None
+    try:
+        for mtu in mtus:
+            # the transport is only constructed, not connected, to size the echo for `mtu`
+            request = echo_request(get_transport(replace(options, mtu=mtu)))
+            try:
+                for _ in range(ATTEMPTS):
+                    response = await smpclient.request(EchoWrite(d=request.d))
+                    if not success(response) or response.r != request.d:
+                        raise ValueError(f"Bad echo response: {response}")
+            except Exception as e:
+                logger.info(f"{mtu=} failed: {e.__class__.__name__} - {e}")
+                break
+            logger.info(f"{mtu=} OK")
+            best = mtu
+    finally:
+        try:
+            await smpclient.disconnect()
+        except Exception as e:
+            logger.debug(f"Ignoring error while disconnecting: {e.__class__.__name__} - {e}")
+
+    return best
+
+
+async def probe_with_spinner(options: Options) -> int | None:
+    """Spin while probing the MTU of the SMP server; raises `typer.Exit` if connection fails."""
+
+    await drop_connection()  # the probe needs the port to itself
+
+    with Progress(
+        SpinnerColumn(), TextColumn("[progress.description]{task.description}")
+    ) as progress:
+        description = f"Probing the MTU of {get_address(options)}..."
+        task = progress.add_task(description=description, total=None)
+        try:
+            mtu: Final = await probe(options)
+        except Exception as e:
+            progress.update(task, description=f"{description} error", completed=True)
+            logger.error(f"Connection failed: {e.__class__.__name__} - {e}")
+            raise typer.Exit(code=1)
+        progress.update(
+            task,
+            description=f"{description} {mtu if mtu is not None else 'failed'}",
+            completed=True,
+        )
+        return mtu
+
+
+def ensure_mtu(options: Options) -> None:
+    """Probe and cache the MTU of the target of `options` if it is not cached already.
+
+    If the probe fails, nothing is cached and the transport uses its default MTU.
+    """
+
+    if cache_key(options) is None or cached_mtu(options) is not None:
+        return
+    mtu: Final = run(probe_with_spinner(options))
+    if mtu is None:
+        logger.warning("Could not probe the MTU, using the transport default")
+        return
+    save_mtu(options, mtu)
@@ -1,11 +1,17 @@
-import asyncio
 from typing import cast
 
 import typer
 from rich import print
 from smpclient.requests.os_management import EchoWrite, ResetWrite
 
-from smpmgr.common import Options, connect_with_spinner, get_smpclient, smp_request
+from smpmgr.common import (
+    Options,
+    connect_with_spinner,
+    drop_connection,
+    get_smpclient,
+    run,
+    smp_request,
+)
 
 app = typer.Typer(name="os", help="The SMP OS Management Group.")
 
@@ -22,7 +28,7 @@ def echo(ctx: typer.Context, message: str) -> None:
         r = await smp_request(smpclient, EchoWrite(d=message))  # type: ignore
         print(r)
 
-    asyncio.run(f())
+    run(f())
 
 
 @app.command()
@@ -36,5 +42,6 @@ def reset(ctx: typer.Context) -> None:
         await connect_with_spinner(smpclient)
         r = await smp_request(smpclient, ResetWrite())  # type: ignore
         print(r)
+        await drop_connection()
 
-    asyncio.run(f())
+    run(f())
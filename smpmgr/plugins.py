@@ -1,24 +1,117 @@
-"""Runtime discovery and execution of user-provided plugins."""
+"""Runtime discovery and execution of user-provided plugins.
 
+Executing every plugin on every invocation is slow, so the group name and help of each plugin
+file are kept in a manifest in the user's cache directory.  A plugin is only executed when its
+manifest entry is stale, i.e. the file has changed, or when its group is invoked.
+"""
+
+import hashlib
 import logging
+import sys
 from importlib.util import module_from_spec, spec_from_file_location
 from pathlib import Path
-from typing import Final, NamedTuple
+from types import ModuleType
+from typing import Any, Final, NamedTuple
 
 import typer
 
+from smpmgr import cache
+
 logger: Final = logging.getLogger(__name__)
 
+MANIFEST: Final = "plugins.json"
+"""The name of the plugin manifest in the cache directory."""
+
 
 class Plugin(NamedTuple):
     """An SMP group plugin."""
 
-    app: typer.Typer
+    name: str
+    """The name of the plugin's group."""
+    help: str
+    """The help of the plugin's group."""
     path: Path
+    """The plugin file."""
+
+    @property
+    def module(self) -> str:
+        """The name that the plugin module is imported as."""
+
+        return self.path.stem
+
+
+def load_module(name: str, path: Path) -> ModuleType:
+    """Execute the plugin file at `path` as the module `name` and return it."""
+
+    if name in sys.modules:
+        return sys.modules[name]
+    if not ((spec := spec_from_file_location(name, path)) and spec.loader):
+        raise ImportError(f"Could not load module from {path}")
+    module: Final = module_from_spec(spec)
+    sys.modules[name] = module  # required by e.g. pydantic generics defined in the plugin
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return module
+
+
+def load_app(module: ModuleType) -> typer.Typer:
+    """Return the `typer.Typer` named `app` of the plugin `module`."""
+
+    app = getattr(module, "app", None)
+    if app is None:
+        raise ImportError(f"Module {module.__file__} does not have an 'app' attribute")
+    if not isinstance(app, typer.Typer):
+        raise TypeError(f"Module {module.__file__} 'app' attribute is not a typer.Typer")
+    return app
+
+
+def _inspect(file: Path) -> Plugin:
+    """Execute the plugin `file` to read the name and help of its group."""
+
+    logger.debug(f"Loading plugin {file} to update the manifest")
+    app: Final = load_app(load_module(file.stem, file))
+    help: Final = app.info.help
+    return Plugin(
+        name=app.info.name or file.stem.removesuffix("_group"),
+        help=help if isinstance(help, str) else "",
+        path=file,
+    )
+
+
+def _get_plugin(file: Path, manifest: dict[str, Any]) -> Plugin:
+    """Return the `Plugin` of `file` from the `manifest`, updating the entry if it is stale."""
+
+    stat: Final = file.stat()
+    entry: Final = manifest.get(str(file))
+    if not isinstance(entry, dict) or "name" not in entry:
+        plugin = _inspect(file)
+        sha256 = hashlib.sha256(file.read_bytes()).hexdigest()
+    else:
+        plugin = Plugin(name=str(entry["name"]), help=str(entry.get("help", "")), path=file)
+        if entry.get("mtime_ns") == stat.st_mtime_ns and entry.get("size") == stat.st_size:
+            return plugin
+        sha256 = hashlib.sha256(file.read_bytes()).hexdigest()
+        if entry.get("sha256") != sha256:  # changed, rather than only touched
+            plugin = _inspect(file)
+
+    manifest[str(file)] = {
+        "name": plugin.name,
+        "help": plugin.help,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": sha256,
+    }
+    return plugin
 
 
 def get_plugins(argv: list[str]) -> tuple[Plugin, ...]:
-    """Returns a tuple of plugin paths and removes them from `argv`."""
+    """Returns a tuple of plugins and removes their paths from `argv`.
+
+    The plugins are not executed unless the manifest entry of the file is stale.
+    """
 
     logger.debug(f"{argv=}")
     paths: Final[list[Path]] = []
@@ -33,21 +126,19 @@ def get_plugins(argv: list[str]) -> tuple[Plugin, ...]:
             else:
                 raise ValueError(f"Invalid plugin path: {path}")
 
-    files: Final = tuple(file for path in paths for file in path.glob("*_group.py"))
+    files: Final = tuple(file for path in paths for file in sorted(path.glob("*_group.py")))
+    if not files:
+        return ()
 
+    manifest: Final = cache.load(MANIFEST)
     plugins: Final[list[Plugin]] = []
+    changed = False
     for file in files:
-        if (spec := spec_from_file_location(file.stem, file)) and spec.loader:
-            module = module_from_spec(spec)
-            spec.loader.exec_module(module)
-        else:
-            raise ImportError(f"Could not load module from {file}")
-        app = getattr(module, "app", None)
-        if app is None:
-            raise ImportError(f"Module {file} does not have an 'app' attribute")
-        if not isinstance(app, typer.Typer):
-            raise TypeError(f"Module {file} 'app' attribute is not a typer.Typer")
-        plugins.append(Plugin(app=app, path=file))
+        entry = manifest.get(str(file))
+        plugins.append(_get_plugin(file, manifest))
+        changed |= manifest.get(str(file)) != entry
+    if changed:
+        cache.save(MANIFEST, manifest)
 
     logger.debug(f"Plugins found: {plugins}")
 
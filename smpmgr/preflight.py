@@ -0,0 +1,254 @@
+"""Local verification of MCUboot images before they are uploaded.
+
+The image is streamed once through `hashlib` to check the hash TLV, so a truncated or corrupted
+file is rejected before a long upload rather than by the device afterwards.  The results are
+cached by path, size, and modification time so that repeated runs do not hash large images
+again.
+"""
+
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from io import BufferedReader, BytesIO
+from pathlib import Path
+from typing import Any, Final, Sequence
+
+from smpclient.mcuboot import (
+    IMAGE_HEADER_STRUCT,
+    IMAGE_MAGIC,
+    IMAGE_TLV,
+    IMAGE_TLV_INFO_MAGIC,
+    IMAGE_TLV_INFO_STRUCT,
+    IMAGE_TLV_PROT_INFO_MAGIC,
+    IMAGE_TLV_STRUCT,
+    ImageVersion,
+)
+
+from smpmgr import cache
+
+logger: Final = logging.getLogger(__name__)
+
+CACHE: Final = "inspect.json"
+"""The name of the image inspection cache in the cache directory."""
+
+CHUNK_SIZE: Final = 1 << 20
+"""How much of the image is read and hashed at a time."""
+
+HASHES: Final = {
+    IMAGE_TLV.SHA256: "sha256",
+    IMAGE_TLV.SHA384: "sha384",
+    IMAGE_TLV.SHA512: "sha512",
+}
+"""The hash TLVs and their `hashlib` algorithms."""
+
+SIGNATURE_LENGTHS: Final[dict[IMAGE_TLV, tuple[int, ...]]] = {
+    IMAGE_TLV.RSA2048_PSS: (256,),
+    IMAGE_TLV.RSA3072_PSS: (384,),
+    IMAGE_TLV.ED25519: (64,),
+    IMAGE_TLV.ECDSA224: tuple(range(8, 65)),
+    IMAGE_TLV.ECDSA_SIG: tuple(range(8, 105)),  # DER encoded, P-256 or P-384
+}
+"""The signature TLVs and their possible lengths."""
+
+
+class ImageCheckError(Exception):
+    """Raised when an image is not a valid MCUboot image."""
+
+
+@dataclass(frozen=True)
+class ImageCheck:
+    """The result of verifying an MCUboot image file."""
+
+    path: str
+    size: int
+    version: str | None = None
+    hash_type: str | None = None
+    """The name of the hash TLV, e.g. `SHA256`, or `None` if the image has none."""
+    tlv_hash: str | None = None
+    """The hex value of the hash TLV."""
+    computed_hash: str | None = None
+    """The hex hash of the header, body, and protected TLVs, computed from the file."""
+    signature: str | None = None
+    """The name of the signature TLV, e.g. `ECDSA_SIG`, or `None` if the image is not signed."""
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def hash(self) -> bytes | None:
+        """The verified hash of the image, as reported by the image states of the device."""
+
+        return bytes.fromhex(self.tlv_hash) if self.ok and self.tlv_hash is not None else None
+
+
+def _read_exactly(f: BytesIO | BufferedReader, size: int, what: str) -> bytes:
+    data: Final = f.read(size)
+    if len(data) != size:
+        raise ImageCheckError(f"The file is truncated, it ends within the {what}")
+    return data
+
+
+def _read_tlvs(
+    f: BytesIO | BufferedReader, offset: int, magic: int
+) -> tuple[int, list[tuple[int, bytes]]]:
+    """Return the size of the TLV area at `offset` and its TLVs."""
+
+    f.seek(offset)
+    info_magic, tlv_tot = IMAGE_TLV_INFO_STRUCT.unpack(
+        _read_exactly(f, IMAGE_TLV_INFO_STRUCT.size, "TLV info")
+    )
+    if info_magic != magic:
+        raise ImageCheckError(f"TLV info magic is {hex(info_magic)}, expected {hex(magic)}")
+
+    tlvs: Final = []
+    position = IMAGE_TLV_INFO_STRUCT.size
+    while position < tlv_tot:
+        type, length = IMAGE_TLV_STRUCT.unpack(_read_exactly(f, IMAGE_TLV_STRUCT.size, "TLVs"))
+        tlvs.append((type, _read_exactly(f, length, "TLVs")))
+        position += IMAGE_TLV_STRUCT.size + length
+    if position != tlv_tot:
+        raise ImageCheckError(f"The TLVs are {position} B, but the TLV info says {tlv_tot} B")
+    return tlv_tot, tlvs
+
+
+def _hash(f: BytesIO | BufferedReader, size: int, algorithm: str) -> str:
+    """Return the hex hash of the first `size` bytes of `f`."""
+
+    h: Final = hashlib.new(algorithm)
+    buffer: Final = bytearray(min(CHUNK_SIZE, max(size, 1)))
+    view: Final = memoryview(buffer)
+    f.seek(0)
+    remaining = size
+    while remaining > 0:
+        n = f.readinto(view[: min(remaining, len(buffer))])
+        if not n:
+            raise ImageCheckError("The file is truncated, it ends within the image")
+        h.update(view[:n])
+        remaining -= n
+    return h.hexdigest()
+
+
+def _check(f: BytesIO | BufferedReader, size: int, result: dict[str, Any]) -> None:
+    """Verify the image in `f`, adding what is found to the `ImageCheck` fields in `result`."""
+
+    (
+        magic,
+        _,
+        hdr_size,
+        protect_tlv_size,
+        img_size,
+        _,
+        *version,
+    ) = IMAGE_HEADER_STRUCT.unpack(_read_exactly(f, IMAGE_HEADER_STRUCT.size, "image header"))
+    if magic != IMAGE_MAGIC:
+        raise ImageCheckError("Not an MCUboot image, the header magic is wrong")
+    result["version"] = str(ImageVersion(*version))
+
+    tlv_offset: Final = hdr_size + img_size
+    if size < tlv_offset:
+        raise ImageCheckError(
+            f"The file is truncated, it is {size} B but the image is {tlv_offset} B"
+        )
+
+    tlvs: Final[list[tuple[int, bytes]]] = []
+    if protect_tlv_size > 0:
+        protected_size, protected = _read_tlvs(f, tlv_offset, IMAGE_TLV_PROT_INFO_MAGIC)
+        if protected_size != protect_tlv_size:
+            raise ImageCheckError(
+                f"The protected TLVs are {protected_size} B, but the header says "
+                f"{protect_tlv_size} B"
+            )
+        tlvs.extend(protected)
+    _, unprotected = _read_tlvs(f, tlv_offset + protect_tlv_size, IMAGE_TLV_INFO_MAGIC)
+    tlvs.extend(unprotected)
+
+    signature: Final = next(((t, v) for t, v in tlvs if t in SIGNATURE_LENGTHS), None)
+    if signature is not None:
+        signature_type = IMAGE_TLV(signature[0])
+        result["signature"] = signature_type.name
+        if len(signature[1]) not in SIGNATURE_LENGTHS[signature_type]:
+            raise ImageCheckError(
+                f"The {signature_type.name} signature TLV has an invalid length, "
+                f"{len(signature[1])} B"
+            )
+
+    hash_tlv: Final = next(((t, v) for t, v in tlvs if t in HASHES), None)
+    if hash_tlv is None:
+        return
+    hash_type: Final = IMAGE_TLV(hash_tlv[0])
+    result["hash_type"] = hash_type.name
+    result["tlv_hash"] = hash_tlv[1].hex()
+    result["computed_hash"] = _hash(f, tlv_offset + protect_tlv_size, HASHES[hash_type])
+    if result["computed_hash"] != result["tlv_hash"]:
+        raise ImageCheckError(f"The {hash_type.name} TLV does not match the image")
+
+
+def check_file(path: Path) -> ImageCheck:
+    """Verify the MCUboot image at `path` without using the cache.
+
+    A `.hex` file is converted to binary in memory first, like `ImageInfo.load_file()` does.
+    """
+
+    result: Final[dict[str, Any]] = {"path": str(path), "size": path.stat().st_size}
+    try:
+        if path.suffix == ".hex":
+            from intelhex import hex2bin  # type: ignore
+
+            data: Final = BytesIO()
+            if hex2bin(str(path), data) != 0:
+                raise ImageCheckError("Could not convert the Intel HEX file")
+            _check(data, len(data.getbuffer()), result)
+        else:
+            with open(path, "rb") as f:
+                _check(f, result["size"], result)
+    except ImageCheckError as e:
+        result["error"] = str(e)
+    return ImageCheck(**result)
+
+
+def check_files(paths: Sequence[Path], jobs: int = 4, use_cache: bool = True) -> list[ImageCheck]:
+    """Verify the images at `paths`, hashing up to `jobs` of them at once in threads.
+
+    Images that were verified before and have not changed size or modification time are not
+    read again.  Raises `OSError` if a file cannot be read.
+    """
+
+    entries: Final = cache.load(CACHE) if use_cache else {}
+    keys: Final = [str(path.resolve()) for path in paths]
+    stats: Final = [path.stat() for path in paths]
+
+    def cached(key: str, stat: os.stat_result) -> ImageCheck | None:
+        entry = entries.get(key)
+        if (
+            not isinstance(entry, dict)
+            or entry.get("size") != stat.st_size
+            or entry.get("mtime_ns") != stat.st_mtime_ns
+        ):
+            return None
+        try:
+            return ImageCheck(**entry["result"])
+        except (KeyError, TypeError):
+            return None
+
+    results: Final = [cached(key, stat) for key, stat in zip(keys, stats)]
+    missing: Final = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:  # hashlib releases the GIL
+            for i, result in zip(missing, executor.map(check_file, (paths[i] for i in missing))):
+                results[i] = result
+                entries[keys[i]] = {
+                    "size": stats[i].st_size,
+                    "mtime_ns": stats[i].st_mtime_ns,
+                    "result": asdict(result),
+                }
+        if use_cache:
+            cache.save(CACHE, {k: v for k, v in entries.items() if Path(k).exists()})
+
+    checks: Final = [r for r in results if r is not None]
+    for check in checks:
+        logger.info(str(check))
+    return checks
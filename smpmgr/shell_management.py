@@ -1,55 +1,157 @@
-import asyncio
+import json
 import shlex
-from typing import Annotated as A
-from typing import Final, cast
+from pathlib import Path
+from typing import Annotated, Any, Final, List, cast
 
 import typer
 from rich import print as rich_print
-from smpclient.generics import error, success
+from rich.markup import escape
+from smp.shell_management import ExecuteResponse, ShellManagementErrorV1, ShellManagementErrorV2
+from smpclient.generics import error, error_v1, error_v2, success
 from smpclient.requests.shell_management import Execute
 from typing_extensions import assert_never
 
-from smpmgr.common import Options, connect_with_spinner, get_smpclient, smp_request
+from smpmgr.common import (
+    Options,
+    connect_with_spinner,
+    get_smpclient,
+    run,
+    smp_pipeline,
+    smp_request,
+)
+
+
+def read_commands(path: Path) -> list[str]:
+    """Read one shell command per line of `path`, ignoring blank lines and lines starting with #."""
+
+    return [
+        line
+        for line in (line.strip() for line in path.read_text().splitlines())
+        if line and not line.startswith("#")
+    ]
+
+
+def to_json(
+    command: str, response: ExecuteResponse | ShellManagementErrorV1 | ShellManagementErrorV2
+) -> Any:
+    """Return the result of `command` as a JSON-serializable `dict`."""
+
+    if success(response):
+        return {"command": command, "ret": response.ret, "output": response.o}
+    elif error(response):
+        if error_v1(response):
+            return {"command": command, "error": {"rc": int(response.rc)}}
+        elif error_v2(response):
+            return {
+                "command": command,
+                "error": {"group": int(response.err.group), "rc": int(response.err.rc)},
+            }
+        else:
+            assert_never(response)
+    else:
+        assert_never(response)
+
+
+def print_response(
+    response: ExecuteResponse | ShellManagementErrorV1 | ShellManagementErrorV2, verbose: bool
+) -> None:
+    """Print the output of a shell command, colored by its return code."""
+
+    if success(response):
+        if response.ret == 0:  # success, regular text color
+            print(response.o)
+        elif response.ret > 0:
+            rich_print(f"[yellow]Return code: {response.ret}[/yellow]")
+            print(response.o)
+        else:  # non-zero return code, error color
+            rich_print(f"[red]{response.o}[/red]")
+        if verbose:
+            rich_print(response)
+    elif error(response):
+        rich_print(response)
+    else:
+        assert_never(response)
 
 
 def shell(
     ctx: typer.Context,
-    command: str = typer.Argument(
-        help="Command string to run, e.g. \"gpio conf gpio@49000000 0 i\""
+    command: List[str] = typer.Argument(
+        None,
+        help="Command string to run, e.g. \"gpio conf gpio@49000000 0 i\".  May be given more"
+        " than once to run several commands in order.",
+        show_default=False,
     ),
+    file: Annotated[
+        Path | None,
+        typer.Option(
+            "--file",
+            exists=True,
+            dir_okay=False,
+            help="Also run the commands in this file, one per line.  Lines starting with #"
+            " are ignored.",
+        ),
+    ] = None,
     timeout: float
     | None = typer.Option(None, help="Timeout in seconds for the command to complete"),
-    verbose: A[
-        bool, typer.Option("--verbose", help="Print the raw success response")  # noqa: F821,F722
+    depth: int = typer.Option(
+        1,
+        min=1,
+        max=16,
+        help="How many commands to keep in flight at once, at most the SMP server's buffer"
+        " count.  By default, each command is sent once the previous one has completed.",
+    ),
+    json_output: Annotated[
+        bool,
+        typer.Option("--json", help="Print the commands, return codes, and outputs as a JSON list"),
+    ] = False,
+    verbose: Annotated[
+        bool, typer.Option("--verbose", help="Print the raw success response")
     ] = False,
 ) -> None:
-    """Send a shell command to the device."""
+    """Send shell commands to the device.
+
+    Several commands are sent back-to-back over one connection, and their outputs are printed
+    in order.
+    """
+
+    commands: Final = list(command or ()) + (read_commands(file) if file is not None else [])
+    if not commands:
+        raise typer.BadParameter("At least one command is required", param_hint="COMMAND")
 
     options: Final = cast(Options, ctx.obj)
     smpclient: Final = get_smpclient(options)
 
     async def f() -> None:
-        await connect_with_spinner(smpclient)
+        await connect_with_spinner(smpclient, visible=not json_output)
 
-        response: Final = await smp_request(
-            smpclient,
-            Execute(argv=shlex.split(command)),
-            f"Waiting response to {command}...",
-            timeout_s=timeout,
+        responses: Final = (
+            [
+                await smp_request(
+                    smpclient,
+                    Execute(argv=shlex.split(commands[0])),
+                    f"Waiting response to {commands[0]}...",
+                    timeout_s=timeout,
+                    visible=not json_output,
+                )
+            ]
+            if len(commands) == 1
+            else await smp_pipeline(
+                smpclient,
+                [Execute(argv=shlex.split(c)) for c in commands],
+                depth,
+                f"Waiting for the responses to {len(commands)} commands...",
+                timeout_s=timeout,
+                visible=not json_output,
+            )
         )
-        if success(response):
-            if response.ret == 0:  # success, regular text color
-                print(response.o)
-            elif response.ret > 0:
-                rich_print(f"[yellow]Return code: {response.ret}[/yellow]")
-                print(response.o)
-            else:  # non-zero return code, error color
-                rich_print(f"[red]{response.o}[/red]")
-            if verbose:
-                rich_print(response)
-        elif error(response):
-            rich_print(response)
-        else:
-            assert_never(response)
 
-    asyncio.run(f())
+        if json_output:
+            print(json.dumps([to_json(c, r) for c, r in zip(commands, responses)], indent=2))
+            return
+
+        for c, r in zip(commands, responses):
+            if len(commands) > 1:
+                rich_print(f"[bold]$ {escape(c)}[/bold]")
+            print_response(r, verbose)
+
+    run(f())
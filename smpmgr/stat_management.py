@@ -1,14 +1,33 @@
 import asyncio
-from typing import cast
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Final, List, Optional, Sequence, cast
 
 import typer
 from rich import print
+from rich.live import Live
 from rich.table import Table
+from smpclient.generics import error_v1, error_v2, success
 from smpclient.requests.statistics_management import GroupData, ListOfGroups
-
-from smpmgr.common import Options, connect_with_spinner, get_smpclient, smp_request
+from smpclient.transport import SMPTransportDisconnected
+
+from smpmgr.common import (
+    Options,
+    connect_with_spinner,
+    get_smpclient,
+    pipeline,
+    run,
+    smp_pipeline,
+    smp_request,
+)
+from smpmgr.fleet import get_target_options
+from smpmgr.metrics import DeviceStats, StatsPoller, render, serve, write_textfile
 
 app = typer.Typer(name="statistics", help="The SMP stat Management Group.")
+logger = logging.getLogger(__name__)
 
 
 @app.command(name="list")
@@ -40,7 +59,7 @@ def list_stats(
             else:
                 print("No statistics groups available")
 
-    asyncio.run(f())
+    run(f())
 
 
 @app.command(name="smp_svr_stats")
@@ -55,7 +74,7 @@ def smp_svr_stats(ctx: typer.Context) -> None:
         r = await smp_request(smpclient, GroupData(name="smp_svr_stats"))
         print(r)
 
-    asyncio.run(f())
+    run(f())
 
 
 @app.command(name="get")
@@ -72,13 +91,21 @@ def get_group(
         r = await smp_request(smpclient, GroupData(name=group_id))
         print(r)
 
-    asyncio.run(f())
+    run(f())
 
 
 @app.command(name="fetch-all")
 def fetch_all_groups(
     ctx: typer.Context,
     verbose: bool = typer.Option(False, "--verbose", "-v", help="Show raw packet data"),
+    depth: Optional[int] = typer.Option(
+        None,
+        min=1,
+        max=16,
+        help="How many requests to keep in flight at once, at most the SMP server's buffer"
+        " count.  By default, its buffer count, or 1 over serial.",
+        show_default=False,
+    ),
 ) -> None:
     """Fetch all statistics groups and their data."""
 
@@ -94,11 +121,16 @@ def fetch_all_groups(
             print("No statistics groups available")
             return
 
-        groups_data = []
-
-        for group_name in list_response.stat_list:
-            group_data = await smp_request(smpclient, GroupData(name=group_name))
-            groups_data.append({'name': group_name, 'data': group_data})
+        responses = await smp_pipeline(
+            smpclient,
+            [GroupData(name=group_name) for group_name in list_response.stat_list],
+            depth,
+            "Waiting for statistics groups...",
+        )
+        groups_data = [
+            {'name': group_name, 'data': group_data}
+            for group_name, group_data in zip(list_response.stat_list, responses)
+        ]
 
         if verbose:
             for group_info in groups_data:
@@ -123,4 +155,211 @@ def fetch_all_groups(
                 print("Data:")
                 print(group_info['data'])
 
-    asyncio.run(f())
+    run(f())
+
+
+@dataclass(frozen=True)
+class Sample:
+    """The counters of each statistics group at a point in time."""
+
+    time: float
+    """`time.monotonic()` when the sample was received."""
+    groups: dict[str, dict[str, int]]
+    """The counters by group name; a group is missing if it could not be read."""
+
+
+def _delta(new: int, old: int) -> int:
+    """Return the increase from `old` to `new`, assuming the counter was reset if it decreased."""
+
+    return new - old if new >= old else new
+
+
+def _watch_table(history: deque[Sample], errors: dict[str, str]) -> Table:
+    """Render the latest sample with the change since the previous one and over the history."""
+
+    latest: Final = history[-1]
+    previous: Final = history[-2] if len(history) > 1 else None
+    oldest: Final = history[0]
+    window_s: Final = latest.time - oldest.time
+
+    table: Final = Table(title=f"Statistics ({len(history)} samples, {window_s:.0f}s window)")
+    table.add_column("Group", style="cyan")
+    table.add_column("Counter")
+    table.add_column("Value", justify="right")
+    table.add_column("Delta", justify="right")
+    table.add_column("Rate/s", justify="right")
+    table.add_column("Avg/s", justify="right")
+
+    for group, fields in latest.groups.items():
+        for name, value in fields.items():
+            delta = rate = avg = ""
+            if previous is not None and name in previous.groups.get(group, {}):
+                d = _delta(value, previous.groups[group][name])
+                delta = f"{d:+d}"
+                rate = f"{d / (latest.time - previous.time):.1f}"
+            if window_s > 0 and name in oldest.groups.get(group, {}):
+                avg = f"{_delta(value, oldest.groups[group][name]) / window_s:.1f}"
+            table.add_row(group, name, str(value), delta, rate, avg)
+    for group, message in errors.items():
+        table.add_row(group, "[red]error[/red]", message, "", "", "")
+
+    return table
+
+
+@app.command(name="watch")
+def watch_groups(
+    ctx: typer.Context,
+    groups: Optional[List[str]] = typer.Argument(
+        None, help="The statistics groups to watch; all groups if not given"
+    ),
+    interval: float = typer.Option(1.0, min=0.05, help="Seconds between samples"),
+    history: int = typer.Option(
+        60, min=2, help="Number of samples kept for the Avg/s column; memory use is bounded by it"
+    ),
+    count: int = typer.Option(0, min=0, help="Stop after this many samples; 0 to run until Ctrl-C"),
+    depth: Optional[int] = typer.Option(
+        None,
+        min=1,
+        max=16,
+        help="How many requests to keep in flight at once, at most the SMP server's buffer"
+        " count.  By default, its buffer count, or 1 over serial.",
+        show_default=False,
+    ),
+) -> None:
+    """Poll statistics groups at a fixed interval and show the counters, deltas, and rates."""
+
+    options = cast(Options, ctx.obj)
+    smpclient = get_smpclient(options)
+
+    async def f() -> None:
+        await connect_with_spinner(smpclient)
+
+        names: Sequence[str] = groups or ()
+        if not names:
+            list_response = await smp_request(smpclient, ListOfGroups())  # type: ignore
+            if not hasattr(list_response, 'stat_list') or not list_response.stat_list:
+                print("No statistics groups available")
+                return
+            names = list_response.stat_list
+
+        requests: Final = [GroupData(name=name) for name in names]
+        samples: Final[deque[Sample]] = deque(maxlen=history)
+        deadline = time.monotonic()
+        sampled = 0
+
+        with Live(auto_refresh=False) as live:
+            while count == 0 or sampled < count:
+                try:
+                    responses = await pipeline(smpclient, requests, depth)
+                except asyncio.TimeoutError:
+                    logger.error("Timeout waiting for response")
+                    raise typer.Exit(code=1)
+                except (OSError, SMPTransportDisconnected) as e:
+                    logger.error(f"Connection to device lost: {e.__class__.__name__} - {e}")
+                    raise typer.Exit(code=1)
+
+                groups_fields: dict[str, dict[str, int]] = {}
+                errors: dict[str, str] = {}
+                for name, r in zip(names, responses):
+                    if success(r):
+                        groups_fields[name] = r.fields
+                    elif error_v1(r):
+                        errors[name] = str(r.rc)
+                    elif error_v2(r):
+                        errors[name] = str(r.err)
+                    else:
+                        raise Exception("Unreachable")
+
+                samples.append(Sample(time.monotonic(), groups_fields))
+                sampled += 1
+                live.update(_watch_table(samples, errors), refresh=True)
+
+                deadline = max(deadline + interval, time.monotonic())  # don't catch up
+                await asyncio.sleep(max(0.0, deadline - time.monotonic()))
+
+    try:
+        run(f())
+    except KeyboardInterrupt:
+        pass
+
+
+@app.command(name="export")
+def export_groups(
+    ctx: typer.Context,
+    groups: Optional[List[str]] = typer.Argument(
+        None, help="The statistics groups to export; all groups if not given"
+    ),
+    target: List[str] = typer.Option(
+        [],
+        help="Export this device too, e.g. port:/dev/ttyACM1, ip:192.168.1.10, or"
+        " ble:AA:BB:CC:DD:EE:FF.  May be used more than once.",
+    ),
+    targets_file: Optional[Path] = typer.Option(
+        None, exists=True, dir_okay=False, help="Export the devices listed in this file"
+    ),
+    textfile: Optional[Path] = typer.Option(
+        None, help="Write the metrics to this file, e.g. for the node_exporter textfile collector"
+    ),
+    listen: Optional[str] = typer.Option(
+        None, help="Serve the metrics over HTTP at HOST:PORT, e.g. 127.0.0.1:9110"
+    ),
+    interval: float = typer.Option(15.0, min=0.1, help="Seconds between polls"),
+    once: bool = typer.Option(False, "--once", help="Poll once, write the metrics, and exit"),
+    depth: Optional[int] = typer.Option(
+        None,
+        min=1,
+        max=16,
+        help="How many requests to keep in flight at once, at most the SMP server's buffer"
+        " count.  By default, its buffer count, or 1 over serial.",
+        show_default=False,
+    ),
+) -> None:
+    """Export statistics groups in the OpenMetrics text format.
+
+    All devices are polled concurrently.
+    Without --textfile or --listen, the metrics are printed once to stdout.
+    The --textfile is written in the Prometheus text format that textfile collectors read, and
+    --listen serves the format that the scraper accepts.
+    """
+
+    options = cast(Options, ctx.obj)
+    targets: Final = get_target_options(options, target, targets_file) or [options]
+
+    if listen is not None:
+        host, _, port = listen.rpartition(":")
+        if not host or not port.isdigit():
+            raise typer.BadParameter(f"Expected HOST:PORT, got '{listen}'", param_hint="--listen")
+
+    pollers: Final = [StatsPoller(o, groups or (), depth) for o in targets]
+    latest: list[DeviceStats] = []
+
+    async def poll() -> None:
+        nonlocal latest
+        latest = await asyncio.gather(*(p.poll() for p in pollers))
+        if textfile is not None:
+            write_textfile(textfile, render(latest, openmetrics=False))
+
+    async def f() -> None:
+        try:
+            await poll()
+            if textfile is None and listen is None:
+                typer.echo(render(latest), nl=False)
+                return
+            if once:
+                return
+
+            server = None if listen is None else await serve(host, int(port), lambda: latest)
+            try:
+                while True:
+                    await asyncio.sleep(interval)
+                    await poll()
+            finally:
+                if server is not None:
+                    server.close()
+        finally:
+            await asyncio.gather(*(p.close() for p in pollers))
+
+    try:
+        run(f())
+    except KeyboardInterrupt:
+        pass
@@ -1,12 +1,18 @@
 import asyncio
+import codecs
 import logging
-from typing import Final, cast
+import sys
+import threading
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Annotated, Final, cast
 
 import readchar
 import typer
-from serial import Serial
+from serial import Serial, SerialException
 
-from smpmgr.common import Options
+from smpmgr.capture import Capture, CaptureError
+from smpmgr.common import Options, drop_connection, run
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +26,26 @@ MAP_KEY_TO_BYTES: Final = {
 }
 
 
-def terminal(ctx: typer.Context) -> None:
+def terminal(
+    ctx: typer.Context,
+    capture: Annotated[
+        Path | None,
+        typer.Option(
+            dir_okay=False,
+            help="Append the device output to this file, with a timestamp on each line.",
+        ),
+    ] = None,
+    capture_max_bytes: Annotated[
+        int,
+        typer.Option(min=0, help="Rotate the capture file at this size; 0 to never rotate."),
+    ] = 0,
+    capture_backups: Annotated[
+        int, typer.Option(min=0, help="How many rotated capture files to keep.")
+    ] = 5,
+    capture_gzip: Annotated[
+        bool, typer.Option("--capture-gzip", help="Gzip the rotated capture files.")
+    ] = False,
+) -> None:
     """Open a terminal to the device."""
 
     options = cast(Options, ctx.obj)
@@ -31,46 +56,85 @@ def terminal(ctx: typer.Context) -> None:
             print("smpmgr --port COM1 terminal")
             return
 
-        print(f"\x1b[2mOpening terminal to {options.transport.port}...", end="")
-
-        with Serial(port=options.transport.port, baudrate=115200, timeout=options.timeout) as s:
-            print("OK")
-            print("Press Ctrl-T to exit the terminal.\x1b[22m")
-            print()
-            device_result, keyboard_result = await asyncio.wait(
-                (
-                    asyncio.create_task(_rx_from_device(s)),
-                    asyncio.create_task(asyncio.to_thread(_tx_keyboard_to_device, s)),
-                ),
-                return_when=asyncio.FIRST_EXCEPTION,
-            )
-
-            logger.debug(f"{device_result=}, {keyboard_result=}")
-
-    asyncio.run(f())
-
-
-async def _rx_from_device(port: Serial) -> None:
-    """Async poll of the serial port for incoming data.
+        await drop_connection()  # release the port if it is held by the interactive session
 
-    Can be replaced when pyserial is replaced."""
-
-    while True:
-        _bytes = port.read_all()
-        if _bytes is not None:
-            print(_bytes.decode(), end="", flush=True)
-        await asyncio.sleep(0.020)
+        print(f"\x1b[2mOpening terminal to {options.transport.port}...", end="")
 
+        capture_file: Final = (
+            Capture(capture, capture_max_bytes, capture_backups, capture_gzip)
+            if capture is not None
+            else nullcontext()
+        )
 
-def _tx_keyboard_to_device(port: Serial) -> None:
-    """Blocking read of keyboard input."""
+        try:
+            with Serial(
+                port=options.transport.port, baudrate=115200, timeout=None
+            ) as s, capture_file as c:
+                print("OK")
+                if capture is not None:
+                    print(f"Capturing to {capture}")
+                print("Press Ctrl-T to exit the terminal.\x1b[22m")
+                print()
+                stop: Final = threading.Event()
+                rx: Final = asyncio.create_task(asyncio.to_thread(_rx_from_device, s, stop, c))
+                tx: Final = asyncio.create_task(asyncio.to_thread(_tx_keyboard_to_device, s, stop))
+                try:
+                    await asyncio.wait((rx, tx), return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    stop.set()
+                    s.cancel_read()  # wake the blocking read of the RX thread
+                    await asyncio.wait((rx,))
+
+                if not tx.done():
+                    if not isinstance(rx.exception(), CaptureError):  # reported when closed
+                        logger.error(f"Lost the connection to the device: {rx.exception()}")
+                    print("Press any key to exit the terminal.")
+                    await tx
+
+                logger.debug(f"{rx=}, {tx=}")
+        except CaptureError as e:
+            logger.error(f"Stopped capturing: {e}")
+            raise typer.Exit(code=1)
+
+    run(f())
+
+
+def _rx_from_device(port: Serial, stop: threading.Event, capture: Capture | None = None) -> None:
+    """Blocking read of the serial port, writing data to stdout as soon as it arrives.
+
+    Everything that is already buffered is read and written at once, so that fast output is
+    written in large batches.  UTF-8 sequences that are split across reads are decoded
+    correctly.  The text is also queued to the `capture`, if any.  Returns when `stop` is set
+    and `port.cancel_read()` is called.
+    """
+
+    decoder: Final = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while not stop.is_set():
+        try:
+            data = port.read(1)  # blocks until data arrives or cancel_read()
+            if port.in_waiting:
+                data += port.read(port.in_waiting)
+        except SerialException:
+            if stop.is_set():
+                return
+            raise
+        if data:
+            text = decoder.decode(data)
+            sys.stdout.write(text)
+            sys.stdout.flush()
+            if capture is not None:
+                capture.write(text)
+
+
+def _tx_keyboard_to_device(port: Serial, stop: threading.Event) -> None:
+    """Blocking read of keyboard input, returns when Ctrl-T is pressed or `stop` is set."""
     while True:
         try:
             key = readchar.readkey()
         except KeyboardInterrupt:
             key = readchar.key.CTRL_C
-        if key == readchar.key.CTRL_T:
-            raise KeyboardInterrupt
+        if key == readchar.key.CTRL_T or stop.is_set():
+            return
         try:
             port.write(MAP_KEY_TO_BYTES[key])
         except KeyError:
@@ -0,0 +1,277 @@
+"""Round trip timing of SMP requests, i.e. `--timing`.
+
+While a `Timings` recorder is active, every transport returned by `get_transport()` records the
+time from sending each request until its response is received, along with the size of both.
+Requests are matched to responses by the SMP header sequence, so pipelined requests and the
+chunks of uploads and downloads are timed individually.
+"""
+
+import json
+import logging
+import math
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from pathlib import Path
+from typing import Any, Final, TypeVar
+
+from rich import print
+from rich.table import Table
+from smp import header as smphdr
+from smpclient.transport import SMPTransport
+
+logger: Final = logging.getLogger(__name__)
+
+TSMPTransport = TypeVar("TSMPTransport", bound=SMPTransport)
+
+PERCENTILES: Final = (50, 95, 99)
+"""The latency percentiles that are reported."""
+
+_COMMANDS: Final[dict[int, type[IntEnum]]] = {
+    smphdr.GroupId.OS_MANAGEMENT: smphdr.CommandId.OSManagement,
+    smphdr.GroupId.IMAGE_MANAGEMENT: smphdr.CommandId.ImageManagement,
+    smphdr.GroupId.STATISTICS_MANAGEMENT: smphdr.CommandId.StatisticsManagement,
+    smphdr.GroupId.SETTINGS_MANAGEMENT: smphdr.CommandId.SettingsManagement,
+    smphdr.GroupId.FILE_MANAGEMENT: smphdr.CommandId.FileManagement,
+    smphdr.GroupId.SHELL_MANAGEMENT: smphdr.CommandId.ShellManagement,
+    smphdr.GroupId.ENUM_MANAGEMENT: smphdr.CommandId.EnumManagement,
+    smphdr.GroupId.TRANSPORT_MANAGEMENT: smphdr.CommandId.TransportManagement,
+    smphdr.GroupId.ZEPHYR_MANAGEMENT: smphdr.CommandId.ZephyrManagement,
+    smphdr.UserGroupId.INTERCREATE: smphdr.CommandId.Intercreate,
+}
+
+
+def group_name(group_id: int) -> str:
+    """Return the name of the SMP group `group_id`, e.g. `IMAGE`, or the number if unknown."""
+
+    try:
+        group: Final = (
+            smphdr.GroupId(group_id).name if group_id < 64 else smphdr.UserGroupId(group_id).name
+        )
+    except ValueError:
+        return str(int(group_id))
+    return group.removesuffix("_MANAGEMENT")
+
+
+def request_name(header: smphdr.Header) -> str:
+    """Return the request type of `header`, e.g. `IMAGE.UPLOAD write`."""
+
+    group: Final = group_name(header.group_id)
+    try:
+        command = _COMMANDS[header.group_id](header.command_id).name
+    except (KeyError, ValueError):
+        command = str(int(header.command_id))
+    op: Final = "write" if header.op in (smphdr.OP.WRITE, smphdr.OP.WRITE_RSP) else "read"
+    return f"{group}.{command} {op}"
+
+
+@dataclass(frozen=True)
+class Sample:
+    """One request and its response."""
+
+    start: float
+    end: float
+    tx: int
+    rx: int
+
+    @property
+    def latency(self) -> float:
+        return self.end - self.start
+
+
+@dataclass(frozen=True)
+class Summary:
+    """The timing of all requests of one type."""
+
+    request: str
+    count: int
+    tx: int
+    rx: int
+    latency: dict[str, float]
+    """The latency percentiles and max, in seconds, e.g. `{"p50": 0.01, ..., "max": 0.02}`."""
+    throughput: float
+    """The bytes sent and received per second, from the first request to the last response."""
+    lost: int
+    """The number of requests that were not answered."""
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "request": self.request,
+            "count": self.count,
+            "bytes_tx": self.tx,
+            "bytes_rx": self.rx,
+            "latency_s": self.latency,
+            "throughput_Bps": self.throughput,
+            "lost": self.lost,
+        }
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Return the nearest-rank `p`th percentile of the non-empty `sorted_values`."""
+
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+@dataclass
+class Timings:
+    """Records the round trips of the instrumented transports."""
+
+    samples: dict[str, list[Sample]] = field(default_factory=dict)
+    _in_flight: dict[int, tuple[str, float, int]] = field(default_factory=dict)
+
+    def sent(self, frame: bytes) -> None:
+        """Record that the request `frame` was sent."""
+
+        try:
+            header: Final = smphdr.Header.loads(frame[: smphdr.Header.SIZE])
+        except Exception as e:
+            logger.debug(f"Not timing a frame without an SMP header: {e}")
+            return
+        self._in_flight[header.sequence] = (request_name(header), time.monotonic(), len(frame))
+
+    def received(self, frame: bytes) -> None:
+        """Record that the response `frame` was received."""
+
+        end: Final = time.monotonic()
+        try:
+            header: Final = smphdr.Header.loads(frame[: smphdr.Header.SIZE])
+        except Exception as e:
+            logger.debug(f"Not timing a frame without an SMP header: {e}")
+            return
+        request = self._in_flight.pop(header.sequence, None)
+        if request is None:
+            logger.debug(f"Not timing a response with unexpected sequence {header.sequence}")
+            return
+        name, start, tx = request
+        self.samples.setdefault(name, []).append(Sample(start, end, tx, len(frame)))
+
+    def summarize(self) -> list[Summary]:
+        """Return the `Summary` of each request type, in the order they were first answered."""
+
+        lost: Final[dict[str, int]] = {}
+        for name, _, _ in self._in_flight.values():
+            lost[name] = lost.get(name, 0) + 1
+
+        summaries: Final = []
+        for name, samples in self.samples.items():
+            latencies = sorted(s.latency for s in samples)
+            tx = sum(s.tx for s in samples)
+            rx = sum(s.rx for s in samples)
+            span = max(s.end for s in samples) - min(s.start for s in samples)
+            summaries.append(
+                Summary(
+                    request=name,
+                    count=len(samples),
+                    tx=tx,
+                    rx=rx,
+                    latency={f"p{p}": percentile(latencies, p) for p in PERCENTILES}
+                    | {"max": latencies[-1]},
+                    throughput=(tx + rx) / span if span > 0 else 0.0,
+                    lost=lost.pop(name, 0),
+                )
+            )
+        summaries.extend(
+            Summary(name, 0, 0, 0, {}, 0.0, count) for name, count in lost.items()
+        )  # no response at all
+        return summaries
+
+
+_timings: Timings | None = None
+
+
+def start() -> Timings:
+    """Start recording the round trips of the transports from `get_transport()`."""
+
+    global _timings
+    _timings = Timings()
+    return _timings
+
+
+def stop() -> Timings | None:
+    """Stop recording and return what was recorded, if anything."""
+
+    global _timings
+    timings: Final = _timings
+    _timings = None
+    return timings
+
+
+def active() -> bool:
+    """Return `True` if round trips are being recorded."""
+
+    return _timings is not None
+
+
+def instrument(transport: TSMPTransport) -> TSMPTransport:
+    """Record the frames sent and received by `transport` while timing is active.
+
+    The `send()` and `receive()` methods of the instance are wrapped, which also times
+    `send_and_receive()` since the transports implement it with those.
+    """
+
+    if getattr(transport, "_smpmgr_timed", False):
+        return transport
+
+    send: Final = transport.send
+    receive: Final = transport.receive
+
+    async def timed_send(data: bytes) -> None:
+        if _timings is not None:
+            _timings.sent(data)
+        await send(data)
+
+    async def timed_receive() -> bytes:
+        frame: Final = await receive()
+        if _timings is not None:
+            _timings.received(frame)
+        return frame
+
+    setattr(transport, "send", timed_send)
+    setattr(transport, "receive", timed_receive)
+    setattr(transport, "_smpmgr_timed", True)
+    return transport
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}"
+
+
+def print_summary(summaries: list[Summary]) -> None:
+    """Print `summaries` as a table."""
+
+    table: Final = Table(title="Request timing (ms)")
+    table.add_column("Request", overflow="fold")
+    table.add_column("Count", justify="right")
+    table.add_column("Bytes TX/RX", justify="right")
+    for p in PERCENTILES:
+        table.add_column(f"p{p}", justify="right")
+    table.add_column("max", justify="right")
+    table.add_column("KiB/s", justify="right")
+    table.add_column("Lost", justify="right")
+    for s in summaries:
+        table.add_row(
+            s.request,
+            str(s.count),
+            f"{s.tx}/{s.rx}",
+            *(_ms(s.latency[f"p{p}"]) if s.count else "-" for p in PERCENTILES),
+            _ms(s.latency["max"]) if s.count else "-",
+            f"{s.throughput / 1024:.1f}",
+            str(s.lost),
+        )
+    print(table)
+
+
+def report(json_path: Path | None) -> None:
+    """Stop recording, then print the summary, and write it as JSON to `json_path` if given."""
+
+    timings: Final = stop()
+    if timings is None:
+        return
+    summaries: Final = timings.summarize()
+    if summaries:
+        print_summary(summaries)
+    else:
+        logger.info("No requests were timed")
+    if json_path is not None:
+        json_path.write_text(json.dumps([s.to_json() for s in summaries], indent=2) + "\n")
+        logger.info(f"Wrote the request timing to {json_path}")
@@ -0,0 +1,149 @@
+"""Chrome trace-event export of the phases of an upgrade, i.e. `upgrade --trace`.
+
+The trace is a JSON file in the Trace Event Format that can be opened with `chrome://tracing`
+or https://ui.perfetto.dev.  Each device has its own track, which is selected with `track()`
+for the current `asyncio` task, so that concurrent upgrades do not need to pass it around.
+When no trace is being recorded, `span()` and `instant()` do nothing.
+"""
+
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Final, Iterator
+
+logger: Final = logging.getLogger(__name__)
+
+LOCAL_TRACK: Final = "smpmgr"
+"""The track of the work that is not specific to a device, e.g. inspecting the image."""
+
+_track: Final[ContextVar[str]] = ContextVar("track", default=LOCAL_TRACK)
+
+
+class Tracer:
+    """Collects trace events, timestamped relative to the creation of the `Tracer`."""
+
+    def __init__(self) -> None:
+        self.events: Final[list[dict[str, Any]]] = []
+        self._tracks: Final[dict[str, int]] = {}
+        self._t0: Final = time.monotonic()
+
+    def _us(self, t: float) -> float:
+        return round((t - self._t0) * 1_000_000, 3)
+
+    def _tid(self, track: str) -> int:
+        if track not in self._tracks:
+            self._tracks[track] = len(self._tracks) + 1
+            self.events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": self._tracks[track],
+                    "args": {"name": track},
+                }
+            )
+        return self._tracks[track]
+
+    def complete(
+        self, track: str, name: str, start: float, end: float, args: dict[str, Any]
+    ) -> None:
+        """Record that `name` ran on `track` from `start` to `end`, from `time.monotonic()`."""
+
+        self.events.append(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": self._us(start),
+                "dur": self._us(end) - self._us(start),
+                "pid": os.getpid(),
+                "tid": self._tid(track),
+                "args": args,
+            }
+        )
+
+    def instant(self, track: str, name: str, args: dict[str, Any]) -> None:
+        """Record that `name` happened on `track` now."""
+
+        self.events.append(
+            {
+                "name": name,
+                "ph": "i",
+                "s": "t",
+                "ts": self._us(time.monotonic()),
+                "pid": os.getpid(),
+                "tid": self._tid(track),
+                "args": args,
+            }
+        )
+
+    def save(self, path: Path) -> None:
+        """Write the trace to `path`."""
+
+        path.write_text(json.dumps({"traceEvents": self.events, "displayTimeUnit": "ms"}))
+        logger.info(f"Wrote {len(self.events)} trace events to {path}")
+
+
+_tracer: Tracer | None = None
+
+
+def start() -> Tracer:
+    """Start recording a trace."""
+
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop(path: Path) -> None:
+    """Stop recording and write the trace to `path`, if one was being recorded."""
+
+    global _tracer
+    tracer: Final = _tracer
+    _tracer = None
+    if tracer is not None:
+        tracer.save(path)
+
+
+def track(name: str) -> None:
+    """Record the events of the current `asyncio` task, and the tasks it creates, on `name`."""
+
+    _track.set(name)
+
+
+@contextmanager
+def span(name: str, **args: Any) -> Iterator[None]:
+    """Record the duration of the `with` block as `name` on the current track.
+
+    If the block raises, the exception is recorded in the event's arguments.
+    """
+
+    if _tracer is None:
+        yield
+        return
+    start: Final = time.monotonic()
+    try:
+        yield
+    except BaseException as e:
+        args["error"] = f"{e.__class__.__name__} - {e}"
+        raise
+    finally:
+        if _tracer is not None:
+            _tracer.complete(_track.get(), name, start, time.monotonic(), args)
+
+
+def complete(name: str, start: float, **args: Any) -> None:
+    """Record `name` on the current track from `start`, from `time.monotonic()`, until now."""
+
+    if _tracer is not None:
+        _tracer.complete(_track.get(), name, start, time.monotonic(), args)
+
+
+def instant(name: str, **args: Any) -> None:
+    """Record that `name` happened now on the current track, e.g. a reconnect."""
+
+    if _tracer is not None:
+        _tracer.instant(_track.get(), name, args)
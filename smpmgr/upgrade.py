@@ -0,0 +1,434 @@
+"""The upgrade command."""
+
+import logging
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Final, List, cast
+
+import typer
+from rich import print
+from rich.progress import Progress, SpinnerColumn, TextColumn
+from smp import error as smperr
+from smp.image_management import (
+    ImageManagementErrorV1,
+    ImageManagementErrorV2,
+    ImageStatesReadResponse,
+)
+from smp.os_management import OS_MGMT_RET_RC
+from smpclient import SMPClient
+from smpclient.extensions import intercreate as ic
+from smpclient.generics import error, error_v1, error_v2, success
+from smpclient.requests.image_management import ImageStatesRead, ImageStatesWrite
+from smpclient.requests.os_management import ResetWrite
+from typing_extensions import Annotated, assert_never
+
+from smpmgr import trace
+from smpmgr.common import (
+    Options,
+    connect_with_spinner,
+    drop_connection,
+    get_custom_smpclient,
+    get_smpclient,
+    map_file,
+    run,
+    smp_pipeline,
+    smp_request,
+)
+from smpmgr.fleet import get_target_options, print_summary, target_label, upgrade_many
+from smpmgr.image_management import (
+    BOOT_TIMEOUT_S,
+    RESUME_RETRIES,
+    BootResult,
+    check_booted,
+    find_image,
+    upload_with_progress_bar,
+    verify_image,
+    wait_for_boot,
+)
+from smpmgr.user.intercreate import upload_with_progress_bar as ic_upload_with_progress_bar
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class UpgradeImage:
+    """A FW image file and the slot to upload it to."""
+
+    file: Path
+    slot: int
+    hash: bytes | None = None
+    """The hash from the image's TLVs, or `None` if it was not inspected."""
+
+
+def parse_image(image: str, default_slot: int) -> UpgradeImage:
+    """Parse an image like `app.bin` or `app.bin:2`, using `default_slot` if none is given."""
+
+    file, separator, slot = image.rpartition(":")
+    if separator and slot.isdecimal():
+        return UpgradeImage(Path(file), int(slot))
+    return UpgradeImage(Path(image), default_slot)
+
+
+async def wait_with_spinner(
+    smpclient: SMPClient, reset_time: float, timeout_s: float
+) -> BootResult:
+    """Spin while waiting for the device to answer after a reset; raises `typer.Exit` on timeout."""
+
+    with Progress(
+        SpinnerColumn(), TextColumn("[progress.description]{task.description}")
+    ) as progress:
+        description: Final = "Waiting for the device to swap and boot..."
+        task: Final = progress.add_task(description=description, total=None)
+        try:
+            boot: Final = await wait_for_boot(smpclient, reset_time, timeout_s)
+        except TimeoutError as e:
+            progress.update(task, description=f"{description} timeout", completed=True)
+            logger.error(str(e))
+            raise typer.Exit(code=1)
+        progress.update(task, description=f"{description} OK", completed=True)
+        return boot
+
+
+def upgrade(
+    ctx: typer.Context,
+    files: Annotated[
+        List[str],
+        typer.Argument(
+            metavar="FILE[:SLOT]...",
+            help="Path to FW image, optionally with the slot to upload it to if not --slot, "
+            "e.g. app.bin:0 net.bin:2.  All images are uploaded over one connection, then "
+            "marked, and the device is reset once.",
+            show_default=False,
+        ),
+    ],
+    slot: Annotated[int, typer.Option(help="The image slot to upload to")] = 0,
+    ic_images: Annotated[
+        List[str],
+        typer.Option(
+            "--ic",
+            metavar="FILE[:IMAGE]",
+            help="Also upload this file with the Intercreate group, like 'ic upload', before "
+            "the reset, e.g. an external flash blob.  May be used more than once.",
+        ),
+    ] = [],
+    confirm: Annotated[
+        bool,
+        typer.Option(
+            "--confirm",
+            help="Permanently confirm the image (prevent revert/rollback). "
+            "Without this flag (default): the image is marked for test swap, and MCUboot will "
+            "revert to the previous image if the new image fails to boot or is not confirmed. "
+            "With this flag: the image is immediately marked as permanent, bypassing MCUboot's "
+            "test/revert safety mechanism. "
+            "[red]WARNING[/red]: Using --confirm skips the test boot and can brick your device. "
+            "[bold]Only use this flag in development scenarios where recovery is possible[/bold], "
+            "such as: MCUboot has serial recovery enabled and you have access to the physical "
+            "serial interface; JTAG/SWD debug headers are exposed and not locked; "
+            "or you have another reliable recovery mechanism. "
+            "[red]DO NOT[/red] use --confirm in production or field deployments where physical "
+            "access for recovery is not available. "
+            "Best practice: always test first by marking for test swap, "
+            "rebooting to verify the image works, "
+            "then confirm the running image with 'smpmgr image state-write --confirm' "
+            "(or some other mechanism).",
+        ),
+    ] = False,
+    bypass_inspect: Annotated[
+        bool,
+        typer.Option(
+            "--bypass-inspect",
+            help="Skip local MCUboot image inspection and read the image hash from the device "
+            "instead of extracting it from the file. "
+            "This is useful when uploading images that are not in MCUboot format, such as "
+            "custom bootloader formats (e.g., NXP's SB3.1) where the hash may be calculated "
+            "differently (e.g., over a specific block rather than the entire binary). "
+            "[bold red]WARNING[/bold red]: When using this option, the responsibility for "
+            "validating image integrity is placed entirely on the device's bootloader. "
+            "If the bootloader does not verify the image, corrupted firmware could be uploaded "
+            "and marked as valid. "
+            "It's assumed the image format encodes some sort of integrity check "
+            "(e.g., CRC or hash)."
+            "[bold red]Only use this option if your bootloader performs its own image integrity "
+            "validation.[/bold red]",
+        ),
+    ] = False,
+    target: Annotated[
+        List[str],
+        typer.Option(
+            help="Upgrade this device too, e.g. port:/dev/ttyACM1, ip:192.168.1.10, or "
+            "ble:AA:BB:CC:DD:EE:FF.  May be used more than once.",
+        ),
+    ] = [],
+    targets_file: Annotated[
+        Path | None,
+        typer.Option(
+            exists=True,
+            dir_okay=False,
+            help="Upgrade the devices listed in this file, one target per line.",
+        ),
+    ] = None,
+    jobs: Annotated[
+        int,
+        typer.Option(min=1, help="Maximum number of devices to upgrade concurrently."),
+    ] = 4,
+    resume: Annotated[
+        bool,
+        typer.Option(
+            "--resume",
+            help="If the connection is lost during the upload, reconnect and continue from the "
+            "offset that the device had received.",
+        ),
+    ] = False,
+    retries: Annotated[
+        int, typer.Option(min=0, help="How many times to reconnect with --resume.")
+    ] = RESUME_RETRIES,
+    force: Annotated[
+        bool,
+        typer.Option(
+            "--force", help="Upload the image even if the device already has an identical one."
+        ),
+    ] = False,
+    wait: Annotated[
+        bool,
+        typer.Option(
+            "--wait",
+            help="After the reset, poll the device until it answers again, then check that the "
+            "new images are running and report how long the swap and boot took.  Images "
+            "uploaded to slot 0 are marked for test too, so that they are swapped in.",
+        ),
+    ] = False,
+    wait_timeout: Annotated[
+        float,
+        typer.Option(min=0, help="How many seconds to wait for the device with --wait."),
+    ] = BOOT_TIMEOUT_S,
+    trace_file: Annotated[
+        Path | None,
+        typer.Option(
+            "--trace",
+            dir_okay=False,
+            help="Write a Chrome trace-event JSON of the upgrade phases and upload chunks to "
+            "this file, with one track per device.  Open it with chrome://tracing or "
+            "https://ui.perfetto.dev.",
+        ),
+    ] = None,
+) -> None:
+    """Upload a FW image, mark it for next boot, and reset the device.
+
+    If the device already has the image, the upload is skipped.
+    If the image is already running, the device is not reset.
+    Many devices can be upgraded concurrently by giving them with --target or --targets-file.
+    With --wait, the command returns once the device is running the new images.
+    """
+
+    if trace_file is not None:
+        trace.start()
+        ctx.call_on_close(lambda: trace.stop(trace_file))
+
+    images: Final = [parse_image(image, slot) for image in files]
+    ic_uploads: Final = [parse_image(image, 0) for image in ic_images]
+
+    if not bypass_inspect:
+        for image in images:
+            with trace.span("inspect", file=str(image.file)):
+                image_check = verify_image(image.file)
+            if image_check.hash is None:
+                typer.echo(f"Could not find IMAGE_TLV_SHA256 in {image.file}.")
+                raise typer.Exit(code=1)
+            image.hash = image_check.hash
+
+    options = cast(Options, ctx.obj)
+
+    if target or targets_file is not None:
+        if len(images) > 1 or ic_uploads:
+            raise typer.BadParameter(
+                "Only one image can be upgraded with --target or --targets-file",
+                param_hint="FILE",
+            )
+        targets: Final = get_target_options(options, target, targets_file)
+        with open(images[0].file, "rb") as image_file, map_file(image_file) as data:
+            results: Final = run(
+                upgrade_many(
+                    targets,
+                    data,
+                    images[0].hash,
+                    images[0].slot,
+                    confirm,
+                    jobs,
+                    retries if resume else 0,
+                    force,
+                    wait_timeout if wait else None,
+                )
+            )
+        print_summary(results)
+        if not all(r.ok for r in results):
+            raise typer.Exit(code=1)
+        return
+
+    smpclient: Final = (
+        get_custom_smpclient(options, ic.ICUploadClient) if ic_uploads else get_smpclient(options)
+    )
+
+    async def read_states() -> (
+        ImageStatesReadResponse | ImageManagementErrorV1 | ImageManagementErrorV2 | None
+    ):
+        if force or bypass_inspect:
+            return None
+        with trace.span("ImageStatesRead"):
+            return await smp_request(
+                smpclient, ImageStatesRead(), "Checking for the images on the device..."
+            )
+
+    async def read_hash(slot: int) -> bytes:
+        """Read the hash of the image in `slot` from the device, for --bypass-inspect."""
+
+        with trace.span("ImageStatesRead"):
+            r = await smp_request(smpclient, ImageStatesRead(), "Waiting for image states...")
+
+        if error(r):
+            print(r)
+            raise typer.Exit(code=1)
+        elif success(r):
+            if len(r.images) == 0:
+                print("No images on device!")
+                raise typer.Exit(code=1)
+            for image in r.images:
+                if image.slot == slot and image.hash is not None:
+                    return image.hash
+            print(f"Image with slot {slot} not found!")
+            raise typer.Exit(code=1)
+        else:
+            assert_never(r)
+
+    async def f() -> None:
+        trace.track(target_label(options))
+        with trace.span("connect"):
+            await connect_with_spinner(smpclient)
+
+        states: Final = await read_states()
+        uploaded = False
+        upgraded: Final[list[UpgradeImage]] = []
+        to_mark: Final[list[UpgradeImage]] = []
+        marked_for_wait: Final[list[UpgradeImage]] = []  # may have been written in place
+
+        for image in images:
+            installed = (
+                None if states is None or image.hash is None else find_image(states, image.hash)
+            )
+            if installed is None:
+                with trace.span("upload", file=str(image.file), slot=image.slot), open(
+                    image.file, "rb"
+                ) as f:
+                    await upload_with_progress_bar(
+                        smpclient, f, image.slot, retries if resume else 0
+                    )
+                uploaded = True
+            elif installed.active:
+                if confirm and not installed.confirmed:
+                    with trace.span("ImageStatesWrite", confirm=True):
+                        confirm_response = await smp_request(
+                            smpclient,
+                            ImageStatesWrite(hash=installed.hash, confirm=True),
+                            f"Confirming the running image {image.file}...",
+                        )
+                    if error(confirm_response):
+                        print(confirm_response)
+                        raise typer.Exit(code=1)
+                print(f"{image.file} is already running on the device.")
+                continue
+            else:
+                print(f"{image.file} is already in slot {installed.slot}, skipping the upload.")
+
+            upgraded.append(image)
+            if image.slot != 0 or confirm or installed is not None:
+                to_mark.append(image)
+            elif wait:
+                to_mark.append(image)
+                marked_for_wait.append(image)
+
+        for ic_upload in ic_uploads:
+            with trace.span("ic upload", file=str(ic_upload.file), image=ic_upload.slot), open(
+                ic_upload.file, "rb"
+            ) as f:
+                await ic_upload_with_progress_bar(
+                    cast(ic.ICUploadClient, smpclient), f, ic_upload.slot
+                )
+            uploaded = True
+
+        if not uploaded and not to_mark:
+            print("Nothing to do.")
+            return
+
+        if to_mark:
+            for image in to_mark:
+                if image.hash is None:
+                    image.hash = await read_hash(image.slot)
+            with trace.span("ImageStatesWrite", confirm=confirm, images=len(to_mark)):
+                image_states_responses = await smp_pipeline(
+                    smpclient,
+                    [ImageStatesWrite(hash=image.hash, confirm=confirm) for image in to_mark],
+                    len(to_mark),
+                    "Marking uploaded images for permanent upgrade..."
+                    if confirm
+                    else "Marking uploaded images for test upgrade...",
+                )
+            for image, image_states_response in zip(to_mark, image_states_responses):
+                if success(image_states_response):
+                    pass
+                elif error(image_states_response):
+                    if image in marked_for_wait:  # e.g. a bootloader wrote it to the primary slot
+                        logger.info(f"Could not mark {image.file}: {image_states_response}")
+                        continue
+                    print(image_states_response)
+                    raise typer.Exit(code=1)
+                else:
+                    assert_never(image_states_response)
+
+        with trace.span("ResetWrite"):
+            reset_response = await smp_request(smpclient, ResetWrite())
+        if success(reset_response):
+            pass
+        elif error(reset_response):
+            if error_v1(reset_response):
+                if reset_response.rc != smperr.MGMT_ERR.EOK:
+                    print(reset_response)
+                    raise typer.Exit(code=1)
+            elif error_v2(reset_response):
+                if reset_response.err.rc != OS_MGMT_RET_RC.OK:
+                    print(reset_response)
+                    raise typer.Exit(code=1)
+            else:
+                assert_never(reset_response)
+        else:
+            assert_never(reset_response)
+        reset_time: Final = time.monotonic()
+
+        if not wait:
+            await drop_connection()
+            print("Upgrade complete.")
+            if to_mark:
+                print("The device may take a few minutes to complete FW swap.")
+            return
+
+        with trace.span("wait"):
+            boot: Final = await wait_with_spinner(smpclient, reset_time, wait_timeout)
+        await drop_connection()
+        print(f"The device answered {boot.duration_s:.1f} s after the reset.")
+
+        failed = False
+        for image in upgraded:
+            if image.hash is None:
+                print(f"{image.file} was not checked, its hash is not known.")
+                continue
+            reason = check_booted(boot.states, image.hash, confirm)
+            if reason is None:
+                print(f"{image.file} is running.")
+            else:
+                print(f"[red]{image.file}: {reason}[/red]")
+                failed = True
+        if failed:
+            raise typer.Exit(code=1)
+
+        print("Upgrade complete.")
+
+    run(f())
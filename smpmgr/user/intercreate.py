@@ -1,6 +1,5 @@
 """The Intercreate (ic) subcommand group."""
 
-import asyncio
 import logging
 from io import BufferedReader
 from pathlib import Path
@@ -20,7 +19,7 @@ from smp.exceptions import SMPBadStartDelimiter
 from smpclient.extensions import intercreate as ic
 from typing_extensions import Annotated
 
-from smpmgr.common import Options, connect_with_spinner, get_custom_smpclient
+from smpmgr.common import Options, connect_with_spinner, get_custom_smpclient, map_file, run
 
 app = typer.Typer(
     name="ic", help=f"The Intercreate User Group ({smphdr.UserGroupId.INTERCREATE.value})"
@@ -43,8 +42,7 @@ async def upload_with_progress_bar(
         TransferSpeedColumn(),
         "•",
         TimeRemainingColumn(),
-    ) as progress:
-        data = file.read()
+    ) as progress, map_file(file) as data:
         file.close()
         task = progress.add_task("Uploading", total=len(data), filename=file.name, start=True)
         try:
@@ -77,4 +75,4 @@ def upload(
         with open(file, "rb") as f:
             await upload_with_progress_bar(smpclient, f, image)
 
-    asyncio.run(f())
+    run(f())
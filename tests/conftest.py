@@ -0,0 +1,109 @@
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass
+from functools import partial
+from typing import AsyncContextManager, AsyncIterator, Callable, Iterator
+
+import pytest
+from smpclient import SMPClient
+from smpclient.transport.udp import SMPUDPTransport
+
+from smpmgr import capabilities, common
+from smpmgr.common import Session, run
+from smpmgr.emulator import Emulator, serve_udp
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory: pytest.TempPathFactory, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Keep the caches of the tests, e.g. of the device capabilities, out of the user's cache."""
+
+    monkeypatch.setenv("SMPMGR_CACHE_DIR", str(tmp_path_factory.mktemp("cache")))
+    monkeypatch.setattr(capabilities, "_entries", {})
+
+
+@dataclass(frozen=True)
+class EmulatorServer:
+    """An `Emulator` served over UDP on a free port of 127.0.0.1."""
+
+    emulator: Emulator
+    port: int
+
+    def transport(self) -> SMPUDPTransport:
+        """Return a transport that connects to the server's port rather than to port 1337.
+
+        `SMPClient.connect()` does not take a port, so the port is bound to the transport, which
+        also lets the code under test reconnect, e.g. after a reset.
+        """
+
+        transport = SMPUDPTransport()
+        setattr(transport, "connect", partial(SMPUDPTransport.connect, transport, port=self.port))
+        return transport
+
+    @asynccontextmanager
+    async def client(
+        self, transport: SMPUDPTransport | None = None, timeout_s: float = 1.0
+    ) -> AsyncIterator[SMPClient]:
+        """Connect an `SMPClient` to the server, using `transport` if given."""
+
+        transport = transport or self.transport()
+        await transport.connect("127.0.0.1", timeout_s)
+        try:
+            yield SMPClient(transport, "127.0.0.1", timeout_s)
+        finally:
+            await transport.disconnect()
+
+
+ServeEmulator = Callable[[Emulator], AsyncContextManager[EmulatorServer]]
+
+
+@pytest.fixture
+def serve_emulator() -> ServeEmulator:
+    """Serve an `Emulator` over UDP within `async with serve_emulator(emulator) as server:`."""
+
+    @asynccontextmanager
+    async def serve(emulator: Emulator) -> AsyncIterator[EmulatorServer]:
+        server = await serve_udp(emulator, "127.0.0.1", 0)
+        try:
+            yield EmulatorServer(emulator, server.get_extra_info("sockname")[1])
+        finally:
+            server.close()
+
+    return serve
+
+
+@dataclass(frozen=True)
+class EmulatorCLI:
+    """Runs `smpmgr` commands against a served `Emulator`, like the interactive shell does."""
+
+    server: EmulatorServer
+
+    def __call__(self, *args: str) -> int:
+        """Run `smpmgr --ip 127.0.0.1 *args` and return its exit code."""
+
+        from smpmgr.main import app
+
+        code = app(["--ip", "127.0.0.1", *args], standalone_mode=False)
+        return code if isinstance(code, int) else 0
+
+
+@pytest.fixture
+def emulator_cli(
+    serve_emulator: ServeEmulator, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[Callable[[Emulator], EmulatorCLI]]:
+    """Return `EmulatorCLI`s of emulators served on the event loop of a `Session`.
+
+    The commands run on the session's event loop, like in the interactive shell, so that the
+    emulator is served while they run.
+    """
+
+    with Session():
+        stack = AsyncExitStack()
+
+        def serve(emulator: Emulator) -> EmulatorCLI:
+            server = run(stack.enter_async_context(serve_emulator(emulator)))
+            monkeypatch.setattr(common, "get_transport", lambda options: server.transport())
+            return EmulatorCLI(server)
+
+        try:
+            yield serve
+        finally:
+            run(stack.aclose())
@@ -0,0 +1,44 @@
+import sys
+
+import pytest
+import typer
+
+from smpmgr.batch import parse_script, run_steps
+
+SCRIPT = """
+# provisioning
+os echo hello
+--timeout 10 shell "echo hello world"  # inline comment
+
+image state-read
+"""
+
+
+def test_parse_script() -> None:
+    steps = parse_script(SCRIPT)
+    assert [(s.line, s.args) for s in steps] == [
+        (3, ["os", "echo", "hello"]),
+        (4, ["--timeout", "10", "shell", "echo hello world"]),
+        (6, ["image", "state-read"]),
+    ]
+    with pytest.raises(typer.BadParameter):
+        parse_script('shell "unterminated')
+
+
+def invoke(args: list[str]) -> None:
+    if args[0] == "fail":
+        sys.exit(2)
+    if args[0] == "raise":
+        raise RuntimeError("A Session is already active")
+    sys.exit(0)
+
+
+@pytest.mark.parametrize("keep_going", [False, True])
+def test_run_steps_stops_on_error(keep_going: bool) -> None:
+    steps = parse_script("ok\nfail\nraise\nok\n")
+    results = run_steps(steps, invoke, keep_going)
+    if keep_going:
+        assert [r.exit_code for r in results] == [0, 2, 1, 0]
+    else:
+        assert [r.exit_code for r in results] == [0, 2]
+    assert all(r.duration_s >= 0 for r in results)
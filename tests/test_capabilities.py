@@ -0,0 +1,124 @@
+import asyncio
+import time
+from typing import Any
+
+import pytest
+import typer
+from smp.header import GroupId, Header
+from smp.image_management import ImageState, ImageStatesReadResponse
+from smpclient import SMPClient
+from smpclient.generics import success
+from smpclient.requests.file_management import FileStatus
+
+from smpmgr import cache, capabilities
+from smpmgr.capabilities import Capabilities
+from smpmgr.common import connect_with_spinner, smp_request
+from smpmgr.emulator import Emulator
+from tests.conftest import ServeEmulator
+
+
+def states(image_hash: bytes) -> ImageStatesReadResponse:
+    return ImageStatesReadResponse(
+        images=[ImageState(slot=0, version="1.0.0", hash=image_hash, active=True, confirmed=True)]
+    )
+
+
+def test_cache_and_invalidation() -> None:
+    assert capabilities.get("192.0.2.1") is None
+    assert capabilities.supports("192.0.2.1", GroupId.FILE_MANAGEMENT)
+
+    capabilities.save_groups("192.0.2.1", [GroupId.OS_MANAGEMENT, GroupId.IMAGE_MANAGEMENT])
+    assert not capabilities.supports("192.0.2.1", GroupId.FILE_MANAGEMENT)
+    assert capabilities.supports("192.0.2.1", GroupId.ENUM_MANAGEMENT)  # to read them again
+
+    capabilities.note_image_states("192.0.2.1", states(b"\x01" * 32))  # not adopted
+    assert capabilities.get("192.0.2.1") == Capabilities(frozenset({0, 1}), None)
+
+    capabilities.save("192.0.2.1", Capabilities(frozenset({0, 1}), "01" * 32))
+    capabilities.note_image_states("192.0.2.1", states(b"\x01" * 32))
+    assert capabilities.get("192.0.2.1") is not None
+
+    capabilities.note_image_states("192.0.2.1", states(b"\x02" * 32))
+    assert capabilities.get("192.0.2.1") is None
+
+
+@pytest.mark.parametrize("current", [True, False])
+def test_smp_request_fails_fast_unless_the_image_has_changed(
+    serve_emulator: ServeEmulator, current: bool
+) -> None:
+    emulator = Emulator()
+    emulator.files["/lfs/a"] = bytearray(b"a")
+    image_hash = emulator.slots[0].hash.hex() if current else "00" * 32
+    capabilities.save("127.0.0.1", Capabilities(frozenset({GroupId.OS_MANAGEMENT}), image_hash))
+
+    async def main() -> None:
+        async with serve_emulator(emulator) as server, server.client(timeout_s=10.0) as smpclient:
+            r = await smp_request(smpclient, FileStatus(name="/lfs/a"))
+            assert success(r) and r.len == 1
+
+    if current:
+        with pytest.raises(typer.Exit):
+            asyncio.run(main())
+        assert emulator.stats["smp"]["rx_frames"] == 1  # the ImageStatesRead
+    else:
+        asyncio.run(main())
+        found = capabilities.get("127.0.0.1")
+        assert found is not None and GroupId.FILE_MANAGEMENT in (found.groups or ())
+
+
+def test_read_capabilities(serve_emulator: ServeEmulator) -> None:
+    async def main() -> None:
+        emulator = Emulator()
+        async with serve_emulator(emulator) as server, server.client() as smpclient:
+            found = await capabilities.read_capabilities(smpclient)
+
+        assert found is not None and found == capabilities.get("127.0.0.1")
+        assert found.groups == frozenset(emulator.groups)
+        assert found.image_hash == emulator.slots[0].hash.hex()
+
+    asyncio.run(main())
+
+
+class SilentEnumEmulator(Emulator):
+    """Never answers the enumeration group, like some SMP servers without it."""
+
+    async def handle(self, frame: bytes) -> bytes | None:
+        if Header.loads(frame[: Header.SIZE]).group_id == GroupId.ENUM_MANAGEMENT:
+            self.stats["smp"]["dropped"] += 1
+            return None
+        return await super().handle(frame)
+
+
+def test_probe_of_a_device_without_the_enumeration_group(serve_emulator: ServeEmulator) -> None:
+    emulator = SilentEnumEmulator()
+
+    async def main() -> float:
+        async with serve_emulator(emulator) as server:
+            start = time.monotonic()
+            for _ in range(2):
+                smpclient = SMPClient(server.transport(), "127.0.0.1", timeout_s=5.0)
+                await connect_with_spinner(smpclient)
+                await smpclient.disconnect()
+            return time.monotonic() - start
+
+    assert asyncio.run(main()) < capabilities.PROBE_TIMEOUT_S + 1.0
+    assert emulator.stats["smp"]["dropped"] == 1  # not asked again
+    assert capabilities.get("127.0.0.1") == Capabilities(None, emulator.slots[0].hash.hex())
+
+
+def test_entries_are_read_from_disk_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    capabilities.save_groups("192.0.2.1", [GroupId.OS_MANAGEMENT])
+    monkeypatch.setattr(capabilities, "_entries", {})  # e.g. in the next run
+
+    loads: list[str] = []
+    load = cache.load
+
+    def counting_load(name: str) -> dict[str, Any]:
+        loads.append(name)
+        return load(name)
+
+    monkeypatch.setattr(cache, "load", counting_load)
+    for _ in range(3):
+        assert not capabilities.supports("192.0.2.1", GroupId.FILE_MANAGEMENT)
+        assert capabilities.supports("192.0.2.2", GroupId.FILE_MANAGEMENT)
+    assert len(loads) == 2  # one for each device
@@ -0,0 +1,69 @@
+import gzip
+import re
+import time
+from pathlib import Path
+
+import pytest
+
+from smpmgr import capture
+from smpmgr.capture import BUFFER_SIZE, Capture, CaptureError
+
+TIMESTAMP = r"\[\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{3}\] "
+
+
+def test_lines_are_timestamped_across_writes(tmp_path: Path) -> None:
+    path = tmp_path / "capture.log"
+    with Capture(path) as capture:
+        capture.write("hello ")
+        capture.write("world\nsecond ")
+        capture.write("line\n")
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 2
+    assert re.fullmatch(TIMESTAMP + "hello world", lines[0])
+    assert re.fullmatch(TIMESTAMP + "second line", lines[1])
+
+
+def test_rotation_with_gzip(tmp_path: Path) -> None:
+    path = tmp_path / "capture.log"
+    with Capture(path, max_bytes=1000, backups=2, compress=True) as capture:
+        for i in range(100):
+            capture.write(f"line {i:03}\n")
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "capture.log",
+        "capture.log.1.gz",
+        "capture.log.2.gz",
+    ]
+    newest = gzip.decompress((tmp_path / "capture.log.1.gz").read_bytes()).decode()
+    assert all(re.fullmatch(TIMESTAMP + r"line \d{3}", line) for line in newest.splitlines())
+    assert path.read_text().splitlines()[-1].endswith("line 099")
+
+
+@pytest.mark.skipif(not Path("/dev/full").exists(), reason="needs /dev/full")
+def test_a_failed_writer_is_reported() -> None:
+    with pytest.raises(CaptureError, match="No space left"):
+        with Capture(Path("/dev/full")) as capture:
+            for _ in range(1000):
+                capture.write("x" * (BUFFER_SIZE // 100) + "\n")
+                time.sleep(0.001)  # let the writer fill its buffer and fail
+
+
+def test_write_drops_rather_than_blocks_when_the_queue_is_full(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+) -> None:
+    monkeypatch.setattr(capture, "MAX_QUEUED", 3)
+    path = tmp_path / "capture.log"
+    capture_file = Capture(path)  # the writer is not started yet, so the queue fills up
+
+    start = time.monotonic()
+    for i in range(10):
+        capture_file.write(f"line {i}\n")
+    assert time.monotonic() - start < capture.FLUSH_INTERVAL_S / 10
+
+    with capture_file:
+        pass
+
+    lines = [line[len("[2000-01-01T00:00:00.000] ") :] for line in path.read_text().splitlines()]
+    assert lines == ["line 0", "line 1", "line 2", "<dropped 7 writes>"]
+    assert "Dropped 7 writes" in caplog.text
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from contextlib import AsyncExitStack
+
+import pytest
+import typer
+from smpclient.generics import success
+from smpclient.requests.os_management import EchoWrite, ResetWrite
+from smpclient.requests.statistics_management import GroupData
+from smpclient.transport import SMPTransport
+
+from smpmgr import common
+from smpmgr.common import (
+    Options,
+    Session,
+    TransportDefinition,
+    connect_with_spinner,
+    drop_connection,
+    get_buf_count,
+    get_smpclient,
+    pipeline,
+    run,
+    smp_request,
+    try_request,
+)
+from smpmgr.emulator import Emulator, LinkModel
+from tests.conftest import ServeEmulator
+
+OPTIONS = Options(
+    timeout=1.0,
+    transport=TransportDefinition(port=None, ble=None, ip="127.0.0.1"),
+    mtu=None,
+    baudrate=None,
+)
+
+
+async def echo() -> None:
+    smpclient = get_smpclient(OPTIONS)
+    await connect_with_spinner(smpclient)
+    assert success(await smp_request(smpclient, EchoWrite(d="hello")))
+
+
+def test_session_reuses_and_remakes_the_connection(
+    monkeypatch: pytest.MonkeyPatch, serve_emulator: ServeEmulator
+) -> None:
+    transports: list[SMPTransport] = []
+
+    with Session() as session:
+        stack = AsyncExitStack()
+        server = run(stack.enter_async_context(serve_emulator(Emulator())))
+
+        def get_transport(options: Options) -> SMPTransport:
+            transports.append(server.transport())
+            return transports[-1]
+
+        monkeypatch.setattr(common, "get_transport", get_transport)
+        session.resolve(OPTIONS)
+        try:
+            run(echo())
+            run(echo())
+            assert len(transports) == 1
+
+            run(drop_connection())  # e.g. after a reset
+            run(echo())
+            assert len(transports) == 2
+
+            with pytest.raises(typer.Exit):  # the transport belongs to the session's loop
+                asyncio.run(echo())
+            run(echo())
+            assert len(transports) == 2
+        finally:
+            run(stack.aclose())
+
+
+@pytest.mark.parametrize("buf_count", [1, 2])
+def test_pipeline_depth_is_capped_at_the_buffer_count(
+    serve_emulator: ServeEmulator, buf_count: int
+) -> None:
+    emulator = Emulator(LinkModel(latency_s=0.01, buf_count=buf_count))
+
+    async def main() -> None:
+        async with serve_emulator(emulator) as server, server.client(timeout_s=0.5) as smpclient:
+            responses = await pipeline(smpclient, [GroupData(name="smp") for _ in range(8)], 8)
+            assert all(success(r) for r in responses)
+            assert await get_buf_count(smpclient) == buf_count
+
+    asyncio.run(main())
+    assert emulator.stats["smp"]["dropped"] == 0
+
+
+def test_try_request_returns_none_without_logging_an_error(
+    serve_emulator: ServeEmulator, caplog: pytest.LogCaptureFixture
+) -> None:
+    async def main() -> None:
+        async with serve_emulator(Emulator(LinkModel(reset_s=1.0))) as server:
+            async with server.client(timeout_s=0.2) as smpclient:
+                echoed = await try_request(smpclient, EchoWrite(d="hello"))
+                assert echoed is not None and success(echoed)
+                reset = await try_request(smpclient, ResetWrite())
+                assert reset is not None and success(reset)
+                assert await try_request(smpclient, EchoWrite(d="hello")) is None
+
+    asyncio.run(main())
+    assert not [r for r in caplog.records if r.levelno >= logging.ERROR]
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+import typer
+from smp.header import GroupId
+
+from smpmgr import discovery
+from smpmgr.common import Options, TransportDefinition
+from smpmgr.emulator import Emulator
+from tests.conftest import ServeEmulator
+
+
+def test_udp_addresses() -> None:
+    assert discovery.udp_addresses(["192.168.1.0/30", "192.168.1.2", "10.0.0.5"]) == [
+        "192.168.1.1",
+        "192.168.1.2",
+        "10.0.0.5",
+    ]
+    with pytest.raises(typer.BadParameter):
+        discovery.udp_addresses(["192.168.1.300"])
+    with pytest.raises(typer.BadParameter):
+        discovery.udp_addresses(["10.0.0.0/8"])
+
+
+def test_probe_many(monkeypatch: pytest.MonkeyPatch, serve_emulator: ServeEmulator) -> None:
+    async def main() -> None:
+        targets = [
+            Options(0.3, TransportDefinition(port=None, ble=None, ip=ip), None, None)
+            for ip in ("127.0.0.2", "127.0.0.1")
+        ]
+        async with serve_emulator(Emulator()) as server:
+            monkeypatch.setattr(discovery, "get_transport", lambda options: server.transport())
+            found = await discovery.probe_many(targets, 0.3, jobs=2)
+
+        assert [f.target for f in found] == ["ip:127.0.0.1"]
+        assert found[0].rtt_s < 0.3
+        assert found[0].groups is not None and GroupId.IMAGE_MANAGEMENT in found[0].groups
+
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import os
+from typing import Awaitable, Callable
+
+import pytest
+from smpclient import SMPClient
+from smpclient.extensions.intercreate import ICUploadClient
+from smpclient.generics import error, success
+from smpclient.requests.file_management import FileHashChecksum, FileStatus
+from smpclient.requests.image_management import ImageStatesRead, ImageStatesWrite
+from smpclient.requests.os_management import EchoWrite, ResetWrite
+from smpclient.requests.shell_management import Execute
+from smpclient.requests.statistics_management import GroupData
+from smpclient.transport.serial import SMPSerialTransport
+
+from smpmgr.emulator import Emulator, LinkModel, serve_pty
+from tests.conftest import ServeEmulator
+
+
+def with_emulator(
+    serve_emulator: ServeEmulator,
+    f: Callable[[SMPClient, Emulator], Awaitable[None]],
+    link: LinkModel = LinkModel(),
+) -> None:
+    async def main() -> None:
+        emulator = Emulator(link)
+        async with serve_emulator(emulator) as server, server.client() as smpclient:
+            await f(smpclient, emulator)
+
+    asyncio.run(main())
+
+
+def test_echo_shell_and_stats(serve_emulator: ServeEmulator) -> None:
+    async def f(smpclient: SMPClient, emulator: Emulator) -> None:
+        r = await smpclient.request(EchoWrite(d="hello"))
+        assert success(r) and r.r == "hello"
+        r2 = await smpclient.request(Execute(argv=["echo", "a", "b"]))
+        assert success(r2) and (r2.o, r2.ret) == ("a b", 0)
+        r3 = await smpclient.request(GroupData(name="smp"))
+        assert success(r3) and r3.fields["rx_frames"] == 3
+        r4 = await smpclient.request(GroupData(name="missing"))
+        assert error(r4)
+
+    with_emulator(serve_emulator, f)
+
+
+def test_upload_resume_and_swap(serve_emulator: ServeEmulator) -> None:
+    image = os.urandom(10_000)
+
+    async def f(smpclient: SMPClient, emulator: Emulator) -> None:
+        async for offset in smpclient.upload(image):
+            assert offset > 0
+            break  # interrupted
+
+        offsets = [offset async for offset in smpclient.upload(image)]
+        assert offsets[0] > 0 and offsets[-1] == len(image)
+        assert emulator.slots[1].data == image
+        assert emulator.stats["flash"]["bytes_written"] == len(image)
+
+        image_hash = hashlib.sha256(image).digest()
+        assert success(await smpclient.request(ImageStatesWrite(hash=image_hash)))
+        assert success(await smpclient.request(ResetWrite()))
+        states = await smpclient.request(ImageStatesRead())
+        assert success(states)
+        assert [(i.slot, i.hash == image_hash, i.active) for i in states.images] == [
+            (0, True, True),
+            (1, False, False),
+        ]
+
+    with_emulator(serve_emulator, f)
+
+
+def test_intercreate_upload(serve_emulator: ServeEmulator) -> None:
+    data = os.urandom(5_000)
+
+    async def f(smpclient: SMPClient, emulator: Emulator) -> None:
+        client = ICUploadClient(smpclient._transport, "127.0.0.1", timeout_s=1.0)
+        offsets = [offset async for offset in client.ic_upload(data, image=2)]
+        assert offsets[-1] == len(data)
+        assert emulator.ic_images[2] == data
+
+    with_emulator(serve_emulator, f)
+
+
+def test_file_upload_and_hash(serve_emulator: ServeEmulator) -> None:
+    data = os.urandom(5_000)
+
+    async def f(smpclient: SMPClient, emulator: Emulator) -> None:
+        async for _ in smpclient.upload_file(data, "/lfs/data.bin"):
+            pass
+        assert emulator.files["/lfs/data.bin"] == data
+        r = await smpclient.request(FileStatus(name="/lfs/data.bin"))
+        assert success(r) and r.len == len(data)
+        r2 = await smpclient.request(FileHashChecksum(name="/lfs/data.bin"))
+        assert success(r2) and r2.output == hashlib.sha256(data).digest()
+        assert bytes(await smpclient.download_file("/lfs/data.bin")) == data
+
+    with_emulator(serve_emulator, f)
+
+
+def test_latency_and_oversized_requests(serve_emulator: ServeEmulator) -> None:
+    async def f(smpclient: SMPClient, emulator: Emulator) -> None:
+        start = asyncio.get_running_loop().time()
+        assert success(await smpclient.request(EchoWrite(d="x")))
+        assert asyncio.get_running_loop().time() - start >= 0.05
+        with pytest.raises(TimeoutError):
+            await smpclient.request(EchoWrite(d="x" * 300), timeout_s=0.2)
+
+    with_emulator(serve_emulator, f, LinkModel(latency_s=0.05, buf_size=256))
+
+
+def test_requests_beyond_the_buffer_count_are_dropped(serve_emulator: ServeEmulator) -> None:
+    async def f(smpclient: SMPClient, emulator: Emulator) -> None:
+        for _ in range(3):
+            await smpclient._transport.send(EchoWrite(d="x").BYTES)
+        await asyncio.sleep(0.1)
+        assert emulator.stats["smp"]["dropped"] == 1
+
+    with_emulator(serve_emulator, f, LinkModel(latency_s=0.01, buf_count=2))
+
+
+@pytest.mark.skipif(os.name != "posix", reason="pseudo-terminals are POSIX only")
+def test_serial_over_pty() -> None:
+    async def main() -> None:
+        server = await serve_pty(Emulator())
+        transport = SMPSerialTransport(
+            max_smp_encoded_frame_size=1024, line_length=1024, line_buffers=1
+        )
+        smpclient = SMPClient(transport, server.port, timeout_s=1.0)
+        await smpclient.connect()
+        try:
+            r = await smpclient.request(EchoWrite(d="x" * 500))
+            assert success(r) and r.r == "x" * 500
+        finally:
+            await smpclient.disconnect()
+            server.close()
+
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+import asyncio
+import os
+from pathlib import Path
+from typing import Any, Callable
+
+import pytest
+from smp.error import MGMT_ERR
+from smp.file_management import FS_MGMT_ERR
+
+from smpmgr.emulator import Emulator, SMPError
+from smpmgr.file_management import download_with_progress_bar
+from tests.conftest import EmulatorCLI, ServeEmulator
+
+
+def download(serve_emulator: ServeEmulator, emulator: Emulator, file: str, path: Path) -> None:
+    async def main() -> None:
+        async with serve_emulator(emulator) as server, server.client() as smpclient:
+            await download_with_progress_bar(smpclient, file, path)
+
+    asyncio.run(main())
+
+
+def test_download_resumes_from_the_part_file(tmp_path: Path, serve_emulator: ServeEmulator) -> None:
+    data = os.urandom(10_000)
+    emulator = Emulator()
+    emulator.files["/lfs/log.txt"] = bytearray(data)
+    path = tmp_path / "log.txt"
+    (tmp_path / "log.txt.part").write_bytes(data[:8_000])
+
+    download(serve_emulator, emulator, "/lfs/log.txt", path)
+
+    assert path.read_bytes() == data
+    assert not (tmp_path / "log.txt.part").exists()
+    assert emulator.stats["smp"]["tx_bytes"] < len(data)  # only the rest was downloaded
+
+
+def test_download_restarts_if_the_file_has_changed(
+    tmp_path: Path, serve_emulator: ServeEmulator
+) -> None:
+    data = os.urandom(10_000)
+    emulator = Emulator()
+    emulator.files["/lfs/log.txt"] = bytearray(data)
+    path = tmp_path / "log.txt"
+    (tmp_path / "log.txt.part").write_bytes(os.urandom(8_000))  # e.g. of a rotated log
+
+    download(serve_emulator, emulator, "/lfs/log.txt", path)
+
+    assert path.read_bytes() == data
+
+
+class CRC32Emulator(Emulator):
+    """An emulator whose file system only supports the CRC32 checksum."""
+
+    def _file_hash(self, request: dict[str, Any]) -> dict[str, Any]:
+        if request.get("type", "sha256") != "crc32":
+            raise SMPError(FS_MGMT_ERR.CHECKSUM_HASH_NOT_FOUND, MGMT_ERR.ENOTSUP)
+        return super()._file_hash(request)
+
+
+@pytest.mark.parametrize("emulator_class", [Emulator, CRC32Emulator])
+def test_sync_uploads_only_missing_and_changed_files(
+    tmp_path: Path, emulator_cli: Callable[[Emulator], EmulatorCLI], emulator_class: type[Emulator]
+) -> None:
+    files = {name: os.urandom(3_000) for name in ("unchanged.bin", "changed.bin", "sub/new.bin")}
+    for name, data in files.items():
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).write_bytes(data)
+    emulator = emulator_class()
+    emulator.files["/lfs/unchanged.bin"] = bytearray(files["unchanged.bin"])
+    emulator.files["/lfs/changed.bin"] = bytearray(os.urandom(3_000))  # same length
+
+    assert emulator_cli(emulator)("file", "sync", str(tmp_path), "/lfs/") == 0
+
+    assert {name: bytes(data) for name, data in emulator.files.items()} == {
+        f"/lfs/{name}": data for name, data in files.items()
+    }
+    assert emulator.stats["flash"]["bytes_written"] == 6_000  # not unchanged.bin
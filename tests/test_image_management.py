@@ -0,0 +1,79 @@
+import asyncio
+import os
+from pathlib import Path
+from typing import Callable
+
+import pytest
+
+from smpmgr import image_management
+from smpmgr.emulator import Emulator
+from smpmgr.image_management import upload_with_retries
+from tests.conftest import EmulatorCLI, ServeEmulator
+from tests.test_preflight import make_image
+
+
+class DroppingEmulator(Emulator):
+    """Handles every request but drops the response to the `drop`th one."""
+
+    def __init__(self, drop: int) -> None:
+        super().__init__()
+        self.drop = drop
+        self.requests = 0
+
+    async def handle(self, frame: bytes) -> bytes | None:
+        response = await super().handle(frame)
+        self.requests += 1
+        return None if self.requests == self.drop else response
+
+
+def upload(
+    serve_emulator: ServeEmulator, emulator: Emulator, image: bytes, retries: int
+) -> list[tuple[int, bool]]:
+    async def main() -> list[tuple[int, bool]]:
+        async with serve_emulator(emulator) as server:
+            async with server.client(timeout_s=0.2) as smpclient:
+                return [r async for r in upload_with_retries(smpclient, image, retries=retries)]
+
+    return asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(image_management, "RETRY_BACKOFF_S", 0.01)
+
+
+def test_upload_resumes_after_a_dropped_response(serve_emulator: ServeEmulator) -> None:
+    image = os.urandom(20_000)
+    emulator = DroppingEmulator(drop=4)
+
+    offsets = upload(serve_emulator, emulator, image, retries=2)
+
+    resumed = [offset for offset, resumed in offsets if resumed]
+    assert len(resumed) == 1 and 0 < resumed[0] < len(image)  # from the device's offset
+    assert offsets[-1] == (len(image), False)
+    assert emulator.slots[1].data == image
+    assert emulator.stats["flash"]["bytes_written"] == len(image)  # nothing was written twice
+
+
+def test_upload_fails_without_retries(serve_emulator: ServeEmulator) -> None:
+    with pytest.raises(asyncio.TimeoutError):
+        upload(serve_emulator, DroppingEmulator(drop=4), os.urandom(20_000), retries=0)
+
+
+def test_upload_skips_an_identical_image(
+    tmp_path: Path, emulator_cli: Callable[[Emulator], EmulatorCLI]
+) -> None:
+    path = tmp_path / "app.bin"
+    path.write_bytes(make_image())
+    emulator = Emulator()
+    cli = emulator_cli(emulator)
+
+    assert cli("image", "upload", str(path)) == 0
+    assert emulator.slots[1].data == path.read_bytes()
+    written = emulator.stats["flash"]["bytes_written"]
+
+    assert cli("image", "upload", str(path)) == 0
+    assert emulator.stats["flash"]["bytes_written"] == written
+
+    assert cli("image", "upload", str(path), "--force") == 0
+    assert emulator.stats["flash"]["bytes_written"] == 2 * written
@@ -0,0 +1,45 @@
+import subprocess
+import sys
+
+import click
+import pytest
+import typer.main
+
+from smpmgr.main import COMMANDS, app
+
+
+def test_main_does_not_import_commands() -> None:
+    """Importing the CLI for --version or --help must not import the commands or transports."""
+
+    heavy = (
+        "smpclient",
+        "bleak",
+        "smpmgr.common",
+        "smpmgr.os_management",
+        "smpmgr.image_management",
+        "smpmgr.upgrade",
+    )
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, smpmgr.main; "
+            f"print(','.join(m for m in {heavy!r} if m in sys.modules))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == ""
+
+
+@pytest.mark.parametrize("name", list(COMMANDS))
+def test_lazy_command_help(name: str) -> None:
+    """The help listed for a lazy command matches the help of the command once imported."""
+
+    group = typer.main.get_command(app)
+    assert isinstance(group, click.Group)
+    command = group.get_command(click.Context(group), name)
+    assert command is not None
+    assert command.help is not None
+    assert command.help.strip().splitlines()[0] == COMMANDS[name].help
@@ -0,0 +1,98 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from smpmgr import metrics
+from smpmgr.common import Options, TransportDefinition
+from smpmgr.emulator import Emulator
+from smpmgr.metrics import DeviceStats, StatsPoller, render, serve, write_textfile
+from tests.conftest import ServeEmulator
+
+STATS = [
+    DeviceStats("ip:192.0.2.1", True, {"smp": {"rx_frames": 3}}),
+    DeviceStats("ip:192.0.2.2", False),
+]
+
+
+def test_render() -> None:
+    assert render(STATS).splitlines()[2:] == [
+        'smp_up{device="ip:192.0.2.1"} 1',
+        'smp_up{device="ip:192.0.2.2"} 0',
+        "# TYPE smp_stat counter",
+        "# HELP smp_stat Counters of the SMP server statistics groups.",
+        'smp_stat_total{device="ip:192.0.2.1",group="smp",counter="rx_frames"} 3',
+        "# EOF",
+    ]
+    prometheus = render(STATS, openmetrics=False).splitlines()
+    assert "# TYPE smp_stat_total counter" in prometheus
+    assert (
+        prometheus[-1] == 'smp_stat_total{device="ip:192.0.2.1",group="smp",counter="rx_frames"} 3'
+    )
+
+
+def test_write_textfile(tmp_path: Path) -> None:
+    path = tmp_path / "smp.prom"
+    write_textfile(path, "old")
+    write_textfile(path, "new")
+    assert path.read_text() == "new"
+    assert [p.name for p in tmp_path.iterdir()] == ["smp.prom"]
+
+
+def test_poller_reports_the_device_down_and_up_again(
+    monkeypatch: pytest.MonkeyPatch, serve_emulator: ServeEmulator
+) -> None:
+    emulator = Emulator()
+    options = Options(0.3, TransportDefinition(port=None, ble=None, ip="127.0.0.1"), None, None)
+
+    async def main() -> list[DeviceStats]:
+        poller = StatsPoller(options, ["smp", "os"], None)
+        try:
+            async with serve_emulator(emulator) as server:
+                monkeypatch.setattr(metrics, "get_transport", lambda options: server.transport())
+                up = await poller.poll()
+            down = await poller.poll()
+            async with serve_emulator(emulator) as server:
+                monkeypatch.setattr(metrics, "get_transport", lambda options: server.transport())
+                again = await poller.poll()
+            return [up, down, again]
+        finally:
+            await poller.close()
+
+    up, down, again = asyncio.run(main())
+    assert up.up and set(up.groups) == {"smp", "os"} and up.groups["os"] == {"resets": 0}
+    assert not down.up and down.groups == {}
+    assert again.up and again.groups["smp"]["rx_frames"] > up.groups["smp"]["rx_frames"]
+
+
+@pytest.mark.parametrize("openmetrics", [True, False])
+def test_http_server_negotiates_the_format(openmetrics: bool) -> None:
+    async def get(port: int, accept: str) -> tuple[str, str]:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(
+            f"GET /metrics HTTP/1.1\r\nHost: localhost\r\nAccept: {accept}\r\n\r\n".encode()
+        )
+        response = (await reader.read()).decode()
+        writer.close()
+        head, _, body = response.partition("\r\n\r\n")
+        return head, body
+
+    async def main() -> tuple[str, str]:
+        server = await serve("127.0.0.1", 0, lambda: STATS)
+        try:
+            accept = (
+                "application/openmetrics-text;version=1.0.0,text/plain;q=0.5"
+                if openmetrics
+                else "text/plain"
+            )
+            return await get(server.sockets[0].getsockname()[1], accept)
+        finally:
+            server.close()
+
+    head, body = asyncio.run(main())
+    assert head.startswith("HTTP/1.1 200 OK")
+    if openmetrics:
+        assert f"Content-Type: {metrics.OPENMETRICS_CONTENT_TYPE}" in head
+    else:
+        assert f"Content-Type: {metrics.PROMETHEUS_CONTENT_TYPE}" in head
+    assert body == render(STATS, openmetrics)
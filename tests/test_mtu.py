@@ -0,0 +1,106 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from smp import os_management as smpos
+from smpclient.transport import SMPTransport
+
+from smpmgr import mtu
+from smpmgr.common import Options, TransportDefinition
+
+OPTIONS = Options(
+    timeout=0.05,
+    transport=TransportDefinition(port=None, ble=None, ip="192.0.2.1"),
+    mtu="auto",
+    baudrate=None,
+)
+
+
+class FakeTransport(SMPTransport):
+    """Echoes frames no larger than `accepted` and drops the rest."""
+
+    def __init__(self, mtu: int, accepted: int = 0) -> None:
+        self._mtu = mtu
+        self._accepted = accepted
+        self._responses: asyncio.Queue[bytes] = asyncio.Queue()
+
+    async def connect(self, address: str, timeout_s: float) -> None:
+        pass
+
+    async def disconnect(self) -> None:
+        pass
+
+    async def send(self, data: bytes) -> None:
+        try:
+            request = smpos.EchoWriteRequest.loads(data)
+        except ValueError:  # e.g. the MCUMgrParametersRead of SMPClient.connect()
+            return
+        if len(data) <= self._accepted:
+            self._responses.put_nowait(
+                smpos.EchoWriteResponse(sequence=request.header.sequence, r=request.d).BYTES
+            )
+
+    async def receive(self) -> bytes:
+        return await self._responses.get()
+
+    async def send_and_receive(self, data: bytes) -> bytes:
+        await self.send(data)
+        return await self.receive()
+
+    @property
+    def mtu(self) -> int:
+        return self._mtu
+
+    @property
+    def max_unencoded_size(self) -> int:
+        return self._mtu
+
+
+def test_echo_request_fits() -> None:
+    for size in (20, 255, 256, 300, 1500, 8192):
+        request = mtu.echo_request(FakeTransport(size))
+        assert len(request.BYTES) <= size
+        assert len(request.BYTES) >= size - 2
+
+
+def test_probe_picks_largest_accepted(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(
+        mtu, "get_transport", lambda options: FakeTransport(options.mtu, accepted=1500)
+    )
+    assert asyncio.run(mtu.probe(OPTIONS)) == 1500
+
+
+def test_probe_fails_if_nothing_is_accepted(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(mtu, "get_transport", lambda options: FakeTransport(options.mtu))
+    assert asyncio.run(mtu.probe(OPTIONS)) is None
+
+
+def test_cache_per_device(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("SMPMGR_CACHE_DIR", str(tmp_path))
+    other = Options(
+        timeout=1.0,
+        transport=TransportDefinition(port="/dev/ttyACM0", ble=None, ip=None),
+        mtu="auto",
+        baudrate=None,
+    )
+
+    assert mtu.cached_mtu(OPTIONS) is None
+    mtu.save_mtu(OPTIONS, 1024)
+    mtu.save_mtu(other, 512)
+    assert mtu.cached_mtu(OPTIONS) == 1024
+    assert mtu.cached_mtu(other) == 512
+
+
+@pytest.mark.parametrize(
+    "command, probed",
+    [("os", True), ("terminal", False), ("discover", False), ("emulator", False)],
+)
+def test_auto_mtu_is_probed_only_for_smp_commands(
+    monkeypatch: pytest.MonkeyPatch, command: str, probed: bool
+) -> None:
+    from smpmgr.main import app
+
+    probes: list[Options] = []
+    monkeypatch.setattr(mtu, "ensure_mtu", probes.append)
+    app(["--ip", "192.0.2.1", "--mtu", "auto", command, "--help"], standalone_mode=False)
+    assert len(probes) == int(probed)
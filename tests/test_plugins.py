@@ -0,0 +1,45 @@
+import sys
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from smpmgr.plugins import get_plugins
+
+PLUGIN = '''
+import typer
+
+app = typer.Typer(name="{name}", help="{name} help")
+'''
+
+
+@pytest.fixture
+def plugin_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[Path]:
+    monkeypatch.setenv("SMPMGR_CACHE_DIR", str(tmp_path / "cache"))
+    path = tmp_path / "plugins"
+    path.mkdir()
+    (path / "lazy_test_group.py").write_text(PLUGIN.format(name="lazy"))
+    yield path
+    sys.modules.pop("lazy_test_group", None)
+
+
+def test_manifest_avoids_executing_plugins(plugin_dir: Path) -> None:
+    argv = ["smpmgr", f"--plugin-path={plugin_dir}", "--help"]
+    (plugin,) = get_plugins(argv)
+    assert argv == ["smpmgr", "--help"]
+    assert (plugin.name, plugin.help) == ("lazy", "lazy help")
+    assert "lazy_test_group" in sys.modules  # executed to build the manifest
+
+    del sys.modules["lazy_test_group"]
+    assert get_plugins([f"--plugin-path={plugin_dir}"]) == (plugin,)
+    assert "lazy_test_group" not in sys.modules  # read from the manifest
+
+
+def test_manifest_is_invalidated_by_changes(plugin_dir: Path) -> None:
+    get_plugins([f"--plugin-path={plugin_dir}"])
+    del sys.modules["lazy_test_group"]
+
+    (plugin_dir / "lazy_test_group.py").write_text(PLUGIN.format(name="renamed"))
+    (plugin,) = get_plugins([f"--plugin-path={plugin_dir}"])
+    assert plugin.name == "renamed"
+    assert "lazy_test_group" in sys.modules
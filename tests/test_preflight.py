@@ -0,0 +1,96 @@
+import hashlib
+import os
+import struct
+from pathlib import Path
+from typing import Sequence
+
+import pytest
+from smpclient.mcuboot import (
+    IMAGE_HEADER_STRUCT,
+    IMAGE_MAGIC,
+    IMAGE_TLV,
+    IMAGE_TLV_INFO_MAGIC,
+    IMAGE_TLV_PROT_INFO_MAGIC,
+)
+
+from smpmgr import preflight
+
+
+def tlv_area(magic: int, tlvs: Sequence[tuple[int, bytes]]) -> bytes:
+    body = b"".join(struct.pack("<BxH", t, len(v)) + v for t, v in tlvs)
+    return struct.pack("<HH", magic, 4 + len(body)) + body
+
+
+def make_image(size: int = 10_000, protected: bool = False, signature: bytes = b"") -> bytes:
+    body = os.urandom(size)
+    protected_tlvs = (
+        tlv_area(IMAGE_TLV_PROT_INFO_MAGIC, [(IMAGE_TLV.SEC_CNT, b"\x01\x00\x00\x00")])
+        if protected
+        else b""
+    )
+    header = IMAGE_HEADER_STRUCT.pack(IMAGE_MAGIC, 0, 32, len(protected_tlvs), size, 0, 1, 2, 3, 4)
+    sha = hashlib.sha256(header + body + protected_tlvs).digest()
+    tlvs = [(IMAGE_TLV.SHA256, sha)] + ([(IMAGE_TLV.ED25519, signature)] if signature else [])
+    return header + body + protected_tlvs + tlv_area(IMAGE_TLV_INFO_MAGIC, tlvs)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("SMPMGR_CACHE_DIR", str(tmp_path / "cache"))
+
+
+def test_valid_images(tmp_path: Path) -> None:
+    (tmp_path / "a.bin").write_bytes(make_image())
+    (tmp_path / "b.bin").write_bytes(make_image(protected=True, signature=os.urandom(64)))
+
+    a, b = preflight.check_files([tmp_path / "a.bin", tmp_path / "b.bin"])
+    assert a.ok and a.version == "1.2.3-build4" and a.hash_type == "SHA256"
+    assert a.hash == bytes.fromhex(a.computed_hash or "")
+    assert b.ok and b.signature == "ED25519"
+
+
+def test_invalid_images(tmp_path: Path) -> None:
+    image = make_image()
+    (tmp_path / "truncated.bin").write_bytes(image[:-10])
+    corrupted = bytearray(image)
+    corrupted[100] ^= 1
+    (tmp_path / "corrupted.bin").write_bytes(corrupted)
+    (tmp_path / "signature.bin").write_bytes(make_image(signature=os.urandom(10)))
+    (tmp_path / "other.bin").write_bytes(os.urandom(100))
+
+    checks = preflight.check_files(
+        [
+            tmp_path / name
+            for name in ("truncated.bin", "corrupted.bin", "signature.bin", "other.bin")
+        ]
+    )
+    assert [c.ok for c in checks] == [False] * 4
+    assert all(c.hash is None for c in checks)
+    assert "truncated" in (checks[0].error or "")
+    assert "does not match" in (checks[1].error or "")
+    assert "ED25519" in (checks[2].error or "")
+    assert "magic" in (checks[3].error or "")
+
+
+def test_results_are_cached_until_the_file_changes(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    path = tmp_path / "a.bin"
+    path.write_bytes(make_image())
+    checked: list[Path] = []
+    check_file = preflight.check_file
+
+    def counting_check_file(p: Path) -> preflight.ImageCheck:
+        checked.append(p)
+        return check_file(p)
+
+    monkeypatch.setattr(preflight, "check_file", counting_check_file)
+
+    first = preflight.check_files([path])
+    assert preflight.check_files([path]) == first
+    assert checked == [path]
+
+    path.write_bytes(make_image())
+    os.utime(path, ns=(0, 0))
+    assert preflight.check_files([path]) != first
+    assert checked == [path, path]
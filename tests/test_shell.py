@@ -0,0 +1,49 @@
+import asyncio
+import json
+from pathlib import Path
+from typing import Callable
+
+import pytest
+from smpclient.requests.shell_management import Execute
+
+from smpmgr.common import pipeline
+from smpmgr.emulator import Emulator, LinkModel
+from smpmgr.shell_management import read_commands, to_json
+from tests.conftest import EmulatorCLI, ServeEmulator
+
+
+def test_read_commands(tmp_path: Path) -> None:
+    path = tmp_path / "bringup.txt"
+    path.write_text("# bring-up\ngpio conf gpio@49000000 0 i\n\n  sensor get temp  \n")
+    assert read_commands(path) == ["gpio conf gpio@49000000 0 i", "sensor get temp"]
+
+
+def test_pipelined_outputs_are_in_order(serve_emulator: ServeEmulator) -> None:
+    commands = [f"echo {i}" for i in range(10)] + ["bogus"]
+
+    async def main() -> list[object]:
+        emulator = Emulator(LinkModel(latency_s=0.01))
+        async with serve_emulator(emulator) as server, server.client() as smpclient:
+            responses = await pipeline(
+                smpclient, [Execute(argv=c.split()) for c in commands], depth=4
+            )
+            return [to_json(c, r) for c, r in zip(commands, responses)]
+
+    results = asyncio.run(main())
+    assert results[:10] == [{"command": f"echo {i}", "ret": 0, "output": str(i)} for i in range(10)]
+    assert results[10] == {"command": "bogus", "ret": -8, "output": "bogus: command not found"}
+
+
+@pytest.mark.parametrize("commands", [["echo hi"], ["echo hi", "echo there"]])
+def test_json_output_is_only_json(
+    emulator_cli: Callable[[Emulator], EmulatorCLI],
+    capsys: pytest.CaptureFixture[str],
+    commands: list[str],
+) -> None:
+    cli = emulator_cli(Emulator())
+    capsys.readouterr()
+
+    assert cli("shell", "--json", *commands) == 0
+    assert json.loads(capsys.readouterr().out) == [
+        {"command": c, "ret": 0, "output": c.split()[1]} for c in commands
+    ]
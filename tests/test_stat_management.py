@@ -0,0 +1,24 @@
+from collections import deque
+
+from smpmgr.stat_management import Sample, _delta, _watch_table
+
+
+def test_delta() -> None:
+    assert _delta(15, 10) == 5
+    assert _delta(10, 10) == 0
+    assert _delta(3, 10) == 3  # the counter was reset, e.g. by a reboot, and counted to 3
+
+
+def test_watch_table_uses_the_bounded_history() -> None:
+    history: deque[Sample] = deque(maxlen=3)
+    for t, value in enumerate((0, 10, 20, 30, 5)):  # reset before the last sample
+        history.append(Sample(float(t), {"smp": {"rx_frames": value}}))
+    assert [s.time for s in history] == [2.0, 3.0, 4.0]
+
+    table = _watch_table(history, {"flash": "ENOENT"})
+    assert table.title == "Statistics (3 samples, 2s window)"
+    cells = [list(column.cells) for column in table.columns]
+    assert [row for row in zip(*cells)] == [
+        ("smp", "rx_frames", "5", "+5", "5.0", "2.5"),  # 5 since the reset, over the 2 s window
+        ("flash", "[red]error[/red]", "ENOENT", "", "", ""),
+    ]
@@ -0,0 +1,47 @@
+import asyncio
+import json
+import os
+from pathlib import Path
+
+from smpclient.requests.os_management import EchoWrite
+
+from smpmgr import timing
+from smpmgr.emulator import Emulator, LinkModel
+from tests.conftest import ServeEmulator
+
+
+def test_percentile() -> None:
+    values = [float(i) for i in range(1, 101)]
+    assert timing.percentile(values, 50) == 50.0
+    assert timing.percentile(values, 99) == 99.0
+    assert timing.percentile([3.0], 95) == 3.0
+
+
+def test_requests_and_upload_chunks_are_timed(
+    tmp_path: Path, serve_emulator: ServeEmulator
+) -> None:
+    image = os.urandom(4_000)
+
+    async def main() -> None:
+        async with serve_emulator(Emulator(LinkModel(latency_s=0.01))) as server:
+            async with server.client(timing.instrument(server.transport())) as smpclient:
+                for _ in range(3):
+                    await smpclient.request(EchoWrite(d="hello"))
+                async for _ in smpclient.upload(image):
+                    pass
+
+    timing.start()
+    asyncio.run(main())
+    path = tmp_path / "timing.json"
+    timing.report(path)
+    assert not timing.active()
+
+    summaries = {s["request"]: s for s in json.loads(path.read_text())}
+    echo = summaries["OS.ECHO write"]
+    assert echo["count"] == 3 and echo["lost"] == 0
+    assert echo["latency_s"]["p50"] >= 0.01
+    assert echo["latency_s"]["max"] >= echo["latency_s"]["p99"] >= echo["latency_s"]["p50"]
+    upload = summaries["IMAGE.UPLOAD write"]
+    assert upload["count"] > 1
+    assert upload["bytes_tx"] > len(image)
+    assert upload["throughput_Bps"] > 0
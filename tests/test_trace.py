@@ -0,0 +1,60 @@
+import asyncio
+import json
+import os
+from pathlib import Path
+
+from smpmgr import trace
+from smpmgr.emulator import Emulator
+from smpmgr.image_management import upload_with_retries
+from tests.conftest import ServeEmulator
+
+
+def test_one_track_per_task(tmp_path: Path) -> None:
+    async def device(name: str) -> None:
+        trace.track(name)
+        with trace.span("connect"):
+            await asyncio.sleep(0.01)
+        trace.instant("connection lost")
+
+    async def main() -> None:
+        await asyncio.gather(device("ip:192.0.2.1"), device("ip:192.0.2.2"))
+
+    trace.start()
+    with trace.span("ImageInfo.load_file"):
+        pass
+    asyncio.run(main())
+    path = tmp_path / "trace.json"
+    trace.stop(path)
+
+    events = json.loads(path.read_text())["traceEvents"]
+    tracks = {e["args"]["name"]: e["tid"] for e in events if e["ph"] == "M"}
+    assert set(tracks) == {trace.LOCAL_TRACK, "ip:192.0.2.1", "ip:192.0.2.2"}
+    spans = {(e["tid"], e["name"]): e for e in events if e["ph"] in ("X", "i")}
+    assert (tracks[trace.LOCAL_TRACK], "ImageInfo.load_file") in spans
+    for device_track in ("ip:192.0.2.1", "ip:192.0.2.2"):
+        assert spans[(tracks[device_track], "connect")]["dur"] >= 10_000
+        assert (tracks[device_track], "connection lost") in spans
+
+
+def test_upload_chunks_are_traced(tmp_path: Path, serve_emulator: ServeEmulator) -> None:
+    image = os.urandom(5_000)
+
+    async def main() -> None:
+        async with serve_emulator(Emulator()) as server, server.client() as smpclient:
+            offsets = [offset async for offset, _ in upload_with_retries(smpclient, image)]
+            assert offsets[-1] == len(image)
+
+    trace.start()
+    asyncio.run(main())
+    path = tmp_path / "trace.json"
+    trace.stop(path)
+
+    chunks = [e for e in json.loads(path.read_text())["traceEvents"] if e["name"] == "chunk"]
+    assert len(chunks) > 1
+    assert chunks[-1]["args"]["offset"] == len(image)
+    assert all(c["dur"] >= 0 for c in chunks)
+
+
+def test_nothing_is_recorded_without_a_trace() -> None:
+    with trace.span("connect"):
+        trace.instant("connection lost")
@@ -0,0 +1,100 @@
+import asyncio
+import hashlib
+import os
+import time
+from pathlib import Path
+from typing import Callable
+
+import pytest
+from smpclient.generics import success
+from smpclient.requests.image_management import ImageStatesWrite
+from smpclient.requests.os_management import ResetWrite
+
+import smpmgr.fleet
+from smpmgr.emulator import Emulator, LinkModel
+from smpmgr.image_management import check_booted, wait_for_boot
+from smpmgr.upgrade import UpgradeImage, parse_image
+from tests.conftest import EmulatorCLI, ServeEmulator
+from tests.test_preflight import make_image
+
+
+def test_parse_image() -> None:
+    assert parse_image("app.bin", 0) == UpgradeImage(Path("app.bin"), 0)
+    assert parse_image("net.bin:2", 0) == UpgradeImage(Path("net.bin"), 2)
+    assert parse_image("app.bin", 1) == UpgradeImage(Path("app.bin"), 1)
+    assert parse_image("C:\\fw\\app.bin", 0) == UpgradeImage(Path("C:\\fw\\app.bin"), 0)
+    assert parse_image("C:\\fw\\app.bin:3", 0) == UpgradeImage(Path("C:\\fw\\app.bin"), 3)
+
+
+def test_wait_for_boot_and_check_booted(serve_emulator: ServeEmulator) -> None:
+    image = os.urandom(2_000)
+    image_hash = hashlib.sha256(image).digest()
+
+    async def main() -> None:
+        async with serve_emulator(Emulator(LinkModel(reset_s=0.3))) as server:
+            async with server.client(timeout_s=0.2) as smpclient:
+                async for _ in smpclient.upload(image):
+                    pass
+                assert success(await smpclient.request(ImageStatesWrite(hash=image_hash)))
+                assert success(await smpclient.request(ResetWrite()))
+
+                boot = await wait_for_boot(smpclient, time.monotonic(), timeout_s=5.0)
+                assert boot.duration_s >= 0.3 and boot.polls >= 1
+                assert check_booted(boot.states, image_hash, confirm=False) is None
+                assert check_booted(boot.states, image_hash, confirm=True) is not None
+                assert check_booted(boot.states, bytes(32), confirm=False) is not None
+
+                assert success(await smpclient.request(ResetWrite()))
+                with pytest.raises(TimeoutError):
+                    await wait_for_boot(smpclient, time.monotonic(), timeout_s=0.2)
+
+    asyncio.run(main())
+
+
+def test_two_images_are_swapped_by_one_reset(
+    tmp_path: Path, emulator_cli: Callable[[Emulator], EmulatorCLI]
+) -> None:
+    emulator = Emulator(LinkModel(reset_s=0.1))
+    files = {"app.bin": make_image(), "net.bin": make_image()}
+    for name, data in files.items():
+        (tmp_path / name).write_bytes(data)
+
+    cli = emulator_cli(emulator)
+    assert (
+        cli(
+            "upgrade",
+            "--wait",
+            "--confirm",
+            f"{tmp_path / 'app.bin'}:0",
+            f"{tmp_path / 'net.bin'}:1",
+        )
+        == 0
+    )
+
+    assert emulator.stats["os"]["resets"] == 1
+    assert [(slot, image.data, image.active) for slot, image in sorted(emulator.slots.items())] == [
+        (0, files["app.bin"], True),
+        (1, b"smpmgr emulator", False),
+        (2, files["net.bin"], True),
+    ]
+
+
+@pytest.mark.parametrize("fleet", [False, True])
+def test_an_image_for_slot_0_is_swapped_in_with_wait(
+    tmp_path: Path,
+    emulator_cli: Callable[[Emulator], EmulatorCLI],
+    monkeypatch: pytest.MonkeyPatch,
+    fleet: bool,
+) -> None:
+    emulator = Emulator(LinkModel(reset_s=0.1))
+    image = make_image()
+    (tmp_path / "app.bin").write_bytes(image)
+
+    cli = emulator_cli(emulator)
+    monkeypatch.setattr(smpmgr.fleet, "get_transport", lambda options: cli.server.transport())
+    target = ["--target", "ip:127.0.0.1"] if fleet else []
+    assert cli("upgrade", "--wait", *target, str(tmp_path / "app.bin")) == 0
+
+    assert emulator.stats["os"]["resets"] == 1
+    assert emulator.slots[0].data == image and emulator.slots[0].active
+    assert not emulator.slots[0].confirmed  # marked for test, it reverts unless confirmed